@@ -25,14 +25,34 @@ except ImportError:
     import simplejson as json
 
 import cStringIO
+import errno
 import hashlib
+import hmac
+import select
 import sys
 import os
+import Queue
 import socket
+import threading
+import time
 import traceback
 
+from ivle.util import constant_time_equal
+
 SOCKETTIMEOUT = 60
 BLOCKSIZE = 1024
+# Size of each recv() made by the buffered version 2 framing.
+RECVSIZE = 65536
+
+# Version 2 frames are netstrings whose payload is this marker, the hex
+# HMAC-SHA256 digest of the content, and then the JSON content itself.
+# Version 1 payloads are always JSON objects, so they can never begin with
+# the marker.
+V2_MARKER = 'v2'
+V2_DIGEST_LENGTH = 64
+
+# Maximum number of idle persistent connections kept by chat().
+MAX_IDLE_CONNECTIONS = 32
 
 class Terminate(Exception):
     """Exception thrown when server is to be shut down. It will attempt to
@@ -47,11 +67,22 @@ class ProtocolError(Exception):
     """Exception thrown when client violates the the chat protocol"""
     pass
 
-def start_server(port, magic, daemon_mode, handler, initializer = None):
-    # Attempt to open the socket.
+class ConnectionClosed(ProtocolError):
+    """Exception thrown when the peer closes a connection between frames"""
+    pass
+
+def listen(port):
+    """Open a listening chat socket on the given port."""
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind(('', port))
-    s.listen(1)
+    s.listen(socket.SOMAXCONN)
+    return s
+
+def start_server(port, magic, daemon_mode, handler, initializer = None,
+                 workers=1, request_timeout=None):
+    # Attempt to open the socket.
+    s = listen(port)
 
     # Excellent! It worked. Let's turn ourself into a daemon,
     # then get on with the job of being a python interpreter.
@@ -89,45 +120,461 @@ def start_server(port, magic, daemon_mode, handler, initializer = None):
     if initializer:
         initializer()
 
-    while True:
-        (conn, addr) = s.accept()
-        conn.settimeout(SOCKETTIMEOUT)
+    try:
+        serve(s, magic, handler, workers, request_timeout)
+    except Terminate:
+        sys.exit(0)
+
+def serve(s, magic, handler, workers=1, request_timeout=None):
+    """Serve chat requests arriving on the listening socket s.
+
+    Connections are multiplexed with select(). By default requests are
+    handed to the handler one at a time; with more than one worker (or a
+    request_timeout) they are run by a pool of threads, as described in
+    _ThreadedServer. Version 1 connections are closed after their single
+    request; version 2 connections stay open until the client closes them
+    or they sit idle for SOCKETTIMEOUT seconds.
+
+    Raises Terminate, after all connections are closed, if the handler asks
+    for the server to shut down.
+    """
+    if workers > 1 or request_timeout:
+        _ThreadedServer(s, magic, handler, workers, request_timeout).serve()
+        return
+
+    conns = {}
+    try:
+        while True:
+            try:
+                ready, _, _ = select.select([s] + conns.keys(), [], [],
+                                            SOCKETTIMEOUT)
+            except select.error, e:
+                # Interrupted by a signal handler that returned normally.
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            now = time.time()
+            for r in ready:
+                if r is s:
+                    (conn, addr) = s.accept()
+                    conn.settimeout(SOCKETTIMEOUT)
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    conns[conn] = _ServerConnection(conn, now)
+                elif not conns[r].service(magic, handler, now):
+                    conns.pop(r).close()
+
+            # Reap connections that have been idle for too long.
+            for conn, sc in conns.items():
+                if now - sc.last_active > SOCKETTIMEOUT:
+                    conns.pop(conn).close()
+    finally:
+        for sc in conns.values():
+            sc.close()
+
+class _ServerConnection(object):
+    """Server side state of a single chat connection."""
+    def __init__(self, sok, now):
+        self.sok = sok
+        self.decoder = NetstringDecoder()
+        self.last_active = now
+        # Used by _ThreadedServer to time requests, and to make sure a
+        # request that has been timed out gets only the one response.
+        self.lock = threading.Lock()
+        self.request_started = None
+        self.abandoned = False
+
+    def read(self, now):
+        """Read the available data, returning any complete request frames,
+        or None if the connection should be closed.
+        """
+        self.last_active = now
+        try:
+            data = self.sok.recv(RECVSIZE)
+        except socket.error:
+            return None
+        if not data:
+            return None
+
+        try:
+            return self.decoder.feed(data)
+        except ProtocolError:
+            return None
+
+    def service(self, magic, handler, now):
+        """Read the available data and answer any complete requests.
+
+        Returns False if the connection should be closed.
+        """
+        frames = self.read(now)
+        if frames is None:
+            return False
+
+        for frame in frames:
+            if not handle_frame(self, frame, magic, handler):
+                return False
+        return True
+
+    def sendall(self, data):
+        """Send a response, unless the request has already been answered
+        by abandon()."""
+        self.lock.acquire()
+        try:
+            if self.abandoned:
+                raise socket.error(errno.EPIPE, 'Request timed out')
+            self.request_started = None
+            self.sok.sendall(data)
+        finally:
+            self.lock.release()
+
+    def finish(self):
+        """Mark the current request as finished. Returns True if it had
+        been abandoned."""
+        self.lock.acquire()
         try:
-            # Grab the input and try to decode
-            inp = recv_netstring(conn)
+            self.request_started = None
+            return self.abandoned
+        finally:
+            self.lock.release()
+
+    def abandon(self, now, timeout):
+        """If the current request has been running for more than timeout
+        seconds, answer it with an error and close the connection.
+
+        Returns True if the request was abandoned.
+        """
+        self.lock.acquire()
+        try:
+            if self.abandoned or self.request_started is None or \
+               now - self.request_started <= timeout:
+                return False
+            self.abandoned = True
+            try:
+                send_netstring(self.sok, json.dumps({
+                    "type": "Timeout",
+                    "value": "Request took more than %d seconds" % timeout,
+                    "traceback": "",
+                    }))
+            except socket.error:
+                pass
+        finally:
+            self.lock.release()
+        self.close()
+        return True
+
+    def close(self):
+        try:
+            self.sok.close()
+        except socket.error:
+            pass
+
+class _ThreadedServer(object):
+    """Serves chat requests on a pool of worker threads.
+
+    The calling thread multiplexes connections with select(), as serve()
+    does, but hands the requests that arrive on a connection to a worker.
+    The connection is left out of the select() until the worker has answered
+    them, so requests on one connection are still answered in order, while
+    requests on different connections run at the same time.
+
+    A request running for more than request_timeout seconds is answered
+    with a Timeout error and its connection closed. The handler can't be
+    stopped, so it is left to finish and a replacement worker started.
+
+    Once a handler raises Terminate, no new connections are accepted and
+    idle ones are closed. Terminate is raised again when the requests still
+    running have finished.
+    """
+    def __init__(self, s, magic, handler, workers, request_timeout):
+        self.s = s
+        self.magic = magic
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.request_timeout = request_timeout
+
+        self.jobs = Queue.Queue()
+        self.finished = Queue.Queue()
+        # Workers write to this pipe to wake up the select().
+        self.wake_r, self.wake_w = os.pipe()
+        self.conns = {}
+        self.busy = set()
+        self.terminate = None
+        self.abandoned = 0
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._work)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            sc, frames = job
+            keep_open = True
+            terminate = None
+            for frame in frames:
+                sc.request_started = time.time()
+                try:
+                    keep_open = handle_frame(sc, frame, self.magic,
+                                             self.handler)
+                except Terminate, t:
+                    keep_open = False
+                    terminate = t
+                if not keep_open:
+                    break
+            abandoned = sc.finish()
+            self.finished.put((sc, keep_open, terminate))
+            os.write(self.wake_w, 'x')
+            if abandoned:
+                # A replacement worker has already been started.
+                return
+
+    def _collect(self, now):
+        """Take back connections whose requests have been answered."""
+        while True:
             try:
-                content = decode(inp, magic)
-            except ProtocolError:
+                sc, keep_open, terminate = self.finished.get_nowait()
+            except Queue.Empty:
+                break
+            self.busy.discard(sc)
+            if terminate is not None and self.terminate is None:
+                self.terminate = terminate
+                for idle in self.conns.values():
+                    idle.close()
+                self.conns.clear()
+            if keep_open and not sc.abandoned and self.terminate is None:
+                sc.last_active = now
+                self.conns[sc.sok] = sc
+            else:
+                sc.close()
+
+    def _abandon_late_requests(self, now):
+        if not self.request_timeout:
+            return
+        for sc in list(self.busy):
+            if sc.abandon(now, self.request_timeout):
+                self.busy.discard(sc)
+                self.abandoned += 1
+                self._start_worker()
+
+    def serve(self):
+        for i in range(self.workers):
+            self._start_worker()
+        try:
+            while not (self.terminate and not self.busy):
+                watch = [self.wake_r] + self.conns.keys()
+                if self.terminate is None:
+                    watch.append(self.s)
+                timeout = SOCKETTIMEOUT
+                if self.request_timeout and self.busy:
+                    timeout = min(timeout, 1)
+                try:
+                    ready, _, _ = select.select(watch, [], [], timeout)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                now = time.time()
+                for r in ready:
+                    if r is self.s:
+                        (conn, addr) = self.s.accept()
+                        conn.settimeout(SOCKETTIMEOUT)
+                        conn.setsockopt(socket.IPPROTO_TCP,
+                                        socket.TCP_NODELAY, 1)
+                        self.conns[conn] = _ServerConnection(conn, now)
+                    elif r == self.wake_r:
+                        os.read(self.wake_r, 4096)
+                        self._collect(now)
+                    elif r in self.conns:
+                        sc = self.conns[r]
+                        frames = sc.read(now)
+                        if frames is None:
+                            del self.conns[r]
+                            sc.close()
+                        elif frames:
+                            del self.conns[r]
+                            self.busy.add(sc)
+                            self.jobs.put((sc, frames))
+
+                self._abandon_late_requests(now)
+
+                # Reap connections that have been idle for too long.
+                for conn, sc in self.conns.items():
+                    if now - sc.last_active > SOCKETTIMEOUT:
+                        self.conns.pop(conn).close()
+            raise self.terminate
+        finally:
+            for sc in self.conns.values():
+                sc.close()
+            self.conns.clear()
+            for i in range(self.workers):
+                self.jobs.put(None)
+            # Abandoned workers may yet write to the pipe, so leave it open
+            # if there are any.
+            if not self.abandoned:
+                os.close(self.wake_r)
+                os.close(self.wake_w)
+
+def handle_frame(conn, frame, magic, handler):
+    """Decode a request frame, pass it to the handler and send the response.
+
+    Returns True if the connection may carry more requests.
+    """
+    persistent = frame.startswith(V2_MARKER)
+    try:
+        content = decode(frame, magic)
+    except (ProtocolError, ValueError):
+        return False
+
+    try:
+        response = handler(content)
+    except Terminate, t:
+        # Try and send final response and then terminate
+        if t.final_response:
+            send_netstring(conn, json.dumps(t.final_response))
+        raise
+    except Exception:
+        # Make a JSON object full of exceptional goodness
+        tb_dump = cStringIO.StringIO()
+        e_type, e_val, e_tb = sys.exc_info()
+        traceback.print_tb(e_tb, file=tb_dump)
+        response = {
+            "type": e_type.__name__,
+            "value": str(e_val),
+            "traceback": tb_dump.getvalue()
+        }
+
+    try:
+        send_netstring(conn, json.dumps(response))
+    except socket.error:
+        return False
+    return persistent
+
+class ChatConnection(object):
+    """A persistent version 2 connection to a chat server.
+
+    Many requests may be made over the one connection. They may also be
+    pipelined: several requests sent before any of the responses are read.
+    """
+    def __init__(self, host, port, magic):
+        self.host = host
+        self.port = port
+        self.magic = magic
+        self.requests = 0
+
+        self.sok = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sok.connect((host, port))
+        self.sok.settimeout(SOCKETTIMEOUT)
+        self.sok.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = NetstringReader(self.sok)
+
+    @property
+    def key(self):
+        return (self.host, self.port, self.magic)
+
+    def send(self, msg):
+        """Send a request without waiting for the response."""
+        send_netstring(self.sok, encode_v2(msg, self.magic))
+        self.requests += 1
+
+    def recv(self):
+        """Read the next response (undecoded)."""
+        return self.reader.read()
+
+    def request(self, msg):
+        """Make a single request and return the undecoded response."""
+        self.send(msg)
+        return self.recv()
+
+    def pipeline(self, msgs):
+        """Send all of msgs, then return a list of their undecoded responses.
+        """
+        self.sok.sendall(''.join('%d:%s,' % (len(data), data) for data in
+                                 [encode_v2(msg, self.magic) for msg in msgs]))
+        self.requests += len(msgs)
+        return [self.recv() for msg in msgs]
+
+    def close(self):
+        try:
+            self.sok.close()
+        except socket.error:
+            pass
+
+_idle_connections = []
+_idle_lock = threading.Lock()
+
+def _checkout(host, port, magic):
+    """Get an idle connection to the server, or None."""
+    _idle_lock.acquire()
+    try:
+        for conn in reversed(_idle_connections):
+            if conn.key == (host, port, magic):
+                _idle_connections.remove(conn)
+                return conn
+    finally:
+        _idle_lock.release()
+    return None
+
+def _checkin(conn):
+    """Return a connection to the idle set, closing the oldest if full."""
+    _idle_lock.acquire()
+    try:
+        _idle_connections.append(conn)
+        if len(_idle_connections) > MAX_IDLE_CONNECTIONS:
+            _idle_connections.pop(0).close()
+    finally:
+        _idle_lock.release()
+
+def discard_connections(host, port, magic):
+    """Close any idle connections to the server (eg. when it is shut down).
+    """
+    _idle_lock.acquire()
+    try:
+        for conn in list(_idle_connections):
+            if conn.key == (host, port, magic):
+                _idle_connections.remove(conn)
                 conn.close()
-                continue
+    finally:
+        _idle_lock.release()
+
+def chat(host, port, msg, magic, decode = True, version = 2):
+    """Send a request to a chat server and return its response.
 
-            response = handler(content)
-
-            send_netstring(conn, json.dumps(response))
-
-            conn.close()
-
-        except Terminate, t:
-            # Try and send final response and then terminate
-            if t.final_response:
-                send_netstring(conn, json.dumps(t.final_response))
-            conn.close()
-            sys.exit(0)
-        except Exception:
-            # Make a JSON object full of exceptional goodness
-            tb_dump = cStringIO.StringIO()
-            e_type, e_val, e_tb = sys.exc_info()
-            traceback.print_tb(e_tb, file=tb_dump)
-            json_exc = {
-                "type": e_type.__name__,
-                "value": str(e_val),
-                "traceback": tb_dump.getvalue()
-            }
-            send_netstring(conn, json.dumps(json_exc))
-            conn.close()
-
-
-def chat(host, port, msg, magic, decode = True):
+    Version 2 requests reuse an idle persistent connection to the server if
+    one exists. Version 1 requests always use a new connection.
+    """
+    if version == 1:
+        inp = _chat_v1(host, port, msg, magic)
+    else:
+        conn = _checkout(host, port, magic)
+        try:
+            if conn is not None:
+                try:
+                    inp = conn.request(msg)
+                except (ConnectionClosed, socket.error), e:
+                    # The server may have closed the connection while it
+                    # was idle. Try again once, on a fresh connection.
+                    if isinstance(e, socket.error) and \
+                       e.args[0] not in (errno.EPIPE, errno.ECONNRESET):
+                        raise
+                    conn.close()
+                    conn = None
+            if conn is None:
+                conn = ChatConnection(host, port, magic)
+                inp = conn.request(msg)
+        except:
+            if conn is not None:
+                conn.close()
+            raise
+        _checkin(conn)
+
+    if decode:
+        return json.loads(inp)
+    else:
+        return inp
+
+def _chat_v1(host, port, msg, magic):
     sok = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sok.connect((host, port))
     sok.settimeout(SOCKETTIMEOUT)
@@ -135,14 +582,10 @@ def chat(host, port, msg, magic, decode = True):
     out = encode(msg, magic)
 
     send_netstring(sok, out)
-    inp = recv_netstring(sok)
+    inp = NetstringReader(sok).read()
 
     sok.close()
-
-    if decode:
-        return json.loads(inp)
-    else:
-        return inp
+    return inp
 
 def encode(message, magic):
     """Converts a message into a JSON serialisation and uses a magic
@@ -155,15 +598,37 @@ def encode(message, magic):
     env = {'digest':digest,'content':content}
     return json.dumps(env)
 
+def encode_v2(message, magic):
+    """Converts a message into a version 2 frame payload: the JSON
+    serialisation, prefixed with the marker and its HMAC-SHA256 digest.
+    """
+    content = json.dumps(message)
+    digest = hmac.new(magic, content, hashlib.sha256).hexdigest()
+    return V2_MARKER + digest + content
 
 def decode(message, magic):
     """Takes a message with an attached HMAC digest and validates the message.
+
+    Both version 1 and version 2 messages are accepted.
     """
+    if message.startswith(V2_MARKER):
+        start = len(V2_MARKER)
+        end = start + V2_DIGEST_LENGTH
+        digest = message[start:end]
+        content = message[end:]
+        expected = hmac.new(magic, content, hashlib.sha256).hexdigest()
+        if not constant_time_equal(digest, expected):
+            raise ProtocolError("HMAC digest is invalid")
+        return json.loads(content)
+
     msg = json.loads(message)
 
     # Check that the message is valid
     digest = hashlib.md5(msg['content'] + magic).hexdigest()
-    if msg['digest'] != digest:
+    given = msg['digest']
+    if isinstance(given, unicode):
+        given = given.encode('utf-8')
+    if not isinstance(given, str) or not constant_time_equal(given, digest):
         raise ProtocolError("HMAC digest is invalid")
     content = json.loads(msg['content'])
 
@@ -216,3 +681,65 @@ def recv_netstring(sok):
     buf.append(recv_data[:-1])
 
     return ''.join(buf)
+
+class NetstringDecoder(object):
+    """Incrementally splits a stream of bytes into Netstrings.
+    """
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, data):
+        """Add data to the buffer and return a list of completed Netstrings.
+
+        Throws a ProtocolError if the data violates the Netstring protocol.
+        """
+        self.buffer += data
+        netstrings = []
+        pos = 0
+        while True:
+            colon = self.buffer.find(':', pos, pos + 11)
+            if colon == -1:
+                # Limit the Netstring to less than 10^10 bytes (~1GB).
+                if len(self.buffer) - pos >= 11:
+                    raise ProtocolError(
+                        "Could not read Netstring size in first 9 bytes: "
+                        "'%s'" % self.buffer[pos:pos + 10])
+                break
+            try:
+                size = int(self.buffer[pos:colon])
+            except ValueError:
+                raise ProtocolError(
+                    "Could not decode Netstring size as int: '%s'" %
+                    self.buffer[pos:colon])
+            end = colon + 1 + size
+            if len(self.buffer) <= end:
+                break
+            if self.buffer[end] != ',':
+                raise ProtocolError("Netstring did not end with ','")
+            netstrings.append(self.buffer[colon + 1:end])
+            pos = end + 1
+        self.buffer = self.buffer[pos:]
+        return netstrings
+
+class NetstringReader(object):
+    """Reads Netstrings from a socket, in large buffered chunks.
+    """
+    def __init__(self, sok):
+        self.sok = sok
+        self.decoder = NetstringDecoder()
+        self.pending = []
+
+    def read(self):
+        """Return the next Netstring from the socket.
+
+        Throws ConnectionClosed if the peer closed the connection cleanly
+        before the Netstring began.
+        """
+        while not self.pending:
+            data = self.sok.recv(RECVSIZE)
+            if not data:
+                if self.decoder.buffer:
+                    raise ProtocolError("Connection closed in Netstring")
+                raise ConnectionClosed("Connection closed before Netstring")
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.pop(0)
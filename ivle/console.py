@@ -28,9 +28,14 @@ import os
 import random
 import socket
 import StringIO
+import threading
+import time
 import uuid
 
+import datetime
+
 from ivle import chat, interpret
+from ivle.database import ConsoleSession, User
 
 class ConsoleError(Exception):
     """ The console failed in some way. This is bad. """
@@ -149,6 +154,7 @@ class Console(object):
         # probability of failing to find a free port in t (e.g. 5) tries
         # is (k / N) ** t (e.g. 3.2*10e-9).
 
+        start = time.time()
         tries = 0
         error = None
         while tries < 5:
@@ -173,6 +179,8 @@ class Console(object):
         if tries == 5:
             raise ConsoleError('Unable to start console service: %s'%error)
 
+        self.spawn_time = time.time() - start
+
     def __chat(self, cmd, args):
         """ A wrapper around chat.chat to comunicate directly with the 
         console.
@@ -208,7 +216,8 @@ class Console(object):
         while 'output' in response or 'input' in response:
             if 'output' in response:
                 self.stdout.write(response['output'])
-                response = self.chat()
+                # Collect the rest of the output, or the final response.
+                response = self.__chat('poll', None)
             elif 'input' in response:
                 response = self.chat(self.stdin.readline())
 
@@ -282,6 +291,43 @@ class Console(object):
         return execute
 
 
+    def run_test(self, globs, code, function=None, args=(), kwargs={},
+                 stdin='', allowed_exceptions=(), want_globals=()):
+        """ Runs a test case in one round trip: sets the globals, executes
+        the code and then, if a function is named, calls it with the repr()
+        args and kwargs. Module level code only reads stdin if there is no
+        function; otherwise the function does.
+
+        Execution stops at an exception from the code, unless its name is in
+        allowed_exceptions. Returns a dictionary of the 'result', 'stdout',
+        'stderr', 'exception' (None, or a dictionary with the unpickled
+        exception as 'except' and its 'name' and 'phase'), whether the
+        function was found ('function_found') and the 'globals' named in
+        want_globals.
+        """
+        pickled_globs = {}
+        for g in globs:
+            pickled_globs[g] = cPickle.dumps(globs[g])
+
+        run = self.__handle_chat('runtest', {
+            'globals': pickled_globs,
+            'code': code,
+            'function': function,
+            'args': list(args),
+            'kwargs': kwargs,
+            'stdin': stdin,
+            'allowed_exceptions': list(allowed_exceptions),
+            'want_globals': list(want_globals)})
+
+        if 'error' in run:
+            raise ConsoleError("Could not run test: %s"%run['error'])
+        if run.get('exception') is not None:
+            run['exception']['except'] = \
+                cPickle.loads(str(run['exception']['except']))
+        for g in run['globals']:
+            run['globals'][g] = cPickle.loads(str(run['globals'][g]))
+        return run
+
     def set_vars(self, variables):
         """ Takes a dictionary of varibles to add to the console's global 
         space. These are evaluated in the local space so you can't use this to 
@@ -296,9 +342,47 @@ class Console(object):
         if set_vars.get('response') != 'okay':
             raise ConsoleError("Could not set variables")
 
+    def chdir(self, working_dir):
+        """ Changes the console's working directory """
+        chdir = self.__handle_chat('chdir', working_dir)
+        if 'okay' not in chdir:
+            raise ConsoleError("Could not change directory: %s"%str(chdir))
+        self.working_dir = working_dir
+
+    def reset(self, working_dir):
+        """ Returns the console to a clean state for reuse, in the given
+        working directory: empty globals and buffers, and the modules,
+        builtins and module search path it started with.
+
+        Raises ConsoleError if that state can't be restored (eg. code run
+        earlier has started threads), in which case the console shouldn't
+        be reused.
+        """
+        self.stdin.truncate(0)
+        self.stdout.truncate(0)
+        self.stderr.truncate(0)
+        reset = self.__handle_chat('reset', working_dir)
+        if 'okay' not in reset:
+            raise ConsoleError("Could not reset console: %s"%str(reset))
+        self.working_dir = working_dir
+
+    def status(self):
+        """ Returns a dictionary describing the console process: its pid,
+        resident set size in bytes ('rss'), seconds since it was last used
+        ('idle') and whether it is running code or waiting for input
+        ('busy'). Asking doesn't count as using the console.
+        """
+        status = self.__chat('status', None)
+        if 'status' not in status:
+            raise ConsoleError("Could not get console status: %s"%str(status))
+        return status['status']
+
     def close(self):
         """ Causes the console process to terminate """
-        return self.__chat('terminate', None)
+        try:
+            return self.__chat('terminate', None)
+        finally:
+            chat.discard_connections(self.host, self.port, self.magic)
     
 class ExistingConsole(Console):
     """ Provides a nice python interface to an existing console.
@@ -318,3 +402,379 @@ class ExistingConsole(Console):
     def restart():
         raise NotImplementedError('You can not restart an existing console')
         
+
+class _PoolUser(object):
+    """ The parts of a User needed to start a console, detached from the
+    request's store so they can be used from a background thread.
+    """
+    def __init__(self, user):
+        self.login = user.login
+        self.unixid = user.unixid
+
+class ConsolePool(object):
+    """ Keeps pre-started consoles ready for users who are likely to ask for
+    one soon, so that handing out a console doesn't wait for a new jailed
+    interpreter.
+
+    A console is started inside a particular user's jail, as that user, so
+    spares can't be shared between users. Instead each user who has recently
+    used a console (or started typing in one) gets up to pool_size spares,
+    which are started in the background.
+    """
+    def __init__(self, config, size=None, max_age=None):
+        self.config = config
+        if size is None:
+            size = config['console']['pool_size']
+        if max_age is None:
+            max_age = config['console']['pool_max_age']
+        self.size = size
+        self.max_age = max_age
+
+        # Maps (unixid, jail_path) to a list of (start time, console).
+        self.spares = {}
+        # Keys which have a spare being started in the background.
+        self.spawning = set()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.spawns = 0
+        self.spawn_failures = 0
+        self.spawn_time_total = 0.0
+        self.spawn_time_max = 0.0
+
+    def _home(self, user):
+        return os.path.join('/home', user.login)
+
+    def _spawn(self, user, jail_path):
+        """ Start a console in the user's home directory, and count it. """
+        try:
+            cons = Console(self.config, user, jail_path, self._home(user))
+        except Exception:
+            self.lock.acquire()
+            try:
+                self.spawn_failures += 1
+            finally:
+                self.lock.release()
+            raise
+        self.lock.acquire()
+        try:
+            self.spawns += 1
+            self.spawn_time_total += cons.spawn_time
+            self.spawn_time_max = max(self.spawn_time_max, cons.spawn_time)
+        finally:
+            self.lock.release()
+        return cons
+
+    def _fill(self, user, jail_path):
+        key = (user.unixid, jail_path)
+        try:
+            while True:
+                self.lock.acquire()
+                try:
+                    if len(self.spares.get(key, [])) >= self.size:
+                        return
+                finally:
+                    self.lock.release()
+                try:
+                    cons = self._spawn(user, jail_path)
+                except ConsoleError:
+                    return
+                self.lock.acquire()
+                try:
+                    self.spares.setdefault(key, []).append(
+                        (time.time(), cons))
+                finally:
+                    self.lock.release()
+        finally:
+            self.lock.acquire()
+            try:
+                self.spawning.discard(key)
+            finally:
+                self.lock.release()
+
+    def prewarm(self, user, jail_path):
+        """ Start spares for the user in the background, if they are short.
+        Returns immediately.
+        """
+        if self.size <= 0:
+            return
+        key = (user.unixid, jail_path)
+        self.lock.acquire()
+        try:
+            stale = self._sweep()
+            spawn = key not in self.spawning and \
+                    len(self.spares.get(key, [])) < self.size
+            if spawn:
+                self.spawning.add(key)
+        finally:
+            self.lock.release()
+        self._close_spares(stale)
+        if not spawn:
+            return
+
+        self._start_fill(_PoolUser(user), jail_path)
+
+    def _start_fill(self, user, jail_path):
+        thread = threading.Thread(target=self._fill, args=(user, jail_path))
+        thread.setDaemon(True)
+        thread.start()
+
+    def _sweep(self):
+        """ Remove stale spares of all users from the pool, returning them
+        to be closed once the lock is released. The lock must be held.
+        """
+        now = time.time()
+        stale = []
+        for key, spares in self.spares.items():
+            stale.extend(spare for (started, spare) in spares
+                         if now - started >= self.max_age)
+            spares[:] = [(started, spare) for (started, spare) in spares
+                         if now - started < self.max_age]
+            if not spares:
+                del self.spares[key]
+        return stale
+
+    def _close_spares(self, spares):
+        for spare in spares:
+            try:
+                spare.close()
+            except (ConsoleError, socket.error):
+                pass
+
+    def _take_spare(self, key):
+        """ Remove and return the newest fresh spare for key, or None.
+        Stale spares are closed.
+        """
+        stale = []
+        cons = None
+        self.lock.acquire()
+        try:
+            spares = self.spares.get(key, [])
+            while spares:
+                started, spare = spares.pop()
+                if time.time() - started < self.max_age:
+                    cons = spare
+                    break
+                stale.append(spare)
+        finally:
+            self.lock.release()
+        self._close_spares(stale)
+        return cons
+
+    def get(self, user, jail_path, working_dir):
+        """ Returns a console for the user in the given working directory,
+        using a spare if one is ready and starting a new one otherwise.
+        """
+        key = (user.unixid, jail_path)
+        cons = self._take_spare(key)
+        while cons is not None:
+            try:
+                cons.chdir(working_dir)
+                break
+            except (ConsoleError, ConsoleException, socket.error):
+                # The spare has died (eg. expired). Try the next.
+                cons = self._take_spare(key)
+
+        self.lock.acquire()
+        try:
+            if cons is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        finally:
+            self.lock.release()
+
+        if cons is None:
+            cons = self._spawn(user, jail_path)
+            if working_dir != self._home(user):
+                cons.chdir(working_dir)
+
+        self.prewarm(user, jail_path)
+        return cons
+
+    def stats(self):
+        """ Returns a dictionary of the pool's counters. """
+        self.lock.acquire()
+        try:
+            return {
+                'size': sum(len(s) for s in self.spares.values()),
+                'users': len(self.spares),
+                'spawning': len(self.spawning),
+                'hits': self.hits,
+                'misses': self.misses,
+                'spawns': self.spawns,
+                'spawn_failures': self.spawn_failures,
+                'spawn_time_mean': (self.spawns and
+                                    self.spawn_time_total / self.spawns),
+                'spawn_time_max': self.spawn_time_max,
+                }
+        finally:
+            self.lock.release()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(config):
+    """ Returns this process's ConsolePool, creating it if need be. """
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = ConsolePool(config)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+
+# The console session registry. Consoles handed out to users are recorded in
+# the database, so that every web application process (on every host) can
+# find a user's console, enforce the per-user cap, and reap idle consoles
+# when a host runs short of memory. Spare consoles in a ConsolePool are not
+# registered until they are handed out.
+
+def _session_console(session):
+    return ExistingConsole(session.host, session.port, session.magic)
+
+def _close_session(store, session):
+    """ Terminate a registered console and forget it. """
+    try:
+        _session_console(session).close()
+    except (ConsoleError, socket.error):
+        pass
+    store.remove(session)
+
+def _session_status(store, session):
+    """ Returns the status of a registered console, or None (forgetting the
+    session) if it has gone away.
+    """
+    try:
+        return _session_console(session).status()
+    except (ConsoleError, socket.error):
+        store.remove(session)
+        return None
+
+def register_console(store, config, user, cons):
+    """ Records a console that has been handed out to the user.
+
+    If the user would then have more than console.max_per_user live consoles,
+    their oldest consoles are terminated.
+    """
+    session = ConsoleSession(user=user, host=unicode(cons.host),
+                             port=cons.port, magic=unicode(cons.magic),
+                             started=datetime.datetime.now())
+    store.add(session)
+    # So the session has an ID to leave itself out with.
+    store.flush()
+
+    cap = config['console']['max_per_user']
+    others = store.find(ConsoleSession, ConsoleSession.user_id == user.id,
+                        ConsoleSession.id != session.id
+                        ).order_by(ConsoleSession.started)
+    live = [other for other in others
+            if _session_status(store, other) is not None]
+    for other in live[:max(0, len(live) - cap + 1)]:
+        _close_session(store, other)
+    return session
+
+def find_console(store, user, working_dir):
+    """ Returns one of the user's registered consoles on this host which is
+    not running anything, reset to a clean state in working_dir, or None if
+    there isn't one. Sessions whose consoles have gone away are forgotten.
+
+    The console may have been started for another page, so nothing that
+    page left in it (globals, modules, builtins) may be handed on; consoles
+    that can't be reset are left alone.
+    """
+    host = unicode(socket.gethostname())
+    sessions = store.find(ConsoleSession, ConsoleSession.user_id == user.id,
+                          ConsoleSession.host == host
+                          ).order_by(ConsoleSession.started)
+    for session in reversed(list(sessions)):
+        status = _session_status(store, session)
+        if status is None or status['busy']:
+            continue
+        cons = _session_console(session)
+        try:
+            cons.reset(working_dir)
+        except (ConsoleError, ConsoleException):
+            continue
+        except socket.error:
+            store.remove(session)
+            continue
+        return cons
+    return None
+
+def memory_available():
+    """ Returns the number of bytes of memory this host has available for
+    new processes, or None if it can't be determined.
+    """
+    try:
+        meminfo = {}
+        for line in open('/proc/meminfo'):
+            field, value = line.split(':', 1)
+            meminfo[field] = int(value.split()[0]) * 1024
+    except (IOError, ValueError):
+        return None
+    if 'MemAvailable' in meminfo:
+        return meminfo['MemAvailable']
+    return sum(meminfo.get(f, 0) for f in ('MemFree', 'Buffers', 'Cached'))
+
+def reap_consoles(store, config):
+    """ If this host is short of memory, terminates registered consoles on
+    it that have been idle for more than console.reap_idle seconds, rather
+    than waiting for python-console's own 15 minute expiry.
+
+    Returns the number of consoles reaped.
+    """
+    available = memory_available()
+    threshold = config['console']['reap_free_memory'] * 1024 * 1024
+    if available is None or available >= threshold:
+        return 0
+
+    reaped = 0
+    host = unicode(socket.gethostname())
+    for session in list(store.find(ConsoleSession,
+                                   ConsoleSession.host == host)):
+        status = _session_status(store, session)
+        if status is None:
+            continue
+        if not status['busy'] and \
+           status['idle'] >= config['console']['reap_idle']:
+            _close_session(store, session)
+            reaped += 1
+    return reaped
+
+def console_stats(store):
+    """ Returns counts and memory use of all registered consoles, by host
+    and by user. Sessions whose consoles have gone away are forgotten.
+    """
+    hosts = {}
+    users = {}
+    sessions = []
+    for (session, login) in list(store.find((ConsoleSession, User.login),
+                                 ConsoleSession.user_id == User.id
+                                 ).order_by(ConsoleSession.host,
+                                            ConsoleSession.port)):
+        status = _session_status(store, session)
+        if status is None:
+            continue
+        for (totals, key) in ((hosts, session.host), (users, login)):
+            total = totals.setdefault(key, {'consoles': 0, 'rss': 0})
+            total['consoles'] += 1
+            total['rss'] += status['rss']
+        sessions.append({'user': login,
+                         'host': session.host,
+                         'port': session.port,
+                         'started': session.started.isoformat(),
+                         'pid': status['pid'],
+                         'rss': status['rss'],
+                         'idle': status['idle'],
+                         'busy': status['busy'],
+                         })
+    return {'consoles': len(sessions),
+            'rss': sum(s['rss'] for s in sessions),
+            'hosts': hosts,
+            'users': users,
+            'sessions': sessions,
+            }
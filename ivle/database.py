@@ -26,24 +26,29 @@ It also provides miscellaneous utility functions for database interaction.
 import hashlib
 import datetime
 import os
+import threading
+import time
 import urlparse
 import urllib
 
 from storm.locals import create_database, Store, Int, Unicode, DateTime, \
-                         Reference, ReferenceSet, Bool, Storm, Desc
-from storm.expr import Select, Max
+                         Reference, ReferenceSet, Bool, Storm, Desc, RawStr
 from storm.exceptions import NotOneError, IntegrityError
+from storm.expr import LeftJoin
 
 from ivle.worksheet.rst import rst
 
-__all__ = ['get_store',
+__all__ = ['get_store', 'StorePool', 'StorePoolTimeout', 'get_store_pool',
             'User',
             'Subject', 'Semester', 'Offering', 'Enrolment',
             'ProjectSet', 'Project', 'ProjectGroup', 'ProjectGroupMembership',
             'Assessed', 'ProjectSubmission', 'ProjectExtension',
             'Exercise', 'Worksheet', 'WorksheetExercise',
-            'ExerciseSave', 'ExerciseAttempt',
-            'TestCase', 'TestSuite', 'TestSuiteVar'
+            'ExerciseSave', 'ExerciseAttempt', 'ExerciseProgress',
+            'ExerciseStatistics', 'ExerciseSuccessCount',
+            'TestCase', 'TestSuite', 'TestSuiteVar',
+            'ExerciseSolutionOutput',
+            'ConsoleSession',
         ]
 
 def _kwarg_init(self, **kwargs):
@@ -80,6 +85,187 @@ def get_store(config):
     """
     return Store(create_database(get_conn_string(config)))
 
+class StorePoolTimeout(Exception):
+    """No store was returned to the pool in time."""
+    pass
+
+class StorePool(object):
+    """Stores kept open between requests, so that each request doesn't
+    connect to the database (and start a new PostgreSQL backend) afresh.
+
+    At most `size` stores are handed out at once; check_out waits up to
+    `timeout` seconds for one to be checked back in. A store which has sat
+    idle for more than `check_interval` seconds is tested before it is handed
+    out, and replaced if its connection has died. Checking in a store rolls
+    back its transaction and drops its cached objects.
+
+    A size of 0 disables pooling: each check_out opens a new store, which
+    check_in closes.
+    """
+    def __init__(self, config, size=None, timeout=None, check_interval=None):
+        self.config = config
+        if size is None:
+            size = config['database']['pool_size']
+        if timeout is None:
+            timeout = config['database']['pool_timeout']
+        if check_interval is None:
+            check_interval = config['database']['pool_check_interval']
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+
+        # A list of (time checked in, store).
+        self.idle = []
+        self.checked_out = 0
+        self.cond = threading.Condition()
+
+        self.checkouts = 0
+        self.connects = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.check_failures = 0
+
+    def check_out(self):
+        """Return a store for the caller's sole use until check_in."""
+        if self.size <= 0:
+            return self._connect()
+
+        start = time.time()
+        self.cond.acquire()
+        try:
+            waited = False
+            while not self.idle and self.checked_out >= self.size:
+                remaining = start + self.timeout - time.time()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise StorePoolTimeout("No database connection was "
+                                           "available.")
+                waited = True
+                self.cond.wait(remaining)
+            if waited:
+                wait = time.time() - start
+                self.waits += 1
+                self.wait_time_total += wait
+                self.wait_time_max = max(self.wait_time_max, wait)
+            self.checkouts += 1
+            self.checked_out += 1
+            if self.idle:
+                checked_in, store = self.idle.pop()
+            else:
+                checked_in, store = None, None
+        finally:
+            self.cond.release()
+
+        try:
+            if store is not None and \
+               time.time() - checked_in > self.check_interval and \
+               not self._check(store):
+                store = None
+            if store is None:
+                store = self._connect()
+        except:
+            self._release()
+            raise
+        return store
+
+    def check_in(self, store):
+        """Return a store to the pool, abandoning its transaction."""
+        if self.size <= 0:
+            store.close()
+            return
+
+        try:
+            store.rollback()
+            store.reset()
+        except Exception:
+            self._close(store)
+            store = None
+
+        self.cond.acquire()
+        try:
+            if store is not None:
+                self.idle.append((time.time(), store))
+            self.checked_out -= 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def _connect(self):
+        store = get_store(self.config)
+        self.cond.acquire()
+        try:
+            self.connects += 1
+        finally:
+            self.cond.release()
+        return store
+
+    def _check(self, store):
+        """Return whether the store can still talk to the database, closing
+        it if not."""
+        try:
+            store.execute('SELECT 1')
+            store.rollback()
+            return True
+        except Exception:
+            self._close(store)
+            self.cond.acquire()
+            try:
+                self.check_failures += 1
+            finally:
+                self.cond.release()
+            return False
+
+    def _close(self, store):
+        try:
+            store.close()
+        except Exception:
+            pass
+
+    def _release(self):
+        """Give up a checked out slot without returning a store."""
+        self.cond.acquire()
+        try:
+            self.checked_out -= 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def stats(self):
+        """Return a dictionary of the pool's counters."""
+        self.cond.acquire()
+        try:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'waits': self.waits,
+                'wait_time_mean': (self.waits and
+                                   self.wait_time_total / self.waits),
+                'wait_time_max': self.wait_time_max,
+                'timeouts': self.timeouts,
+                'check_failures': self.check_failures,
+                }
+        finally:
+            self.cond.release()
+
+_store_pool = None
+_store_pool_lock = threading.Lock()
+
+def get_store_pool(config):
+    """Return this process's StorePool, creating it if need be."""
+    global _store_pool
+    _store_pool_lock.acquire()
+    try:
+        if _store_pool is None:
+            _store_pool = StorePool(config)
+        return _store_pool
+    finally:
+        _store_pool_lock.release()
+
 # USERS #
 
 class User(Storm):
@@ -142,6 +328,35 @@ class User(Storm):
     def valid(self):
         return self.state == 'enabled' and not self.account_expired
 
+    # ({offering ID: Enrolment}, set of project group IDs), once fetched by
+    # load_memberships.
+    _memberships = None
+
+    def load_memberships(self):
+        """Fetch all of the user's enrolments and group memberships in a
+        single query.
+
+        Permission checks then use these rather than querying for them
+        again, so they don't see later changes to the user's enrolments or
+        groups. This is meant for the user making a request, whose store is
+        reset at the end of it.
+        """
+        # Every pairing of an enrolment with a membership, but users have
+        # few of each.
+        enrolments = {}
+        groups = set()
+        for (enrolment, group_id) in Store.of(self).using(User,
+            LeftJoin(Enrolment, Enrolment.user_id == User.id),
+            LeftJoin(ProjectGroupMembership,
+                     ProjectGroupMembership.user_id == User.id)
+            ).find((Enrolment, ProjectGroupMembership.project_group_id),
+                   User.id == self.id):
+            if enrolment is not None:
+                enrolments[enrolment.offering_id] = enrolment
+            if group_id is not None:
+                groups.add(group_id)
+        self._memberships = (enrolments, groups)
+
     def _get_enrolments(self, justactive):
         return Store.of(self).find(Enrolment,
             Enrolment.user_id == self.id,
@@ -393,6 +608,7 @@ class Offering(Storm):
                 perms.add('view')
             if enrolment and enrolment.role == u'tutor':
                 perms.add('view_project_submissions')
+                perms.add('view_exercise_statistics')
                 # Site-specific policy on the role of tutors
                 if config['policy']['tutors_can_enrol_students']:
                     perms.add('enrol')
@@ -406,6 +622,7 @@ class Offering(Storm):
                 perms.add('admin_groups')
                 perms.add('edit_worksheets')
                 perms.add('view_worksheet_marks')
+                perms.add('view_exercise_statistics')
                 perms.add('edit')           # Can edit projects & details
                 perms.add('enrol')          # Can see enrolment screen at all
                 perms.add('enrol_student')  # Can enrol students
@@ -416,6 +633,8 @@ class Offering(Storm):
 
     def get_enrolment(self, user):
         """Find the user's enrolment in this offering."""
+        if user._memberships is not None:
+            return user._memberships[0].get(self.id)
         try:
             enrolment = self.enrolments.find(user=user).one()
         except NotOneError:
@@ -634,7 +853,8 @@ class Project(Storm):
         if not self.can_submit(principal, who, late=late):
             raise DeadlinePassed()
 
-        a = Assessed.get(Store.of(self), principal, self)
+        store = Store.of(self)
+        a = Assessed.get(store, principal, self)
         ps = ProjectSubmission()
         # Raise SubmissionError if the path is illegal
         ps.path = ProjectSubmission.test_and_normalise_path(path)
@@ -642,6 +862,10 @@ class Project(Storm):
         ps.date_submitted = datetime.datetime.now()
         ps.assessed = a
         ps.submitter = who
+        # The submission refers to the Assessed and vice versa, so it must
+        # be inserted before the Assessed can point at it.
+        store.flush()
+        a.latest_submission = ps
 
         return ps
 
@@ -653,12 +877,7 @@ class Project(Storm):
         """Return the latest submission for each Assessed."""
         return Store.of(self).find(ProjectSubmission,
             Assessed.project_id == self.id,
-            ProjectSubmission.assessed_id == Assessed.id,
-            ProjectSubmission.date_submitted == Select(
-                    Max(ProjectSubmission.date_submitted),
-                    ProjectSubmission.assessed_id == Assessed.id,
-                    tables=ProjectSubmission
-            )
+            ProjectSubmission.id == Assessed.latest_submission_id
         )
 
     def has_deadline_passed(self, user):
@@ -673,6 +892,13 @@ class Project(Storm):
             return
         return assessed.submissions
 
+    def get_latest_submission_for_principal(self, principal):
+        """Fetch the latest submission by a particular principal, or None."""
+        assessed = Assessed.get(Store.of(self), principal, self)
+        if assessed is None:
+            return None
+        return assessed.latest_submission
+
     @property
     def can_delete(self):
         """Can only delete if there are no submissions."""
@@ -752,7 +978,11 @@ class ProjectGroup(Storm):
         return urlparse.urljoin(url, path)
 
     def get_permissions(self, user, config):
-        if user.admin or user in self.members:
+        if user._memberships is not None:
+            member = self.id in user._memberships[1]
+        else:
+            member = user in self.members
+        if user.admin or member:
             return set(['submit_project'])
         else:
             return set()
@@ -795,6 +1025,10 @@ class Assessed(Storm):
     extensions = ReferenceSet(id, 'ProjectExtension.assessed_id')
     submissions = ReferenceSet(
         id, 'ProjectSubmission.assessed_id', order_by='date_submitted')
+    # The most recent of the submissions, kept up to date by Project.submit.
+    latest_submission_id = Int(name="latest_submissionid")
+    latest_submission = Reference(latest_submission_id,
+                                  'ProjectSubmission.id')
 
     def __repr__(self):
         return "<%s %r in %r>" % (type(self).__name__,
@@ -999,7 +1233,9 @@ class Exercise(Storm):
 
     test_suites = ReferenceSet(id, 
         'TestSuite.exercise_id',
-        order_by='seq_no')
+        order_by='TestSuite.seq_no')
+
+    solution_outputs = ReferenceSet(id, 'ExerciseSolutionOutput.exercise_id')
 
     __init__ = _kwarg_init
 
@@ -1015,16 +1251,21 @@ class Exercise(Storm):
         This is used to determine who may view the exercises list, and create
         new exercises."""
         perms = set()
-        roles = set()
+        if user is not None and not user.admin:
+            if user._memberships is not None:
+                roles = set(e.role for e in user._memberships[0].values()
+                            if e.active)
+            else:
+                roles = set(e.role for e in user.active_enrolments)
         if user is not None:
             if user.admin:
                 perms.add('edit')
                 perms.add('view')
-            elif u'lecturer' in set((e.role for e in user.active_enrolments)):
+            elif u'lecturer' in roles:
                 perms.add('edit')
                 perms.add('view')
             elif (config['policy']['tutors_can_edit_worksheets']
-            and u'tutor' in set((e.role for e in user.active_enrolments))):
+            and u'tutor' in roles):
                 # Site-specific policy on the role of tutors
                 perms.add('edit')
                 perms.add('view')
@@ -1051,12 +1292,21 @@ class Exercise(Storm):
         self.description = description
         self._cache_description_xhtml(invalidate=True)
 
+    def invalidate_solution_outputs(self):
+        """Forget the cached outputs of the solution for each test suite.
+
+        This must be done whenever the solution, include code or suites
+        change.
+        """
+        self.solution_outputs.find().remove()
+
     def delete(self):
         """Deletes the exercise, providing it has no associated worksheets."""
         if (self.worksheet_exercises.count() > 0):
             raise IntegrityError()
         for suite in self.test_suites:
             suite.delete()
+        self.invalidate_solution_outputs()
         Store.of(self).remove(self)
 
 class Worksheet(Storm):
@@ -1251,6 +1501,86 @@ class ExerciseAttempt(ExerciseSave):
     def get_permissions(self, user, config):
         return set(['view']) if user is self.user else set()
 
+class ExerciseProgress(Storm):
+    """A summary of a user's active attempts at a worksheet exercise.
+
+    This is derived entirely from ExerciseAttempt, and is kept up to date by
+    ivle.worksheet.utils whenever an attempt is recorded or (de)activated,
+    so that a user's status can be read without counting their attempts.
+
+     - first_success       - the date of the first complete attempt, or None.
+     - attempts_to_success - the number of attempts up to and including the
+                             first complete one, or None.
+     - total_attempts      - the number of attempts.
+     - last_attempt        - the date of the latest attempt, or None.
+    """
+
+    __storm_table__ = "exercise_progress"
+    __storm_primary__ = "ws_ex_id", "user_id"
+
+    ws_ex_id = Int(name="ws_ex_id")
+    worksheet_exercise = Reference(ws_ex_id, "WorksheetExercise.id")
+
+    user_id = Int(name="loginid")
+    user = Reference(user_id, User.id)
+    first_success = DateTime()
+    attempts_to_success = Int()
+    total_attempts = Int()
+    last_attempt = DateTime()
+
+    __init__ = _kwarg_init
+
+    def __repr__(self):
+        return "<%s %s by %s: %d attempts>" % (type(self).__name__,
+            self.worksheet_exercise.exercise.name, self.user.login,
+            self.total_attempts)
+
+class ExerciseStatistics(Storm):
+    """The number of users who have attempted and completed a worksheet
+    exercise.
+
+    Like ExerciseProgress, from which it is derived, this only considers
+    active attempts. It is kept up to date along with ExerciseProgress.
+    """
+
+    __storm_table__ = "exercise_statistics"
+
+    ws_ex_id = Int(primary=True, name="ws_ex_id")
+    worksheet_exercise = Reference(ws_ex_id, "WorksheetExercise.id")
+    attempted = Int()
+    completed = Int()
+
+    successes = ReferenceSet(ws_ex_id, "ExerciseSuccessCount.ws_ex_id",
+                             order_by="ExerciseSuccessCount.attempts")
+
+    __init__ = _kwarg_init
+
+    def __repr__(self):
+        return "<%s %s: %d of %d completed>" % (type(self).__name__,
+            self.worksheet_exercise.exercise.name, self.completed,
+            self.attempted)
+
+class ExerciseSuccessCount(Storm):
+    """The number of users who first completed a worksheet exercise on a
+    given attempt.
+
+    Together these form a histogram of ExerciseProgress.attempts_to_success.
+    """
+
+    __storm_table__ = "exercise_success_count"
+    __storm_primary__ = "ws_ex_id", "attempts"
+
+    ws_ex_id = Int(name="ws_ex_id")
+    worksheet_exercise = Reference(ws_ex_id, "WorksheetExercise.id")
+    attempts = Int()
+    users = Int()
+
+    __init__ = _kwarg_init
+
+    def __repr__(self):
+        return "<%s %s: %d on attempt %d>" % (type(self).__name__,
+            self.worksheet_exercise.exercise.name, self.users, self.attempts)
+
 class TestSuite(Storm):
     """A container to group an exercise's test cases.
 
@@ -1268,7 +1598,7 @@ class TestSuite(Storm):
     function = Unicode()
     stdin = Unicode()
     exercise = Reference(exercise_id, Exercise.id)
-    test_cases = ReferenceSet(suiteid, 'TestCase.suiteid', order_by="seq_no")
+    test_cases = ReferenceSet(suiteid, 'TestCase.suiteid', order_by="TestCase.seq_no")
     variables = ReferenceSet(suiteid, 'TestSuiteVar.suiteid', order_by='arg_no')
 
     def delete(self):
@@ -1347,3 +1677,45 @@ class TestCasePart(Storm):
 
     def delete(self):
         Store.of(self).remove(self)
+
+class ExerciseSolutionOutput(Storm):
+    """The cached output of an exercise's solution for one test suite.
+
+    The key is a hash of everything that affects the output, so outputs
+    never go stale, but they should be removed when the exercise changes
+    (see Exercise.invalidate_solution_outputs).
+    """
+
+    __storm_table__ = "exercise_solution_output"
+    __storm_primary__ = "exercise_id", "key"
+
+    exercise_id = Unicode(name="exerciseid")
+    key = Unicode()
+    data = RawStr()
+
+    exercise = Reference(exercise_id, Exercise.id)
+
+    __init__ = _kwarg_init
+
+class ConsoleSession(Storm):
+    """A python-console handed out to a user (see ivle.console).
+
+    Sessions are removed when their consoles are closed, or found to have
+    gone away.
+    """
+
+    __storm_table__ = "console_session"
+
+    id = Int(primary=True, name="sessionid")
+    user_id = Int(name="loginid")
+    user = Reference(user_id, User.id)
+    host = Unicode()
+    port = Int()
+    magic = Unicode()
+    started = DateTime()
+
+    __init__ = _kwarg_init
+
+    def __repr__(self):
+        return "<%s %s:%d for %r>" % (type(self).__name__, self.host,
+                                      self.port, self.user)
@@ -35,22 +35,24 @@ import cgi
 import traceback
 import logging
 import socket
+import threading
 import time
 
-import mod_python
-
 from ivle import util
 import ivle.config
 from ivle.dispatch.request import Request
 import ivle.webapp.security
 from ivle.webapp.base.plugins import ViewPlugin, PublicViewPlugin
-from ivle.webapp.base.xhtml import XHTMLView, XHTMLErrorView
+from ivle.webapp.base.xhtml import XHTMLView, XHTMLErrorView, load_templates
 from ivle.webapp.errors import BadRequest, HTTPError, NotFound, Unauthorized
 from ivle.webapp.publisher import Publisher, PublishingError
 from ivle.webapp import ApplicationRoot
 
 config = ivle.config.Config()
 
+if config['templates']['preload']:
+    load_templates(config)
+
 class ObjectPermissionCheckingPublisher(Publisher):
     """A specialised publisher that checks object permissions.
 
@@ -66,7 +68,7 @@ class ObjectPermissionCheckingPublisher(Publisher):
     def traversed_to_object(self, obj):
         """Check that the user has any permission at all over the object."""
         if (hasattr(obj, 'get_permissions') and
-            len(obj.get_permissions(self.root.user, config)) == 0):
+            len(self.root.req.get_permissions(obj)) == 0):
             # Indicate the forbidden object if this is an admin.
             if self.root.user and self.root.user.admin:
                 raise Unauthorized('Unauthorized: %s' % obj)
@@ -116,6 +118,24 @@ def generate_publisher(view_plugins, root, publicmode=False):
 
     return r
 
+# Route tables for normal and public mode, built once per process.
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+def get_publisher(root, publicmode=False):
+    """Return a publisher for the given root, binding it to the routes of all
+    view plugins. The routes are only registered the first time for each
+    mode; later requests share them.
+    """
+    _publishers_lock.acquire()
+    try:
+        if publicmode not in _publishers:
+            _publishers[publicmode] = generate_publisher(
+                config.plugin_index[ViewPlugin], None, publicmode=publicmode)
+        return _publishers[publicmode].bind(root)
+    finally:
+        _publishers_lock.release()
+
 def handler(apachereq):
     """Handles an HTTP request.
 
@@ -124,11 +144,18 @@ def handler(apachereq):
     @param apachereq: An Apache request object.
     """
     # Make the request object into an IVLE request which can be given to views
-    req = Request(apachereq, config)
+    return dispatch(Request(apachereq, config))
+
+def dispatch(req):
+    """Handles an IVLE request, from any web server.
 
-    req.publisher = generate_publisher(
-        config.plugin_index[ViewPlugin], ApplicationRoot(req),
-        publicmode=req.publicmode)
+    Returns req.OK, or an HTTP status code for the web server to send its own
+    error page for.
+
+    @param req: An IVLE request object.
+    """
+    req.publisher = get_publisher(ApplicationRoot(req),
+                                  publicmode=req.publicmode)
 
     try:
         obj, viewcls, subpath = req.publisher.resolve(req.uri.decode('utf-8'))
@@ -181,10 +208,10 @@ def handler(apachereq):
                 return req.OK
             else:
                 return e.code
-        except mod_python.apache.SERVER_RETURN:
-            # A mod_python-specific Apache error.
-            # XXX: We need to raise these because req.throw_error() uses them.
-            # Remove this after Google Code issue 117 is fixed.
+        except req.server_return:
+            # A web server-specific early return.
+            # XXX: We need to raise these because req.throw_redirect() uses
+            # them. Remove this after Google Code issue 117 is fixed.
             raise
         except Exception, e:
             # A non-HTTPError appeared. We have an unknown exception. Panic.
@@ -227,7 +254,7 @@ def handle_unknown_exception(req, exc_type, exc_value, exc_traceback):
     logfile = os.path.join(config['paths']['logs'], 'ivle_error.log')
     logfail = False
 
-    req.status = mod_python.apache.HTTP_INTERNAL_SERVER_ERROR
+    req.status = Request.HTTP_INTERNAL_SERVER_ERROR
 
     try:
         publicmode = req.publicmode
@@ -40,22 +40,215 @@ try:
         """
         def make_cookie(self):
             cookie = super(PotentiallySecureFileSession, self).make_cookie()
-            if (self._req.is_https() or
-                self._req.headers_in.get('X-Forwarded-Proto') == 'https'):
+            if wants_secure_cookie(self._req):
                 cookie.secure = True
             return cookie
 except ImportError:
     # This needs to be importable from outside Apache.
     pass
 
+import base64
+import Cookie
+import hashlib
+import hmac
+import os
 import os.path
+import sqlite3
+import threading
+import time
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
 import ivle.util
 import ivle.database
 from ivle.webapp.base.plugins import CookiePlugin
 import ivle.webapp.security
 
 
+def wants_secure_cookie(apache_req):
+    """Whether cookies set in response to a mod_python request should be
+    secure: if it came over HTTPS, or a proxy in front has set
+    X-Forwarded-Proto: https."""
+    return (apache_req.is_https() or
+            apache_req.headers_in.get('X-Forwarded-Proto') == 'https')
+
+SESSION_COOKIE = 'ivle_session'
+
+class Session(dict):
+    """Session state that concurrent requests can use without waiting for
+    each other.
+
+    This behaves like a mod_python Session, as far as IVLE uses one, but
+    lock() and unlock() do nothing. If two requests in a session both
+    save(), the last one wins.
+    """
+    def __init__(self, req, timeout):
+        self._req = req
+        self._timeout = timeout
+
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+    def save(self):
+        raise NotImplementedError()
+
+    def delete(self):
+        """Forget the stored session state."""
+        raise NotImplementedError()
+
+    def invalidate(self):
+        """End the session, removing its cookie and stored state."""
+        self.delete()
+        self.clear()
+        self._set_cookie('', expires=1)
+
+    def _get_cookie(self):
+        """Return the value of the session cookie sent by the client, or
+        None."""
+        try:
+            cookies = Cookie.SimpleCookie(self._req.headers_in.get('Cookie',
+                                                                   ''))
+        except Cookie.CookieError:
+            return None
+        if SESSION_COOKIE not in cookies:
+            return None
+        return cookies[SESSION_COOKIE].value
+
+    def _set_cookie(self, value, **attributes):
+        if self._req.is_https():
+            attributes['secure'] = True
+        self._req.add_cookie(SESSION_COOKIE, value, path='/', **attributes)
+
+
+class CookieSession(Session):
+    """Session state kept in the browser, in a cookie signed with a secret.
+
+    Reading the session touches neither the filesystem nor the database.
+    The state must be JSON serialisable, and small enough to fit in a cookie
+    (about 4KB). The state can't be revoked on the server: invalidate() only
+    tells the browser to forget it, and a copy remains valid until it
+    expires.
+    """
+    def __init__(self, req, timeout, secret):
+        super(CookieSession, self).__init__(req, timeout)
+        self._secret = secret
+        value = self._get_cookie()
+        if value is not None:
+            self.update(self._decode(value))
+
+    def _sign(self, data):
+        return hmac.new(self._secret, data, hashlib.sha256).hexdigest()
+
+    def _decode(self, value):
+        try:
+            (data, digest) = value.rsplit('.', 1)
+            (payload, expires) = data.split('.')
+            if not ivle.util.constant_time_equal(digest, self._sign(data)):
+                return {}
+            if int(expires) < time.time():
+                return {}
+            return json.loads(base64.urlsafe_b64decode(
+                payload + '=' * (-len(payload) % 4)))
+        except (ValueError, TypeError):
+            return {}
+
+    def save(self):
+        # The padding isn't allowed in an unquoted cookie value.
+        payload = base64.urlsafe_b64encode(json.dumps(dict(self))).rstrip('=')
+        data = '%s.%d' % (payload, time.time() + self._timeout)
+        self._set_cookie('%s.%s' % (data, self._sign(data)))
+
+    def delete(self):
+        # Nothing is stored on the server.
+        pass
+
+
+_sqlite_connections = threading.local()
+
+class SQLiteSession(Session):
+    """Session state kept in a SQLite database shared by the web server's
+    processes.
+
+    Only the session ID is kept in the browser. Reads don't block each
+    other, and writes only lock the database for the duration of the
+    statement.
+    """
+    def __init__(self, req, timeout, path):
+        super(SQLiteSession, self).__init__(req, timeout)
+        self._path = path
+        self._sid = None
+        sid = self._get_cookie()
+        if sid is not None:
+            row = self._connect().execute(
+                'SELECT data FROM session WHERE sid = ? AND expires > ?',
+                (sid, time.time())).fetchone()
+            if row is not None:
+                self._sid = sid
+                self.update(json.loads(row[0]))
+
+    def _connect(self):
+        """Return this thread's connection to the session database."""
+        connections = _sqlite_connections.__dict__
+        if self._path not in connections:
+            conn = sqlite3.connect(self._path, timeout=10)
+            # Where supported, readers don't wait for a writer.
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS session ('
+                         'sid TEXT PRIMARY KEY, data TEXT, expires REAL)')
+            conn.commit()
+            connections[self._path] = conn
+        return connections[self._path]
+
+    def save(self):
+        if self._sid is None:
+            self._sid = os.urandom(16).encode('hex')
+            self._set_cookie(self._sid)
+        conn = self._connect()
+        now = time.time()
+        conn.execute('DELETE FROM session WHERE expires <= ?', (now,))
+        conn.execute('INSERT OR REPLACE INTO session VALUES (?, ?, ?)',
+                     (self._sid, json.dumps(dict(self)), now + self._timeout))
+        conn.commit()
+
+    def delete(self):
+        if self._sid is not None:
+            conn = self._connect()
+            conn.execute('DELETE FROM session WHERE sid = ?', (self._sid,))
+            conn.commit()
+            self._sid = None
+
+
+def _cookie_session(req, timeout):
+    secret = req.config['session']['secret']
+    if secret is None:
+        # Configurations from before there was a secret get the old sessions.
+        return _file_session(req, timeout)
+    return CookieSession(req, timeout, secret)
+
+def _sqlite_session(req, timeout):
+    path = req.config['session']['path']
+    if path is None:
+        path = os.path.join(req.config['paths']['data'], 'sessions',
+                            'sessions.db')
+    return SQLiteSession(req, timeout, path)
+
+def _file_session(req, timeout):
+    return PotentiallySecureFileSession(req.apache_req, timeout=timeout)
+
+# Maps the names of session backends to functions taking a Request and a
+# timeout and returning its session.
+SESSION_BACKENDS = {
+    'cookie': _cookie_session,
+    'sqlite': _sqlite_session,
+    'file': _file_session,
+    }
+
+
 class Request:
     """An IVLE request object. This is presented to the IVLE apps as a way of
     interacting with the web server and the dispatcher.
@@ -156,6 +349,8 @@ class Request:
         # and public FQDN) in the output HTML. In that case, set this to 0.
         self.write_javascript_settings = True
         self.got_common_vars = False
+        # Maps id(obj) to (obj, the user's permissions over obj).
+        self._permissions = {}
 
     def __del__(self):
         self.cleanup()
@@ -163,7 +358,7 @@ class Request:
     def cleanup(self):
         """Cleanup."""
         if self._store is not None:
-            self._store.close()
+            ivle.database.get_store_pool(self.config).check_in(self._store)
             self._store = None
 
     def commit(self):
@@ -171,7 +366,7 @@ class Request:
         if self._store is not None:
             self._store.commit()
 
-    def __writeheaders(self):
+    def _write_headers(self):
         """Writes out the HTTP and HTML headers before any real data is
         written."""
         self.headers_written = True
@@ -189,14 +384,14 @@ class Request:
         """Writes out the HTTP and HTML headers if they haven't already been
         written."""
         if not self.headers_written:
-            self.__writeheaders()
+            self._write_headers()
 
     def write(self, string, flush=1):
         """Writes string directly to the client, then flushes the buffer,
         unless flush is 0."""
 
         if not self.headers_written:
-            self.__writeheaders()
+            self._write_headers()
         if isinstance(string, unicode):
             # Encode unicode strings as UTF-8
             # (Otherwise cannot handle being written to a bytestream)
@@ -212,14 +407,11 @@ class Request:
         if hasattr(self, 'session'):
             self.session.invalidate()
             self.session.delete()
-            # Invalidates all IVLE cookies
-            all_cookies = mod_python.Cookie.get_cookies(self)
 
-            # Create cookies for plugins that might request them.
+            # Invalidates all IVLE cookies, including those plugins set.
             for plugin in self.config.plugin_index[CookiePlugin]:
                 for cookie in plugin.cookies:
-                    self.add_cookie(mod_python.Cookie.Cookie(cookie, '',
-                                                    expires=1, path='/'))
+                    self.add_cookie(cookie, '', expires=1, path='/')
         self.throw_redirect(self.make_path(''))
 
 
@@ -230,7 +422,7 @@ class Request:
     def sendfile(self, filename):
         """Sends the named file directly to the client."""
         if not self.headers_written:
-            self.__writeheaders()
+            self._write_headers()
         self.apache_req.sendfile(filename)
 
     def read(self, len=None):
@@ -260,6 +452,17 @@ class Request:
         else:
             mod_python.Cookie.add_cookie(self.apache_req, cookie, value, **attributes)
 
+    def is_https(self):
+        """Whether the client made the request over HTTPS, directly or to a
+        proxy in front that has set X-Forwarded-Proto: https."""
+        return wants_secure_cookie(self.apache_req)
+
+    @property
+    def server_return(self):
+        """The exception raised to end the request early, which the
+        dispatcher leaves for the web server. throw_redirect raises it."""
+        return mod_python.apache.SERVER_RETURN
+
     def make_path(self, path):
         """Prepend the IVLE URL prefix to the given path.
 
@@ -270,17 +473,17 @@ class Request:
         return os.path.join(self.config['urls']['root'], path)
 
     def get_session(self):
-        """Returns a mod_python Session object for this request.
-        Note that this is dependent on mod_python and may need to change
-        interface if porting away from mod_python.
+        """Returns the Session object for this request, from the backend
+        chosen in the configuration.
 
         IMPORTANT: Call unlock() on the session as soon as you are done with
-                   it! If you don't, all other requests will block!
+                   it! With the file backend, all other requests in the
+                   session will block until you do.
         """
-        # Cache the session object and set the timeout to 24 hours.
+        # Cache the session object.
         if not hasattr(self, 'session'):
-            self.session = PotentiallySecureFileSession(
-                self.apache_req, timeout = 60 * 60 * 24)
+            self.session = SESSION_BACKENDS[self.config['session']['backend']](
+                self, self.config['session']['timeout'])
         return self.session
 
     def get_fieldstorage(self):
@@ -303,10 +506,10 @@ class Request:
 
     @property
     def store(self):
-        # Open a database connection and transaction, keep it around for users
-        # of the Request object to use.
+        # Take a database connection from the pool and keep it around for
+        # users of the Request object to use. cleanup() returns it.
         if self._store is None:
-            self._store = ivle.database.get_store(self.config)
+            self._store = ivle.database.get_store_pool(self.config).check_out()
         return self._store
 
     @property
@@ -322,8 +525,24 @@ class Request:
             else:
                 temp_user = ivle.webapp.security.get_user_details(self)
                 if temp_user and temp_user.valid:
+                    # Permission checks will all need these.
+                    temp_user.load_memberships()
                     self._user = temp_user
                 else:
                     self._user = None
             return self._user
 
+    def get_permissions(self, obj):
+        """Return the set of permissions the request's user holds over an
+        object.
+
+        These are worked out at most once per object in each request, so
+        must not be modified.
+        """
+        try:
+            return self._permissions[id(obj)][1]
+        except KeyError:
+            perms = obj.get_permissions(self.user, self.config)
+            # Keep the object, so that its id isn't reused.
+            self._permissions[id(obj)] = (obj, perms)
+            return perms
@@ -0,0 +1,328 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+IVLE WSGI Application
+
+Runs the IVLE dispatcher under any WSGI server, instead of mod_python. Point
+the server at ivle.dispatch.wsgi:application. For example, with mod_wsgi:
+
+    WSGIDaemonProcess ivle processes=4 threads=8
+    WSGIScriptAlias / /path/to/ivle/dispatch/wsgi.py
+
+Each process keeps up to [database] pool_size database connections, so that
+should be at least the number of threads per process.
+
+Responses are buffered until the view has finished, except for files sent
+with sendfile. The file session backend needs mod_python, so [session]
+backend must be "cookie" (with a secret) or "sqlite".
+"""
+
+import cgi
+import Cookie
+import email.utils
+import httplib
+import urllib
+
+import ivle.dispatch
+import ivle.util
+from ivle.config import ConfigError
+from ivle.dispatch.request import Request
+
+__all__ = ['WSGIRequest', 'application']
+
+class ServerReturn(Exception):
+    """Ends a WSGIRequest early, with the response so far."""
+    pass
+
+class Headers(object):
+    """A table of HTTP headers, like mod_python's: names are case
+    insensitive, and may appear more than once."""
+    def __init__(self, items=()):
+        self._items = []
+        for (name, value) in items:
+            self.add(name, value)
+
+    def add(self, name, value):
+        self._items.append((name, value))
+
+    def get(self, name, default=None):
+        name = name.lower()
+        for (n, v) in self._items:
+            if n.lower() == name:
+                return v
+        return default
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        del self[name]
+        self.add(name, value)
+
+    def __delitem__(self, name):
+        name = name.lower()
+        self._items = [(n, v) for (n, v) in self._items if n.lower() != name]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    has_key = __contains__
+
+    def items(self):
+        return list(self._items)
+
+class StringField(str):
+    """A form field's value, like mod_python's StringField."""
+    @property
+    def value(self):
+        return str(self)
+
+class FieldStorage(object):
+    """The fields of a form submitted with a request, with the interface of
+    mod_python's FieldStorage.
+
+    Values are StringFields, except for uploaded files, which have file,
+    filename and value attributes.
+    """
+    def __init__(self, environ, fp):
+        storage = cgi.FieldStorage(fp=fp, environ=environ,
+                                   keep_blank_values=True)
+        self._fields = {}
+        self._keys = []
+        for item in storage.list or []:
+            name = item.name
+            if item.filename is None:
+                item = StringField(item.value)
+            if name not in self._fields:
+                self._keys.append(name)
+            self._fields.setdefault(name, []).append(item)
+
+    def keys(self):
+        return list(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    has_key = __contains__
+
+    def __getitem__(self, name):
+        values = self._fields[name]
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def getfirst(self, name, default=None):
+        try:
+            return self._fields[name][0]
+        except KeyError:
+            return default
+
+    def getlist(self, name):
+        return list(self._fields.get(name, []))
+
+class WSGIRequest(Request):
+    """An IVLE request object built from a WSGI environment.
+
+    This has the same interface as the mod_python-based Request, so views
+    can't tell the difference. The response is collected by the object;
+    status_line, get_headers and iter_body give it to the WSGI server.
+    """
+    server_return = ServerReturn
+
+    # Size of the blocks files are sent in, without a file wrapper.
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, environ, config):
+        """Create an IVLE request from a WSGI environment.
+
+        @param environ: A WSGI environment.
+        @param config: An IVLE configuration.
+        """
+        self.apache_req = None
+        self.environ = environ
+        self.config = config
+        self.headers_written = False
+
+        self.headers_in = Headers()
+        for (key, value) in environ.items():
+            if key.startswith('HTTP_'):
+                self.headers_in.add(key[5:].replace('_', '-').title(), value)
+            elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH') and value:
+                self.headers_in.add(key.replace('_', '-').title(), value)
+        self.headers_out = Headers()
+
+        host = environ.get('HTTP_HOST') or environ['SERVER_NAME']
+        self.hostname = host.split(':')[0]
+        self.publicmode = self.hostname == config['urls']['public_host']
+
+        self.method = environ['REQUEST_METHOD']
+        self.uri = environ.get('SCRIPT_NAME', '') + \
+                   environ.get('PATH_INFO', '')
+        self.unparsed_uri = environ.get('REQUEST_URI')
+        if self.unparsed_uri is None:
+            self.unparsed_uri = urllib.quote(self.uri)
+            if environ.get('QUERY_STRING'):
+                self.unparsed_uri += '?' + environ['QUERY_STRING']
+        (self.app, self.path) = (ivle.util.split_path(self.uri))
+
+        # Default values for the output members
+        self.status = Request.HTTP_OK
+        self.content_type = None
+        self.content_length = None
+        self.location = None
+        self.write_javascript_settings = True
+        self.got_common_vars = False
+        self._permissions = {}
+
+        try:
+            self._unread = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            self._unread = 0
+        self.body = []
+
+    def _write_headers(self):
+        self.headers_written = True
+        if self.content_type is not None:
+            self.headers_out['Content-Type'] = self.content_type
+        if self.content_length:
+            self.headers_out['Content-Length'] = str(self.content_length)
+        if self.location is not None:
+            self.headers_out['Location'] = self.location
+
+    def write(self, string, flush=1):
+        if not self.headers_written:
+            self._write_headers()
+        if isinstance(string, unicode):
+            string = string.encode('utf8')
+        self.body.append(string)
+
+    def flush(self):
+        pass
+
+    def sendfile(self, filename):
+        if not self.headers_written:
+            self._write_headers()
+        self.body.append(open(filename, 'rb'))
+
+    def read(self, size=None):
+        # Never read past the body, or a server with keep-alive may block.
+        if size is None or size > self._unread:
+            size = self._unread
+        data = self.environ['wsgi.input'].read(size)
+        # The input may return less than asked for.
+        self._unread -= len(data)
+        return data
+
+    def throw_redirect(self, location):
+        self.status = Request.HTTP_MOVED_TEMPORARILY
+        self.location = location.encode('ascii')
+        self.content_type = 'text/html'
+        self.write('<p>The document has moved <a href="%s">here</a></p>\n'
+                   % cgi.escape(self.location, True))
+        raise ServerReturn()
+
+    def add_cookie(self, cookie, value=None, **attributes):
+        cookies = Cookie.SimpleCookie()
+        cookies[cookie] = value or ''
+        for (name, attr) in attributes.items():
+            if name == 'expires' and isinstance(attr, (int, long, float)):
+                # Like mod_python, a number is a time, not an age.
+                attr = email.utils.formatdate(attr, usegmt=True)
+            cookies[cookie][name] = attr
+        self.headers_out.add('Set-Cookie', cookies[cookie].OutputString())
+
+    def is_https(self):
+        return (self.environ.get('wsgi.url_scheme') == 'https' or
+                self.headers_in.get('X-Forwarded-Proto') == 'https')
+
+    def get_fieldstorage(self):
+        if not hasattr(self, 'fields'):
+            self.fields = FieldStorage(self.environ,
+                                       self.environ['wsgi.input'])
+        return self.fields
+
+    def get_cgi_environ(self):
+        self.got_common_vars = True
+        return dict((key, value) for (key, value) in self.environ.items()
+                    if isinstance(value, str) and not key.startswith('wsgi.'))
+
+    def status_line(self, code=None):
+        """Return the WSGI status line of the response."""
+        code = code or self.status
+        return '%d %s' % (code, httplib.responses.get(code, ''))
+
+    def get_headers(self):
+        """Return the response headers, as a list of pairs."""
+        if not self.headers_written:
+            self._write_headers()
+        return [(str(name), str(value))
+                for (name, value) in self.headers_out.items()]
+
+    def iter_body(self):
+        """Yield the response body in pieces."""
+        for part in self.body:
+            if isinstance(part, str):
+                yield part
+                continue
+            try:
+                while True:
+                    block = part.read(self.BLOCK_SIZE)
+                    if not block:
+                        break
+                    yield block
+            finally:
+                part.close()
+
+
+def application(environ, start_response):
+    """The WSGI application running IVLE."""
+    config = ivle.dispatch.config
+    if config['session']['backend'] == 'file' or (
+       config['session']['backend'] == 'cookie' and
+       config['session']['secret'] is None):
+        raise ConfigError("The file session backend needs mod_python.")
+
+    req = WSGIRequest(environ, config)
+    try:
+        code = ivle.dispatch.dispatch(req)
+    except ServerReturn:
+        code = req.OK
+
+    if code != req.OK and not req.body:
+        # The view left the error page to the web server.
+        start_response(req.status_line(code),
+                       [('Content-Type', 'text/plain')])
+        return [httplib.responses.get(code, str(code))]
+
+    start_response(req.status_line(), req.get_headers())
+    if (len(req.body) == 1 and not isinstance(req.body[0], str) and
+        'wsgi.file_wrapper' in environ):
+        return environ['wsgi.file_wrapper'](req.body[0], req.BLOCK_SIZE)
+    return req.iter_body()
@@ -26,12 +26,14 @@ import uuid
 import warnings
 import logging
 import subprocess
+import tempfile
 
-from storm.expr import Select, Max
+from storm.expr import Max, Count
 
 import ivle.config
 from ivle.database import (User, ProjectGroup, Assessed, ProjectSubmission,
-        Project, ProjectSet, Offering, Enrolment, Subject, Semester)
+        Project, ProjectSet, Offering, Enrolment, Subject, Semester,
+        ProjectGroupMembership)
 
 def chown_to_webserver(filename):
     """chown a directory and its contents to the web server.
@@ -54,143 +56,217 @@ def make_svn_repo(path, throw_on_error=True):
 
     chown_to_webserver(path)
 
-def rebuild_svn_config(store, config):
-    """Build the complete SVN configuration file.
+# Bump this when the format of the authz fragments changes, so that
+# fragments already on disk are regenerated.
+AUTHZ_FRAGMENT_VERSION = 1
 
-    @param config: An ivle.config.Config object.
+def _authz_stamp(*inputs):
+    """Return a stamp identifying the inputs of an authz fragment."""
+    return hashlib.sha1(repr((AUTHZ_FRAGMENT_VERSION,) + inputs)).hexdigest()
+
+class AuthzFragments(object):
+    """The cached pieces of a Subversion authz file.
+
+    Fragments live in a directory alongside the file (named after it, with
+    '.d' appended). Each begins with a stamp of the inputs it was generated
+    from, so a fragment only has to be regenerated when its stamp changes.
+    The file itself is then reassembled from the fragments and atomically
+    replaced.
     """
-    users = store.find(User)
-    conf_name = config['paths']['svn']['conf']
-    temp_name = conf_name + ".new"
-    f = open(temp_name, "w")
-    f.write("""\
-# IVLE SVN repository authorisation configuration
-# Generated: %(time)s
-""" % {'time': time.asctime()})
+    STAMP_PREFIX = '# Stamp: '
+
+    def __init__(self, conf_name):
+        self.conf_name = conf_name
+        self.path = conf_name + '.d'
+        self.regenerated = 0
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _fragment_path(self, name):
+        return os.path.join(self.path, name)
+
+    def stamp_of(self, name):
+        """Return the stamp of the named fragment, or None if there isn't
+        one."""
+        try:
+            f = open(self._fragment_path(name))
+        except IOError:
+            return None
+        try:
+            line = f.readline()
+        finally:
+            f.close()
+        if not line.startswith(self.STAMP_PREFIX):
+            return None
+        return line[len(self.STAMP_PREFIX):].strip()
+
+    def update(self, name, stamp, generate, force=False):
+        """Make sure the named fragment has the given stamp, calling
+        generate with a file to write it to if it doesn't (or if force is
+        set)."""
+        if not force and self.stamp_of(name) == stamp:
+            return
+        path = self._fragment_path(name)
+        temp_name = path + '.new'
+        f = open(temp_name, 'w')
+        try:
+            f.write('%s%s\n' % (self.STAMP_PREFIX, stamp))
+            generate(f)
+        finally:
+            f.close()
+        os.rename(temp_name, path)
+        self.regenerated += 1
+
+    def assemble(self, header, names):
+        """Replace the authz file with header followed by the named
+        fragments, and discard any other fragments."""
+        (fd, temp_name) = tempfile.mkstemp(
+            dir=os.path.dirname(self.conf_name) or '.',
+            prefix=os.path.basename(self.conf_name) + '.')
+        f = os.fdopen(fd, 'w')
+        try:
+            f.write(header)
+            for name in names:
+                fragment = open(self._fragment_path(name))
+                try:
+                    fragment.readline() # The stamp.
+                    shutil.copyfileobj(fragment, f)
+                finally:
+                    fragment.close()
+        finally:
+            f.close()
+        os.chmod(temp_name, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP
+                            | stat.S_IROTH)
+        os.rename(temp_name, self.conf_name)
+        chown_to_webserver(self.conf_name)
+
+        for name in set(os.listdir(self.path)) - set(names):
+            try:
+                os.remove(self._fragment_path(name))
+            except OSError:
+                pass
+
+def _offering_viewers(store):
+    """Return a dict mapping offering IDs to the logins of their active
+    tutors and lecturers, who may read the offering's submissions."""
+    viewers = {}
+    for (offeringid, login) in store.find(
+        (Enrolment.offering_id, User.login),
+            User.id == Enrolment.user_id,
+            Enrolment.role.is_in((u'tutor', u'lecturer')),
+            Enrolment.active == True,
+        ).order_by(User.login):
+        viewers.setdefault(offeringid, []).append(login)
+    return viewers
+
+def _offering_submission_counts(store, *conditions):
+    """Return a dict mapping offering IDs to the number and greatest ID of
+    the project submissions (satisfying conditions) made in them. New
+    submissions change these."""
+    return dict((offeringid, (count, last)) for (offeringid, count, last) in
+        store.find(
+            (ProjectSet.offering_id, Count(ProjectSubmission.id),
+             Max(ProjectSubmission.id)),
+                Assessed.id == ProjectSubmission.assessed_id,
+                Project.id == Assessed.project_id,
+                ProjectSet.id == Project.project_set_id,
+                *conditions
+            ).group_by(ProjectSet.offering_id))
+
+def _latest_submissions(store, offeringid, columns, *conditions):
+    """Find the given columns of the latest submission of everything
+    assessed in an offering (satisfying conditions)."""
+    return store.find(columns,
+            ProjectSubmission.id == Assessed.latest_submission_id,
+            Project.id == Assessed.project_id,
+            ProjectSet.id == Project.project_set_id,
+            ProjectSet.offering_id == offeringid,
+            *conditions
+        ).order_by(ProjectSubmission.id)
 
-    for u in users:
+def _write_user_repositories(store, f):
+    for login in store.find(User.login).order_by(User.id):
         f.write("""
 [%(login)s:/]
 %(login)s = rw
-""" % {'login': u.login.encode('utf-8')})
-
-    # Now we need to grant offering tutors and lecturers access to the latest
-    # submissions in their offerings. There are much prettier ways to do this,
-    # but a lot of browser requests call this function, so it needs to be
-    # fast. We can grab all of the paths needing authorisation directives with
-    # a single query, and we cache the list of viewers for each offering.
-    offering_viewers_cache = {}
-    for (login, psid, pspath, offeringid) in store.find(
-        (User.login, ProjectSubmission.id, ProjectSubmission.path,
-         Offering.id),
-            Assessed.id == ProjectSubmission.assessed_id,
-            User.id == Assessed.user_id,
-            Project.id == Assessed.project_id,
-            ProjectSet.id == Project.project_set_id,
-            Offering.id == ProjectSet.offering_id,
-            ProjectSubmission.date_submitted == Select(
-                    Max(ProjectSubmission.date_submitted),
-                    ProjectSubmission.assessed_id == Assessed.id,
-                    tables=ProjectSubmission
-            )
-        ):
-
-        # Do we already have the list of logins authorised for this offering
-        # cached? If not, get it.
-        if offeringid not in offering_viewers_cache:
-            offering_viewers_cache[offeringid] = list(store.find(
-                    User.login,
-                    User.id == Enrolment.user_id,
-                    Enrolment.offering_id == offeringid,
-                    Enrolment.role.is_in((u'tutor', u'lecturer')),
-                    Enrolment.active == True,
-                )
-            )
-
+""" % {'login': login.encode('utf-8')})
+
+def _write_user_submissions(store, f, offeringid, viewers):
+    # Grant the offering's tutors and lecturers access to the latest
+    # submissions made by individual users.
+    for (login, psid, pspath) in _latest_submissions(store, offeringid,
+            (User.login, ProjectSubmission.id, ProjectSubmission.path),
+            User.id == Assessed.user_id):
         f.write("""
 # Submission %(id)d
 [%(login)s:%(path)s]
 """ % {'login': login.encode('utf-8'), 'id': psid,
        'path': pspath.encode('utf-8')})
 
-        for viewer_login in offering_viewers_cache[offeringid]:
+        for viewer_login in viewers:
             # We don't want to override the owner's write privilege,
             # so we don't add them to the read-only ACL.
             if login != viewer_login:
                 f.write("%s = r\n" % viewer_login.encode('utf-8'))
 
-    f.close()
-    os.rename(temp_name, conf_name)
-    chown_to_webserver(conf_name)
+def rebuild_svn_config(store, config, force=False):
+    """Build the complete SVN configuration file.
 
-def rebuild_svn_group_config(store, config):
-    """Build the complete SVN configuration file for groups
+    The file is assembled from fragments (see AuthzFragments): one for
+    every user's own repository, which changes when users are added, and one
+    per offering for the latest submissions, which changes with new
+    submissions and tutor or lecturer enrolments. Only fragments whose
+    inputs have changed are regenerated, unless force is set.
 
     @param config: An ivle.config.Config object.
+    @return: The number of fragments regenerated.
     """
-    conf_name = config['paths']['svn']['group_conf']
-    temp_name = conf_name + ".new"
-    f = open(temp_name, "w")
+    fragments = AuthzFragments(config['paths']['svn']['conf'])
 
-    f.write("""\
-# IVLE SVN group repository authorisation configuration
+    users = store.find(User)
+    fragments.update('users', _authz_stamp(users.count(), users.max(User.id)),
+                     lambda f: _write_user_repositories(store, f), force)
+    names = ['users']
+
+    viewers = _offering_viewers(store)
+    submissions = _offering_submission_counts(store, Assessed.user_id != None)
+    for offeringid in store.find(Offering.id).order_by(Offering.id):
+        name = 'offering-%d' % offeringid
+        offering_viewers = viewers.get(offeringid, [])
+        fragments.update(name,
+            _authz_stamp(submissions.get(offeringid), offering_viewers),
+            lambda f: _write_user_submissions(store, f, offeringid,
+                                              offering_viewers),
+            force)
+        names.append(name)
+
+    fragments.assemble("""\
+# IVLE SVN repository authorisation configuration
 # Generated: %(time)s
+""" % {'time': time.asctime()}, names)
+    return fragments.regenerated
 
-""" % {'time': time.asctime()})
-
-    group_members_cache = {}
-    for group in store.find(ProjectGroup):
-        offering = group.project_set.offering
-        reponame = "_".join([offering.subject.short_name,
-                             offering.semester.year,
-                             offering.semester.url_name,
-                             group.name])
+def _write_group_repositories(store, f, offeringid, reponame_prefix, members):
+    for (gid, name) in store.find((ProjectGroup.id, ProjectGroup.name),
+            ProjectSet.id == ProjectGroup.project_set_id,
+            ProjectSet.offering_id == offeringid,
+        ).order_by(ProjectGroup.id):
+        reponame = "_".join(reponame_prefix + (name,))
 
         f.write("[%s:/]\n" % reponame.encode('utf-8'))
-        if group.id not in group_members_cache:
-            group_members_cache[group.id] = set()
-        for user in group.members:
-            group_members_cache[group.id].add(user.login)
-            f.write("%s = rw\n" % user.login.encode('utf-8'))
+        for login in members.get(gid, []):
+            f.write("%s = rw\n" % login.encode('utf-8'))
         f.write("\n")
 
-    # Now we need to grant offering tutors and lecturers access to the latest
-    # submissions in their offerings. There are much prettier ways to do this,
-    # but a lot of browser requests call this function, so it needs to be
-    # fast. We can grab all of the paths needing authorisation directives with
-    # a single query, and we cache the list of viewers for each offering.
-    offering_viewers_cache = {}
-    for (ssn, year, sem, name, psid, pspath, gid, offeringid) in store.find(
-        (Subject.short_name, Semester.year, Semester.url_name,
-         ProjectGroup.name, ProjectSubmission.id, ProjectSubmission.path,
-         ProjectGroup.id, Offering.id),
-            Assessed.id == ProjectSubmission.assessed_id,
-            ProjectGroup.id == Assessed.project_group_id,
-            Project.id == Assessed.project_id,
-            ProjectSet.id == Project.project_set_id,
-            Offering.id == ProjectSet.offering_id,
-            Subject.id == Offering.subject_id,
-            Semester.id == Offering.semester_id,
-            ProjectSubmission.date_submitted == Select(
-                    Max(ProjectSubmission.date_submitted),
-                    ProjectSubmission.assessed_id == Assessed.id,
-                    tables=ProjectSubmission
-            )
-        ):
-
-        reponame = "_".join([ssn, year, sem, name])
-
-        # Do we already have the list of logins authorised for this offering
-        # cached? If not, get it.
-        if offeringid not in offering_viewers_cache:
-            offering_viewers_cache[offeringid] = list(store.find(
-                    User.login,
-                    User.id == Enrolment.user_id,
-                    Enrolment.offering_id == offeringid,
-                    Enrolment.role.is_in((u'tutor', u'lecturer')),
-                    Enrolment.active == True,
-                )
-            )
+def _write_group_submissions(store, f, offeringid, reponame_prefix, members,
+                             viewers):
+    # Grant the offering's tutors and lecturers access to the latest
+    # submissions made by groups.
+    for (name, psid, pspath, gid) in _latest_submissions(store, offeringid,
+            (ProjectGroup.name, ProjectSubmission.id, ProjectSubmission.path,
+             ProjectGroup.id),
+            ProjectGroup.id == Assessed.project_group_id):
+        reponame = "_".join(reponame_prefix + (name,))
 
         f.write("""
 # Submission %(id)d
@@ -198,14 +274,76 @@ def rebuild_svn_group_config(store, config):
 """ % {'repo': reponame.encode('utf-8'), 'id': psid,
        'path': pspath.encode('utf-8')})
 
-        for viewer_login in offering_viewers_cache[offeringid]:
+        for viewer_login in viewers:
             # Skip existing group members, or they can't write to it any more.
-            if viewer_login not in group_members_cache[gid]:
-                f.write("%s = r\n" % viewer_login)
+            if viewer_login not in members.get(gid, []):
+                f.write("%s = r\n" % viewer_login.encode('utf-8'))
+
+def rebuild_svn_group_config(store, config, force=False):
+    """Build the complete SVN configuration file for groups
+
+    Like rebuild_svn_config, the file is assembled from per-offering
+    fragments, holding the offering's group repositories and their latest
+    submissions. A fragment is regenerated when the offering's groups,
+    group memberships, tutors and lecturers or submissions change, or if
+    force is set.
+
+    @param config: An ivle.config.Config object.
+    @return: The number of fragments regenerated.
+    """
+    fragments = AuthzFragments(config['paths']['svn']['group_conf'])
+    names = []
+
+    viewers = _offering_viewers(store)
+    submissions = _offering_submission_counts(store,
+                                              Assessed.project_group_id != None)
+    groups = dict((offeringid, (count, last)) for (offeringid, count, last) in
+        store.find(
+            (ProjectSet.offering_id, Count(ProjectGroup.id),
+             Max(ProjectGroup.id)),
+                ProjectSet.id == ProjectGroup.project_set_id,
+            ).group_by(ProjectSet.offering_id))
+
+    # Group members, by offering and then group.
+    members = {}
+    for (offeringid, gid, login) in store.find(
+        (ProjectSet.offering_id, ProjectGroupMembership.project_group_id,
+         User.login),
+            User.id == ProjectGroupMembership.user_id,
+            ProjectGroup.id == ProjectGroupMembership.project_group_id,
+            ProjectSet.id == ProjectGroup.project_set_id,
+        ).order_by(User.login):
+        members.setdefault(offeringid, {}).setdefault(gid, []).append(login)
+
+    for (offeringid, ssn, year, sem) in store.find(
+        (Offering.id, Subject.short_name, Semester.year, Semester.url_name),
+            Subject.id == Offering.subject_id,
+            Semester.id == Offering.semester_id,
+        ).order_by(Offering.id):
+        name = 'offering-%d' % offeringid
+        reponame_prefix = (ssn, year, sem)
+        offering_members = members.get(offeringid, {})
+        offering_viewers = viewers.get(offeringid, [])
+
+        def generate(f):
+            _write_group_repositories(store, f, offeringid, reponame_prefix,
+                                      offering_members)
+            _write_group_submissions(store, f, offeringid, reponame_prefix,
+                                     offering_members, offering_viewers)
+
+        fragments.update(name,
+            _authz_stamp(reponame_prefix, groups.get(offeringid),
+                         sorted(offering_members.items()), offering_viewers,
+                         submissions.get(offeringid)),
+            generate, force)
+        names.append(name)
+
+    fragments.assemble("""\
+# IVLE SVN group repository authorisation configuration
+# Generated: %(time)s
 
-    f.close()
-    os.rename(temp_name, conf_name)
-    chown_to_webserver(conf_name)
+""" % {'time': time.asctime()}, names)
+    return fragments.regenerated
 
 def make_svn_auth(store, login, config, throw_on_error=True):
     """Create a Subversion password for a user.
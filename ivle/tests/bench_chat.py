@@ -0,0 +1,81 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+"""Benchmark chat round trips over the version 1 and version 2 protocols.
+
+Run directly: python -m ivle.tests.bench_chat [requests] [payload bytes]
+"""
+
+import sys
+import threading
+import time
+
+import ivle.chat
+
+MAGIC = 'benchmark'
+
+def echo(msg):
+    if msg.get('terminate'):
+        raise ivle.chat.Terminate({'terminated': True})
+    return msg
+
+def serve(listener):
+    try:
+        ivle.chat.serve(listener, MAGIC, echo)
+    except ivle.chat.Terminate:
+        pass
+
+def start_echo_server():
+    listener = ivle.chat.listen(0)
+    thread = threading.Thread(target=serve, args=(listener,))
+    thread.start()
+    return listener.getsockname()[1], thread
+
+def bench(label, n, func):
+    times = []
+    start = time.time()
+    for i in xrange(n):
+        t = time.time()
+        func()
+        times.append(time.time() - t)
+    elapsed = time.time() - start
+    times.sort()
+    print '%-12s %8.0f req/s  median %7.1fus  p99 %7.1fus' % (
+        label, n / elapsed, times[len(times) // 2] * 1e6,
+        times[int(len(times) * 0.99)] * 1e6)
+
+def main(n=2000, size=100):
+    port, thread = start_echo_server()
+    msg = {'cmd': 'chat', 'text': 'x' * size}
+
+    bench('v1', n, lambda: ivle.chat.chat('localhost', port, msg, MAGIC,
+                                          version=1))
+    bench('v2', n, lambda: ivle.chat.chat('localhost', port, msg, MAGIC))
+
+    conn = ivle.chat.ChatConnection('localhost', port, MAGIC)
+    batch = [msg] * 50
+    bench('v2 pipeline', n // len(batch), lambda: conn.pipeline(batch))
+    print '(pipeline figures are per batch of %d requests)' % len(batch)
+    conn.close()
+
+    ivle.chat.chat('localhost', port, {'terminate': True}, MAGIC)
+    ivle.chat.discard_connections('localhost', port, MAGIC)
+    thread.join()
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
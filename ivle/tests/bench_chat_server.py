@@ -0,0 +1,91 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+"""Benchmark a chat server with many clients making slow requests, as
+usrmgt-server gets, with one worker and with a pool of workers.
+
+Run directly:
+    python -m ivle.tests.bench_chat_server [clients] [requests] [delay ms]
+"""
+
+import sys
+import threading
+import time
+
+import ivle.chat
+
+MAGIC = 'benchmark'
+
+def slow(msg):
+    if msg.get('terminate'):
+        raise ivle.chat.Terminate({'terminated': True})
+    # Stands in for a handler waiting on disk, Subversion or the database.
+    time.sleep(msg['delay'])
+    return msg
+
+def start_server(workers):
+    listener = ivle.chat.listen(0)
+    def serve():
+        try:
+            ivle.chat.serve(listener, MAGIC, slow, workers=workers)
+        except ivle.chat.Terminate:
+            pass
+    thread = threading.Thread(target=serve)
+    thread.start()
+    return listener.getsockname()[1], thread
+
+def bench(workers, clients, n, delay):
+    port, server = start_server(workers)
+    msg = {'delay': delay}
+    times = []
+    lock = threading.Lock()
+
+    def client():
+        for i in xrange(n):
+            t = time.time()
+            ivle.chat.chat('localhost', port, msg, MAGIC)
+            t = time.time() - t
+            lock.acquire()
+            times.append(t)
+            lock.release()
+
+    threads = [threading.Thread(target=client) for i in xrange(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    ivle.chat.chat('localhost', port, {'terminate': True}, MAGIC)
+    ivle.chat.discard_connections('localhost', port, MAGIC)
+    server.join()
+
+    times.sort()
+    print '%2d workers %8.1f req/s  median %7.1fms  p99 %7.1fms' % (
+        workers, len(times) / elapsed, times[len(times) // 2] * 1e3,
+        times[int(len(times) * 0.99)] * 1e3)
+
+def main(clients=8, n=25, delay=10):
+    print '%d clients, %d requests each, %dms per request' % (clients, n,
+                                                              delay)
+    for workers in (1, 4, 8):
+        bench(workers, clients, n, delay / 1000.0)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
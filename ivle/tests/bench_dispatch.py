@@ -0,0 +1,87 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Benchmark requests per second through the dispatch handler, opening a
+database connection for every request and with pooled connections.
+
+The handler is driven with fake mod_python requests from a number of
+threads, as from one web server process, for a page that needs the
+database. The session is faked, logged in as the given user (by default,
+the first in the database). Needs mod_python installed and a configured
+database.
+
+Run directly:
+    python -m ivle.tests.bench_dispatch [requests] [threads] [uri] [login]
+"""
+
+import sys
+import threading
+import time
+
+import ivle.database
+
+def run(count, threads, uri):
+    """Serve count requests for uri on the given number of threads,
+    returning the time taken."""
+    import ivle.dispatch
+    from ivle.webapp.testing import FakeApacheRequest
+
+    def work(n):
+        for i in range(n):
+            ivle.dispatch.handler(FakeApacheRequest(uri))
+
+    workers = [threading.Thread(target=work, args=(count // threads,))
+               for i in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+def main(count=1000, threads=1, uri='/', login=None):
+    # Not at the top, so the test runner can import this without mod_python.
+    import ivle.dispatch
+    from ivle.dispatch.request import Request
+    from ivle.webapp.testing import FakeSession
+
+    config = ivle.dispatch.config
+    if login is None:
+        store = ivle.database.get_store(config)
+        login = store.find(ivle.database.User).order_by(
+            ivle.database.User.id).first().login
+        store.close()
+    session = FakeSession(login=login)
+    Request.get_session = lambda self: session
+
+    for (label, size) in [('new connection per request', 0),
+                          ('pooled connections',
+                           max(config['database']['pool_size'], 1))]:
+        ivle.database._store_pool = ivle.database.StorePool(config,
+                                                            size=size)
+        # Warm up the templates and plugins first.
+        run(threads, threads, uri)
+        elapsed = run(count, threads, uri)
+        stats = ivle.database._store_pool.stats()
+        print '%-28s %8.1f requests/s  %5d connects  %5d waits ' \
+              '(mean %.4fs, max %.4fs)' % (
+              label, count / elapsed, stats['connects'], stats['waits'],
+              stats['wait_time_mean'], stats['wait_time_max'])
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*[int(a) for a in args[:2]] + args[2:])
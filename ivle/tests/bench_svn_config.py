@@ -0,0 +1,92 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+"""Benchmark rebuilding the Subversion authz files for a large dataset.
+
+Fills the configured database with synthetic users, offerings, groups and
+submissions inside a transaction, times full and incremental rebuilds into a
+temporary directory, and then rolls everything back.
+
+Run directly:
+    python -m ivle.tests.bench_svn_config [users] [offerings]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import ivle.config
+import ivle.database
+import ivle.makeuser
+import ivle.tests.dataset
+
+def timed(label, func):
+    start = time.time()
+    regenerated = func()
+    print '%-34s %7.2fs  %4d fragments regenerated' % (
+        label, time.time() - start, regenerated)
+
+def main(users=50000, offerings=200):
+    config = ivle.config.Config()
+    store = ivle.database.get_store(config)
+    ivle.makeuser.chown_to_webserver = lambda filename: None
+    tempdir = tempfile.mkdtemp()
+    config['paths']['svn']['conf'] = os.path.join(tempdir, 'svn.conf')
+    config['paths']['svn']['group_conf'] = os.path.join(tempdir,
+                                                       'svn-group.conf')
+    try:
+        start = time.time()
+        ivle.tests.dataset.generate(store, users, offerings, worksheets=0)
+        print 'Populated %d users and %d offerings in %.1fs' % (
+            users, offerings, time.time() - start)
+
+        def both(force=False):
+            return (ivle.makeuser.rebuild_svn_config(store, config, force) +
+                    ivle.makeuser.rebuild_svn_group_config(store, config,
+                                                           force))
+
+        timed('full rebuild', lambda: both(force=True))
+        timed('rebuild, nothing changed', both)
+
+        # A new submission changes just one offering's fragment.
+        store.execute("""
+            INSERT INTO project_submission (assessedid, path, revision,
+                                            date_submitted, submitter)
+            SELECT assessedid, '/work/late', 3, '2099-02-01', loginid
+            FROM assessed WHERE loginid IS NOT NULL
+            ORDER BY assessedid DESC LIMIT 1""")
+        store.execute("""
+            UPDATE assessed SET latest_submissionid = (
+                SELECT max(submissionid) FROM project_submission s
+                WHERE s.assessedid = assessed.assessedid)
+            WHERE assessedid = (SELECT max(assessedid) FROM assessed
+                                WHERE loginid IS NOT NULL)""")
+        timed('rebuild after one submission', both)
+
+        store.execute("""
+            INSERT INTO login (login, nick, fullname, unixid, state)
+            VALUES ('benchnew', 'Bench', 'New User', 99999, 'enabled')""")
+        timed('rebuild after one new user', both)
+    finally:
+        store.rollback()
+        shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
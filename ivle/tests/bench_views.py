@@ -0,0 +1,187 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Load test the web application's views against a large dataset.
+
+Drives ivle.dispatch.handler with fake mod_python requests for each of a
+set of pages, as a student or as a lecturer, from a number of threads as
+from one web server process. Reports the response statuses, latency
+percentiles and database queries per request of each page, then the mean
+and maximum template render time of each view class.
+
+The session is faked, so no logins are needed. Needs mod_python and a
+configured database filled by ivle.tests.dataset.
+
+Run directly:
+    python -m ivle.tests.bench_views [requests per page] [threads]
+"""
+
+import sys
+import threading
+import time
+
+from storm.tracer import install_tracer, remove_tracer
+
+import ivle.database
+from ivle.database import (Enrolment, Offering, Project, ProjectSet, User,
+                           Worksheet)
+
+class QueryCounter(object):
+    """A Storm tracer which counts the statements executed by each
+    thread."""
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+    def reset(self):
+        self.local.count = 0
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        self.local.count = self.count + 1
+
+    def connection_raw_execute_error(self, connection, raw_cursor,
+                                     statement, params, error):
+        pass
+
+    def connection_raw_execute_success(self, connection, raw_cursor,
+                                       statement, params):
+        pass
+
+def percentile(values, p):
+    """Return the pth percentile of a sorted list."""
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+def find_pages(store, publisher):
+    """Return a list of (name, login, uri) for the pages to load, using
+    objects from the synthetic dataset."""
+    from ivle.webapp.admin.subject import EnrolmentsView
+    from ivle.webapp.tutorial.marks import (WorksheetsMarksView,
+                                            WorksheetsMarksCSVView)
+    from ivle.webapp.tutorial.statistics import WorksheetsStatisticsView
+
+    offering = store.find(Offering, Offering.id == Worksheet.offering_id
+        ).order_by(Offering.id).first()
+    def member(role):
+        return store.find(User, User.id == Enrolment.user_id,
+            Enrolment.offering_id == offering.id, Enrolment.role == role
+            ).order_by(User.id).first().login
+    student = member(u'student')
+    lecturer = member(u'lecturer')
+    worksheet = offering.worksheets.order_by(Worksheet.seq_no).first()
+    project = store.find(Project, Project.project_set_id == ProjectSet.id,
+        ProjectSet.offering_id == offering.id).order_by(Project.id).first()
+
+    return [
+        ('home', student, '/'),
+        ('offering', student, publisher.generate(offering)),
+        ('worksheet', student, publisher.generate(worksheet)),
+        ('files', student, '/files/%s' % student),
+        ('offering (lecturer)', lecturer, publisher.generate(offering)),
+        ('enrolments', lecturer,
+         publisher.generate(offering, EnrolmentsView)),
+        ('worksheet marks', lecturer,
+         publisher.generate(offering, WorksheetsMarksView)),
+        ('worksheet marks CSV', lecturer,
+         publisher.generate(offering, WorksheetsMarksCSVView)),
+        ('exercise statistics', lecturer,
+         publisher.generate(offering, WorksheetsStatisticsView)),
+        ('project submissions', lecturer, publisher.generate(project)),
+        ]
+
+def load(login, uri, count, threads, counter):
+    """Request uri count times as the given user, across threads. Return
+    the statuses, the sorted latencies and the mean number of queries."""
+    import ivle.dispatch
+    from ivle.webapp.testing import FakeApacheRequest
+
+    statuses = {}
+    latencies = []
+    queries = []
+
+    def work(n):
+        for i in range(n):
+            apachereq = FakeApacheRequest(uri)
+            apachereq.login = login
+            counter.reset()
+            start = time.time()
+            code = ivle.dispatch.handler(apachereq)
+            latencies.append(time.time() - start)
+            queries.append(counter.count)
+            status = code or apachereq.status or 200
+            statuses[status] = statuses.get(status, 0) + 1
+
+    workers = [threading.Thread(target=work, args=(count // threads,))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    latencies.sort()
+    return statuses, latencies, float(sum(queries)) / len(queries)
+
+def main(count=50, threads=1):
+    # Not at the top, so the test runner can import this without mod_python.
+    import ivle.dispatch
+    from ivle.dispatch.request import Request
+    from ivle.webapp import ApplicationRoot
+    from ivle.webapp.base.xhtml import render_stats
+    from ivle.webapp.testing import FakeApacheRequest, FakeSession
+
+    config = ivle.dispatch.config
+    Request.get_session = lambda self: FakeSession(
+        login=self.apache_req.login)
+
+    store = ivle.database.get_store(config)
+    publisher = ivle.dispatch.get_publisher(
+        ApplicationRoot(Request(FakeApacheRequest('/'), config)))
+    pages = find_pages(store, publisher)
+    store.close()
+
+    counter = QueryCounter()
+    install_tracer(counter)
+    try:
+        print '%-22s %-14s %8s %8s %8s %8s %8s' % (
+            'page', 'statuses', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+            'queries')
+        for (name, login, uri) in pages:
+            # Warm up the templates and caches first.
+            load(login, uri, threads, threads, counter)
+            statuses, latencies, queries = load(login, uri, count, threads,
+                                                counter)
+            print '%-22s %-14s %8.1f %8.1f %8.1f %8.1f %8.1f' % (
+                name,
+                ','.join('%d:%d' % s for s in sorted(statuses.items())),
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 90) * 1000,
+                percentile(latencies, 99) * 1000,
+                latencies[-1] * 1000, queries)
+    finally:
+        remove_tracer(counter)
+
+    print
+    print '%-36s %8s %8s %8s' % ('view', 'renders', 'mean ms', 'max ms')
+    for (name, stats) in sorted(render_stats().items()):
+        print '%-36s %8d %8.1f %8.1f' % (name, stats['renders'],
+                                         stats['mean'] * 1000,
+                                         stats['max'] * 1000)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
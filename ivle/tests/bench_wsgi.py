@@ -0,0 +1,102 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Benchmark requests per second through the WSGI application, against the
+mod_python handler.
+
+Both front ends are driven in-process from a number of threads, as from one
+web server process, for a page that needs the database; the differences
+measured are those of the request objects and response handling, not the
+web servers. The session is faked, logged in as the given user (by default,
+the first in the database). Needs a configured database; the mod_python
+handler is skipped if mod_python isn't installed.
+
+Run directly:
+    python -m ivle.tests.bench_wsgi [requests] [threads] [uri] [login]
+"""
+
+import sys
+import threading
+import time
+import wsgiref.util
+
+import ivle.database
+
+def serve_mod_python(uri):
+    import ivle.dispatch
+    from ivle.webapp.testing import FakeApacheRequest
+    ivle.dispatch.handler(FakeApacheRequest(uri))
+
+def serve_wsgi(uri):
+    import ivle.dispatch.wsgi
+    (path, _, query) = uri.partition('?')
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query}
+    wsgiref.util.setup_testing_defaults(environ)
+    def start_response(status, headers):
+        pass
+    for block in ivle.dispatch.wsgi.application(environ, start_response):
+        pass
+
+def run(serve, count, threads, uri):
+    """Serve count requests for uri on the given number of threads,
+    returning the time taken."""
+    def work(n):
+        for i in range(n):
+            serve(uri)
+
+    workers = [threading.Thread(target=work, args=(count // threads,))
+               for i in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+def main(count=1000, threads=1, uri='/', login=None):
+    # Not at the top, so the test runner can import this without mod_python.
+    import ivle.dispatch
+    from ivle.dispatch.request import Request
+    from ivle.webapp.testing import FakeSession
+
+    config = ivle.dispatch.config
+    if login is None:
+        store = ivle.database.get_store(config)
+        login = store.find(ivle.database.User).order_by(
+            ivle.database.User.id).first().login
+        store.close()
+    session = FakeSession(login=login)
+    Request.get_session = lambda self: session
+    # The session is faked, so any backend will do for the WSGI application.
+    config['session']['backend'] = 'sqlite'
+
+    front_ends = [('wsgi', serve_wsgi)]
+    try:
+        import mod_python.apache
+        front_ends.insert(0, ('mod_python', serve_mod_python))
+    except ImportError:
+        print 'mod_python not installed; skipping its handler.'
+
+    for (label, serve) in front_ends:
+        # Warm up the templates and plugins first.
+        run(serve, threads, threads, uri)
+        elapsed = run(serve, count, threads, uri)
+        print '%-12s %8.1f requests/s' % (label, count / elapsed)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*[int(a) for a in args[:2]] + args[2:])
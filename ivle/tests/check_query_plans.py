@@ -0,0 +1,179 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+"""Check that the hot queries use indexes on a large dataset.
+
+Fills the configured database with the synthetic dataset of
+ivle.tests.dataset inside a transaction. Each hot query from
+ivle.worksheet.utils, ivle.database and ivle.makeuser is run while
+recording the SQL Storm sends. Every SELECT is
+then EXPLAINed, and the check fails if any plan scans one of the large
+tables sequentially. Everything is rolled back.
+
+Run directly:
+    python -m ivle.tests.check_query_plans [users] [offerings]
+"""
+
+import datetime
+import re
+import sys
+import time
+
+from storm.tracer import install_tracer, remove_tracer
+
+import ivle.config
+import ivle.database
+from ivle.database import (Assessed, Enrolment, Offering, Project,
+                           ProjectSet, ProjectSubmission, User, Worksheet)
+import ivle.makeuser
+import ivle.tests.dataset
+import ivle.worksheet.utils
+
+# Tables which grow with the number of users. Scanning any of these
+# sequentially to answer a question about one user, worksheet or offering
+# is a regression.
+LARGE_TABLES = set(['login', 'enrolment', 'assessed', 'project_submission',
+                    'group_member', 'exercise_attempt', 'exercise_save',
+                    'exercise_progress', 'exercise_statistics',
+                    'exercise_success_count'])
+
+SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+class StatementRecorder(object):
+    """A Storm tracer which remembers the statements executed."""
+    def __init__(self):
+        self.statements = []
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        self.statements.append((statement, params))
+
+    def connection_raw_execute_error(self, connection, raw_cursor,
+                                     statement, params, error):
+        pass
+
+    def connection_raw_execute_success(self, connection, raw_cursor,
+                                       statement, params):
+        pass
+
+def hot_queries(store, config):
+    """Return a list of (name, function) pairs, each running some of the
+    queries made while serving a page."""
+    offering = store.find(Offering, Offering.id == Worksheet.offering_id
+        ).order_by(Offering.id).first()
+    user = store.find(User, User.id == Enrolment.user_id,
+        Enrolment.offering_id == offering.id, Enrolment.role == u'student'
+        ).order_by(User.id).first()
+    worksheets = list(offering.worksheets)
+    worksheet = worksheets[0]
+    worksheet_exercise = worksheet.worksheet_exercises.order_by(
+        ivle.database.WorksheetExercise.seq_no).first()
+    project = store.find(Project, Project.project_set_id == ProjectSet.id,
+        ProjectSet.offering_id == offering.id).order_by(Project.id).first()
+    students = [student.id for student in offering.students]
+    ws_ex_ids = [ws_ex.id for ws_ex in worksheet.worksheet_exercises]
+    as_of = datetime.datetime(2099, 1, 1, 0, 2)
+    utils = ivle.worksheet.utils
+
+    return [
+        ('get_exercise_status', lambda: utils.get_exercise_status(
+            store, user, worksheet_exercise)),
+        ('get_exercise_status as_of', lambda: utils.get_exercise_status(
+            store, user, worksheet_exercise, as_of)),
+        ('get_exercise_status (progress)', lambda: utils.get_exercise_status(
+            store, user, worksheet_exercise, use_progress=True)),
+        ('get_exercise_stored_text', lambda: utils.get_exercise_stored_text(
+            store, user, worksheet_exercise)),
+        ('get_exercise_attempts', lambda: utils.get_exercise_attempts(
+            store, user, worksheet_exercise)),
+        ('get_exercise_statistics', lambda: utils.get_exercise_statistics(
+            store, worksheet_exercise)),
+        ('get_worksheet_exercise_states', lambda:
+            utils.get_worksheet_exercise_states(store, user, worksheet,
+                                                statistics=True)),
+        ('get_worksheet_exercise_states (progress)', lambda:
+            utils.get_worksheet_exercise_states(store, user, worksheet,
+                statistics=True, use_progress=True)),
+        ('get_worksheet_exercise_statistics', lambda:
+            utils.get_worksheet_exercise_statistics(store, ws_ex_ids)),
+        ('calculate_scores', lambda: utils.calculate_scores(
+            store, students, worksheets)),
+        ('calculate_scores as_of', lambda: utils.calculate_scores(
+            store, students, worksheets, as_of)),
+        ('calculate_scores (progress)', lambda: utils.calculate_scores(
+            store, students, worksheets, use_progress=True)),
+        ('User.active_enrolments', lambda: list(user.active_enrolments)),
+        ('User.get_groups', lambda: list(user.get_groups(offering))),
+        ('Offering.get_permissions', lambda: offering.get_permissions(
+            user, config)),
+        ('Offering.get_members_by_role', lambda: list(
+            offering.get_members_by_role(u'tutor'))),
+        ('Project.latest_submissions', lambda: list(
+            project.latest_submissions)),
+        ('makeuser._latest_submissions', lambda: list(
+            ivle.makeuser._latest_submissions(store, offering.id,
+                (ProjectSubmission.path, Assessed.user_id),
+                Assessed.user_id != None))),
+        ]
+
+def check(store, name, query):
+    """Run a query and EXPLAIN its SELECTs, returning a list of the plans
+    which scan a large table sequentially."""
+    store.invalidate()
+    recorder = StatementRecorder()
+    install_tracer(recorder)
+    try:
+        query()
+    finally:
+        remove_tracer(recorder)
+
+    regressions = []
+    for (statement, params) in recorder.statements:
+        if not statement.lstrip().upper().startswith('SELECT'):
+            continue
+        plan = '\n'.join(row[0] for row in
+                         store.execute('EXPLAIN ' + statement, params))
+        if set(SEQ_SCAN.findall(plan)) & LARGE_TABLES:
+            regressions.append((statement, plan))
+    return regressions
+
+def main(users=5000, offerings=50):
+    config = ivle.config.Config()
+    store = ivle.database.get_store(config)
+    failed = False
+    try:
+        start = time.time()
+        ivle.tests.dataset.generate(store, users, offerings)
+        print 'Populated %d users and %d offerings in %.1fs' % (
+            users, offerings, time.time() - start)
+
+        for (name, query) in hot_queries(store, config):
+            regressions = check(store, name, query)
+            print '%-42s %s' % (name, 'FAIL' if regressions else 'ok')
+            for (statement, plan) in regressions:
+                failed = True
+                print
+                print '    ' + statement
+                print '    ' + plan.replace('\n', '\n    ')
+                print
+    finally:
+        store.rollback()
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:]]))
@@ -0,0 +1,219 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Generate a large synthetic dataset, for benchmarks and load tests.
+
+All users are named bench1, bench2, ..., and all subjects BENCH1, BENCH2,
+..., in the semester 2099/bench. Each user takes four offerings: as
+lecturer of one if they are among the first (one per offering), as a tutor
+if among the next quarter, and otherwise as a student. Each offering has two
+individual projects in one project set, and a group project in another with
+twenty groups of four; a quarter of the students submit to each individual
+project, and every group to the group project, twice. Each offering has
+worksheets of exercises, and its members attempt half of them several times,
+succeeding on the last attempt, and save a quarter.
+
+The default dataset has about six million exercise attempts.
+
+generate() adds the dataset inside the caller's transaction; benchmarks
+roll it back. Run directly, this fills and commits to the configured
+database, for load tests with bench_views:
+    python -m ivle.tests.dataset [options]
+"""
+
+import optparse
+import sys
+import time
+
+import ivle.config
+import ivle.database
+
+def generate(store, users=50000, offerings=200, worksheets=4, exercises=5,
+             attempts=3):
+    """Add the synthetic dataset to the store's database.
+
+    @param users: The number of users.
+    @param offerings: The number of offerings.
+    @param worksheets: The number of worksheets in each offering.
+    @param exercises: The number of exercises in each worksheet.
+    @param attempts: The number of attempts made at each attempted exercise.
+    """
+    params = {'users': users, 'offerings': offerings,
+              'worksheets': worksheets, 'exercises': exercises,
+              'exercise_pool': 8 * exercises, 'attempts': attempts}
+    for sql in [
+        """INSERT INTO login (login, nick, fullname, unixid, state)
+           SELECT 'bench' || i, 'Bench', 'Bench User ' || i, 100000 + i,
+                  'enabled'
+           FROM generate_series(1, %(users)d) AS i""",
+        """INSERT INTO semester (year, url_name, code, display_name, state)
+           VALUES ('2099', 'bench', 'bench', 'Benchmark', 'current')""",
+        """INSERT INTO subject (subj_code, subj_name, subj_short_name)
+           SELECT 'BENCH' || i, 'Benchmark ' || i, 'bench' || i
+           FROM generate_series(1, %(offerings)d) AS i""",
+        """INSERT INTO offering (subject, semesterid)
+           SELECT subjectid, (SELECT semesterid FROM semester
+                              WHERE year = '2099' AND url_name = 'bench')
+           FROM subject WHERE subj_code LIKE 'BENCH%%'""",
+        """CREATE TEMPORARY TABLE bench_offering AS
+           SELECT offeringid, row_number() OVER (ORDER BY offeringid) - 1
+                  AS n
+           FROM offering JOIN subject ON subject = subjectid
+           WHERE subj_code LIKE 'BENCH%%'""",
+        """CREATE TEMPORARY TABLE bench_login AS
+           SELECT loginid, row_number() OVER (ORDER BY loginid) - 1 AS n
+           FROM login WHERE login LIKE 'bench%%'""",
+        """INSERT INTO enrolment (loginid, offeringid, role)
+           SELECT loginid, offeringid,
+                  CASE WHEN l.n < %(offerings)d AND o.n = l.n THEN 'lecturer'
+                       WHEN l.n < 5 * %(offerings)d / 4 THEN 'tutor'
+                       ELSE 'student' END
+           FROM bench_login l, bench_offering o
+           WHERE o.n IN (l.n %% %(offerings)d, (l.n + 1) %% %(offerings)d,
+                         (l.n + 2) %% %(offerings)d,
+                         (l.n + 3) %% %(offerings)d)""",
+        # An individual project set, and a group one.
+        """INSERT INTO project_set (offeringid, max_students_per_group)
+           SELECT offeringid, size
+           FROM bench_offering, (VALUES (NULL::integer), (4)) AS s (size)""",
+        """INSERT INTO project (short_name, name, projectsetid, deadline)
+           SELECT 'p' || i, 'Project ' || i, projectsetid, '2099-01-01'
+           FROM project_set NATURAL JOIN bench_offering,
+                generate_series(1, 2) AS i
+           WHERE max_students_per_group IS NULL""",
+        """INSERT INTO project (short_name, name, projectsetid, deadline)
+           SELECT 'g1', 'Group project', projectsetid, '2099-01-01'
+           FROM project_set NATURAL JOIN bench_offering
+           WHERE max_students_per_group IS NOT NULL""",
+        """INSERT INTO project_group (groupnm, projectsetid, createdby, epoch)
+           SELECT 'group' || i, projectsetid,
+                  (SELECT min(loginid) FROM bench_login), '2099-01-01'
+           FROM project_set NATURAL JOIN bench_offering,
+                generate_series(1, 20) AS i
+           WHERE max_students_per_group IS NOT NULL""",
+        """INSERT INTO group_member (loginid, groupid)
+           SELECT e.loginid, g.groupid
+           FROM enrolment e NATURAL JOIN bench_offering o
+                JOIN project_set ps ON ps.offeringid = o.offeringid
+                JOIN project_group g ON g.projectsetid = ps.projectsetid
+           WHERE e.loginid %% 12 = 0
+             AND g.groupnm = 'group' || (1 + e.loginid / 12 %% 20)""",
+        """INSERT INTO assessed (loginid, projectid)
+           SELECT e.loginid, p.projectid
+           FROM enrolment e NATURAL JOIN bench_offering o
+                JOIN project_set ps ON ps.offeringid = o.offeringid
+                JOIN project p ON p.projectsetid = ps.projectsetid
+           WHERE ps.max_students_per_group IS NULL
+             AND (e.loginid + p.projectid) %% 4 = 0""",
+        """INSERT INTO assessed (groupid, projectid)
+           SELECT g.groupid, p.projectid
+           FROM project_group g
+                JOIN project_set ps ON ps.projectsetid = g.projectsetid
+                NATURAL JOIN bench_offering
+                JOIN project p ON p.projectsetid = g.projectsetid""",
+        """INSERT INTO project_submission (assessedid, path, revision,
+                                          date_submitted, submitter)
+           SELECT a.assessedid, '/work/' || i, i,
+                  '2099-01-01'::timestamp + i * interval '1 hour',
+                  (SELECT min(loginid) FROM bench_login)
+           FROM assessed a JOIN project p ON p.projectid = a.projectid
+                JOIN project_set ps ON ps.projectsetid = p.projectsetid
+                NATURAL JOIN bench_offering,
+                generate_series(1, 2) AS i""",
+        """UPDATE assessed SET latest_submissionid = (
+               SELECT submissionid FROM project_submission s
+               WHERE s.assessedid = assessed.assessedid
+               ORDER BY date_submitted DESC LIMIT 1)""",
+        """INSERT INTO exercise (identifier, name, partial, num_rows)
+           SELECT 'bench-ex' || i, 'Benchmark exercise ' || i, '', 4
+           FROM generate_series(1, %(exercise_pool)d) AS i""",
+        """INSERT INTO worksheet (offeringid, identifier, name, data,
+                                 assessable, published, seq_no, format)
+           SELECT offeringid, 'ws' || i, 'Worksheet ' || i, '<worksheet />',
+                  true, true, i, 'xml'
+           FROM bench_offering, generate_series(1, %(worksheets)d) AS i""",
+        """INSERT INTO worksheet_exercise (worksheetid, exerciseid, seq_no,
+                                          optional)
+           SELECT w.worksheetid,
+                  'bench-ex' || (1 + (o.n * 7 + w.seq_no * 5 + i)
+                                       %% %(exercise_pool)d),
+                  i, false
+           FROM worksheet w NATURAL JOIN bench_offering o,
+                generate_series(1, %(exercises)d) AS i""",
+        """CREATE TEMPORARY TABLE bench_user_exercise AS
+           SELECT e.loginid, we.ws_ex_id
+           FROM enrolment e NATURAL JOIN bench_offering o
+                JOIN worksheet w ON w.offeringid = o.offeringid
+                JOIN worksheet_exercise we ON we.worksheetid = w.worksheetid
+           WHERE (e.loginid + we.ws_ex_id) %% 2 = 0""",
+        """INSERT INTO exercise_attempt (loginid, ws_ex_id, date, attempt,
+                                        complete, active)
+           SELECT loginid, ws_ex_id,
+                  '2099-01-01'::timestamp + a * interval '1 minute',
+                  'attempt', a = %(attempts)d, true
+           FROM bench_user_exercise, generate_series(1, %(attempts)d) AS a""",
+        """INSERT INTO exercise_save (loginid, ws_ex_id, date, text)
+           SELECT loginid, ws_ex_id, '2099-01-02', 'save'
+           FROM bench_user_exercise WHERE (loginid + ws_ex_id) %% 4 = 0""",
+        # As the 20100815-03 and 20100815-04 migrations fill them.
+        """INSERT INTO exercise_progress (loginid, ws_ex_id, first_success,
+                                         attempts_to_success, total_attempts,
+                                         last_attempt)
+           SELECT loginid, ws_ex_id,
+                  MIN(CASE WHEN complete THEN date END),
+                  COUNT(*), COUNT(*), MAX(date)
+           FROM exercise_attempt NATURAL JOIN bench_user_exercise
+           GROUP BY loginid, ws_ex_id""",
+        """INSERT INTO exercise_statistics (ws_ex_id, attempted, completed)
+           SELECT ws_ex_id, COUNT(*), COUNT(first_success)
+           FROM exercise_progress NATURAL JOIN bench_user_exercise
+           GROUP BY ws_ex_id""",
+        """INSERT INTO exercise_success_count (ws_ex_id, attempts, users)
+           SELECT ws_ex_id, attempts_to_success, COUNT(*)
+           FROM exercise_progress NATURAL JOIN bench_user_exercise
+           GROUP BY ws_ex_id, attempts_to_success""",
+        "ANALYZE",
+        ]:
+        store.execute(sql % params)
+
+def main():
+    parser = optparse.OptionParser(usage="""%prog [options]
+Add a synthetic dataset to the configured IVLE database.""")
+    parser.add_option('-u', '--users', type='int', default=50000,
+                      help='number of users (default %default)')
+    parser.add_option('-o', '--offerings', type='int', default=200,
+                      help='number of offerings (default %default)')
+    parser.add_option('-w', '--worksheets', type='int', default=4,
+                      help='worksheets in each offering (default %default)')
+    parser.add_option('-e', '--exercises', type='int', default=5,
+                      help='exercises in each worksheet (default %default)')
+    parser.add_option('-a', '--attempts', type='int', default=3,
+                      help='attempts at each attempted exercise '
+                           '(default %default)')
+    (options, args) = parser.parse_args()
+    if args:
+        parser.error('unexpected arguments')
+
+    store = ivle.database.get_store(ivle.config.Config())
+    start = time.time()
+    generate(store, options.users, options.offerings, options.worksheets,
+             options.exercises, options.attempts)
+    store.commit()
+    print 'Generated in %.1fs' % (time.time() - start)
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,8 @@
 import socket
 import os
 import random
+import threading
+import time
 
 try:
     import json
@@ -131,3 +133,137 @@ class TestChat(object):
 
         # This should raise the ProtocolError
         ivle.chat.decode(CHATMESSAGE, INCORRECTMAGIC)
+
+    def test_encode_decode_v2(self):
+        """Check that a round trip version 2 encoding and decoding works
+        """
+        MESSAGE = {'message': 'Hello, world'}
+        MAGIC = "MagicString"
+        encoded = ivle.chat.encode_v2(MESSAGE, MAGIC)
+        assert encoded.startswith(ivle.chat.V2_MARKER)
+        assert_equal(ivle.chat.decode(encoded, MAGIC), MESSAGE)
+
+    @raises(ivle.chat.ProtocolError)
+    def test_decode_v2_bad_magic(self):
+        """Check that a bad version 2 digest raises a ProtocolError
+        """
+        encoded = ivle.chat.encode_v2({'a': 'b'}, "AEIOU")
+        ivle.chat.decode(encoded, "ABCDE")
+
+    def test_decoder_partial_netstrings(self):
+        """Check that the decoder reassembles split and joined Netstrings"""
+        decoder = ivle.chat.NetstringDecoder()
+        assert_equal(decoder.feed("12:Hello"), [])
+        assert_equal(decoder.feed(" world!,0:,3:ab"), [SIMPLESTRING, ""])
+        assert_equal(decoder.feed("c,"), ["abc"])
+        assert_equal(decoder.buffer, "")
+
+    @raises(ivle.chat.ProtocolError)
+    def test_decoder_invalid_netstring(self):
+        ivle.chat.NetstringDecoder().feed("5:not that short!,")
+
+    def test_reader_multiple_netstrings(self):
+        messages = [os.urandom(random.randint(0, 20)) for i in range(10)]
+        for message in messages:
+            ivle.chat.send_netstring(self.s1, message)
+        reader = ivle.chat.NetstringReader(self.s2)
+        for message in messages:
+            assert_equal(reader.read(), message)
+
+
+class TestChatServer(object):
+    MAGIC = "MagicString"
+
+    def handler(self, msg):
+        if msg.get('terminate'):
+            raise ivle.chat.Terminate({'terminated': True})
+        if msg.get('fail'):
+            raise ValueError('failed')
+        if msg.get('sleep'):
+            time.sleep(msg['sleep'])
+        return {'echo': msg}
+
+    def setUp(self):
+        self.listener = ivle.chat.listen(0)
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def serve(self):
+        try:
+            ivle.chat.serve(self.listener, self.MAGIC, self.handler)
+        except ivle.chat.Terminate:
+            pass
+
+    def tearDown(self):
+        ivle.chat.chat('localhost', self.port, {'terminate': True},
+                       self.MAGIC)
+        self.thread.join(5)
+        self.listener.close()
+        ivle.chat.discard_connections('localhost', self.port, self.MAGIC)
+
+    def test_chat_v1(self):
+        """Check that the old one-shot protocol is still served"""
+        response = ivle.chat.chat('localhost', self.port, {'a': 1},
+                                  self.MAGIC, version=1)
+        assert_equal(response, {'echo': {'a': 1}})
+
+    def test_chat_v2_reuses_connection(self):
+        for i in range(3):
+            response = ivle.chat.chat('localhost', self.port, {'a': i},
+                                      self.MAGIC)
+            assert_equal(response, {'echo': {'a': i}})
+        conn = ivle.chat._checkout('localhost', self.port, self.MAGIC)
+        assert_equal(conn.requests, 3)
+        conn.close()
+
+    def test_pipeline(self):
+        conn = ivle.chat.ChatConnection('localhost', self.port, self.MAGIC)
+        try:
+            responses = conn.pipeline([{'a': i} for i in range(20)])
+        finally:
+            conn.close()
+        assert_equal([json.loads(r) for r in responses],
+                     [{'echo': {'a': i}} for i in range(20)])
+
+    def test_handler_exception(self):
+        response = ivle.chat.chat('localhost', self.port, {'fail': True},
+                                  self.MAGIC)
+        assert_equal(response['type'], 'ValueError')
+        assert_equal(response['value'], 'failed')
+
+
+class TestThreadedChatServer(TestChatServer):
+    def serve(self):
+        try:
+            ivle.chat.serve(self.listener, self.MAGIC, self.handler,
+                            workers=4, request_timeout=1)
+        except ivle.chat.Terminate:
+            pass
+
+    def test_concurrent_requests(self):
+        """Check that slow requests on different connections overlap"""
+        responses = []
+        def request(i):
+            responses.append(ivle.chat.chat('localhost', self.port,
+                                            {'sleep': 0.5, 'i': i},
+                                            self.MAGIC))
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in range(4)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.time() - start < 1.5
+        assert_equal(sorted(r['echo']['i'] for r in responses), range(4))
+
+    def test_request_timeout(self):
+        response = ivle.chat.chat('localhost', self.port, {'sleep': 3},
+                                  self.MAGIC)
+        assert_equal(response['type'], 'Timeout')
+        # The server carries on serving other requests.
+        response = ivle.chat.chat('localhost', self.port, {'a': 1},
+                                  self.MAGIC)
+        assert_equal(response, {'echo': {'a': 1}})
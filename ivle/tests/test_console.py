@@ -0,0 +1,291 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import datetime
+import socket
+import time
+
+from nose.tools import assert_equal
+from storm.locals import create_database, Store
+
+import ivle.console
+from ivle.database import ConsoleSession, User
+
+
+class FakeUser(object):
+    login = 'studenta'
+    unixid = 5000
+
+
+class FakeConsole(object):
+    spawn_time = 0.5
+
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.closed = False
+
+    def chdir(self, working_dir):
+        self.working_dir = working_dir
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConsolePool(ivle.console.ConsolePool):
+    """A ConsolePool which starts fake consoles, and never in the
+    background."""
+    def _spawn(self, user, jail_path):
+        cons = FakeConsole(self._home(user))
+        self.spawns += 1
+        self.spawn_time_total += cons.spawn_time
+        return cons
+
+    def _start_fill(self, user, jail_path):
+        self._fill(user, jail_path)
+
+
+class TestConsolePool(object):
+    def setUp(self):
+        self.pool = FakeConsolePool(None, size=1, max_age=60)
+        self.user = FakeUser()
+
+    def test_miss_then_hit(self):
+        cons = self.pool.get(self.user, '/jail', '/home/studenta/a')
+        assert_equal(cons.working_dir, '/home/studenta/a')
+        cons = self.pool.get(self.user, '/jail', '/home/studenta/b')
+        assert_equal(cons.working_dir, '/home/studenta/b')
+        stats = self.pool.stats()
+        assert_equal(stats['hits'], 1)
+        assert_equal(stats['misses'], 1)
+        assert_equal(stats['spawns'], 3)
+        assert_equal(stats['size'], 1)
+        assert_equal(stats['spawn_time_mean'], 0.5)
+
+    def test_stale_spares_are_closed(self):
+        self.pool.prewarm(self.user, '/jail')
+        started, spare = self.pool.spares[(5000, '/jail')][0]
+        self.pool.spares[(5000, '/jail')][0] = (time.time() - 120, spare)
+        cons = self.pool.get(self.user, '/jail', '/home/studenta')
+        assert spare.closed
+        assert cons is not spare
+        assert_equal(self.pool.stats()['misses'], 1)
+
+    def test_swept_spares_are_closed(self):
+        other = FakeUser()
+        other.login, other.unixid = 'studentb', 5001
+        self.pool.prewarm(self.user, '/jail')
+        started, spare = self.pool.spares[(5000, '/jail')][0]
+        self.pool.spares[(5000, '/jail')][0] = (time.time() - 120, spare)
+        # Prewarming for anyone sweeps out the stale spare.
+        self.pool.prewarm(other, '/jail')
+        assert spare.closed
+        assert (5000, '/jail') not in self.pool.spares
+        assert_equal(self.pool.stats()['size'], 1)
+
+
+class TestConsoleRegistry(object):
+    config = {'console': {'reap_free_memory': 256, 'reap_idle': 120}}
+
+    def setUp(self):
+        self.memory_available = ivle.console.memory_available
+
+    def tearDown(self):
+        ivle.console.memory_available = self.memory_available
+
+    def test_memory_available(self):
+        available = ivle.console.memory_available()
+        assert available is None or available > 0
+
+    def test_no_reaping_without_memory_pressure(self):
+        # The store isn't touched unless memory is short.
+        ivle.console.memory_available = lambda: 1024 ** 3
+        assert_equal(ivle.console.reap_consoles(None, self.config), 0)
+        ivle.console.memory_available = lambda: None
+        assert_equal(ivle.console.reap_consoles(None, self.config), 0)
+
+
+# Just enough of the schema for the console session registry.
+SCHEMA = [
+    """CREATE TABLE login (loginid INTEGER PRIMARY KEY, login TEXT,
+           passhash TEXT, state TEXT, admin BOOLEAN, unixid INT, nick TEXT,
+           pass_exp TIMESTAMP, acct_exp TIMESTAMP, last_login TIMESTAMP,
+           svn_pass TEXT, email TEXT, fullname TEXT, studentid TEXT,
+           settings TEXT)""",
+    """CREATE TABLE console_session (sessionid INTEGER PRIMARY KEY,
+           loginid INT, host TEXT, port INT, magic TEXT,
+           started TIMESTAMP)""",
+    ]
+
+
+class FakeRegisteredConsole(object):
+    """A registered console, or (with status None) one that has gone
+    away."""
+    def __init__(self, port, status, clean=True):
+        self.host = socket.gethostname()
+        self.port = port
+        self.magic = 'magic%d' % port
+        self._status = status
+        self._clean = clean
+        self.closed = False
+        self.resets = 0
+        self.working_dir = None
+
+    def status(self):
+        if self._status is None:
+            raise ivle.console.ConsoleError("Could not connect")
+        return self._status
+
+    def reset(self, working_dir):
+        self.status()
+        if not self._clean:
+            raise ivle.console.ConsoleError("Could not reset console")
+        self.resets += 1
+        self.working_dir = working_dir
+
+    def close(self):
+        self.status()
+        self.closed = True
+
+
+def status(busy=False, idle=0, rss=1000):
+    return {'pid': 1, 'rss': rss, 'idle': idle, 'busy': busy}
+
+
+class TestConsoleSessions(object):
+    config = {'console': {'max_per_user': 2, 'reap_free_memory': 256,
+                          'reap_idle': 120}}
+
+    def setUp(self):
+        self.store = Store(create_database('sqlite:'))
+        for statement in SCHEMA:
+            self.store.execute(statement)
+        self.user = User(login=u'studenta')
+        self.other = User(login=u'studentb')
+        self.store.add(self.user)
+        self.store.add(self.other)
+
+        # Sessions find their consoles here, by port.
+        self.consoles = {}
+        self.session_console = ivle.console._session_console
+        ivle.console._session_console = \
+            lambda session: self.consoles[session.port]
+        self.memory_available = ivle.console.memory_available
+
+    def tearDown(self):
+        ivle.console._session_console = self.session_console
+        ivle.console.memory_available = self.memory_available
+        self.store.close()
+
+    def register(self, user, port, status, minutes_ago=0, clean=True):
+        cons = FakeRegisteredConsole(port, status, clean)
+        self.consoles[port] = cons
+        session = ivle.console.register_console(self.store, self.config,
+                                                user, cons)
+        session.started = datetime.datetime.now() - \
+            datetime.timedelta(minutes=minutes_ago)
+        return cons
+
+    def ports(self, user=None):
+        sessions = self.store.find(ConsoleSession)
+        if user is not None:
+            sessions = sessions.find(ConsoleSession.user_id == user.id)
+        return sorted(s.port for s in sessions)
+
+    def test_register_caps_consoles_per_user(self):
+        first = self.register(self.user, 3001, status(), 30)
+        second = self.register(self.user, 3002, status(), 20)
+        self.register(self.other, 3003, status(), 10)
+        assert_equal(self.ports(), [3001, 3002, 3003])
+
+        # A third console for the user closes their oldest.
+        self.register(self.user, 3004, status())
+        assert first.closed
+        assert not second.closed
+        assert_equal(self.ports(self.user), [3002, 3004])
+        assert_equal(self.ports(self.other), [3003])
+
+    def test_register_forgets_stale_consoles(self):
+        self.register(self.user, 3001, None, 30)
+        second = self.register(self.user, 3002, status(), 20)
+        self.register(self.user, 3003, status())
+        # The stale console didn't count towards the cap.
+        assert not second.closed
+        assert_equal(self.ports(), [3002, 3003])
+
+    def test_find_console(self):
+        self.register(self.user, 3001, status(), 30)
+        self.register(self.user, 3002, status(busy=True), 20)
+        self.register(self.other, 3003, status(), 10)
+        cons = ivle.console.find_console(self.store, self.user,
+                                         '/home/studenta/a')
+        # The newest console that isn't busy, with nothing left in it from
+        # the page it was started for.
+        assert_equal(cons.port, 3001)
+        assert_equal(cons.resets, 1)
+        assert_equal(cons.working_dir, '/home/studenta/a')
+
+    def test_find_console_skips_unresettable_consoles(self):
+        self.register(self.user, 3001, status(), 30)
+        self.register(self.user, 3002, status(), 20, clean=False)
+        cons = ivle.console.find_console(self.store, self.user,
+                                         '/home/studenta')
+        assert_equal(cons.port, 3001)
+        # The other console is still registered to its page.
+        assert_equal(self.ports(), [3001, 3002])
+
+    def test_find_console_forgets_stale_consoles(self):
+        self.register(self.user, 3001, status(busy=True), 30)
+        self.register(self.user, 3002, None, 20)
+        assert ivle.console.find_console(self.store, self.user,
+                                         '/home/studenta') is None
+        assert_equal(self.ports(), [3001])
+
+    def test_find_console_on_other_hosts(self):
+        self.register(self.user, 3001, status())
+        self.store.find(ConsoleSession).set(host=u'elsewhere')
+        assert ivle.console.find_console(self.store, self.user,
+                                         '/home/studenta') is None
+
+    def test_reap_consoles(self):
+        self.register(self.user, 3001, status(idle=600), 30)
+        self.register(self.user, 3002, status(idle=600, busy=True), 20)
+        self.register(self.other, 3003, status(idle=60), 10)
+        self.register(self.other, 3004, None)
+
+        ivle.console.memory_available = lambda: 1024 ** 3
+        assert_equal(ivle.console.reap_consoles(self.store, self.config), 0)
+        assert_equal(self.ports(), [3001, 3002, 3003, 3004])
+
+        ivle.console.memory_available = lambda: 1024
+        assert_equal(ivle.console.reap_consoles(self.store, self.config), 1)
+        assert self.consoles[3001].closed
+        assert_equal(self.ports(), [3002, 3003])
+
+    def test_console_stats(self):
+        self.register(self.user, 3001, status(rss=1000))
+        self.register(self.user, 3002, status(rss=3000))
+        self.register(self.other, 3003, status(rss=500))
+        self.register(self.other, 3004, None)
+        stats = ivle.console.console_stats(self.store)
+        assert_equal(stats['consoles'], 3)
+        assert_equal(stats['rss'], 4500)
+        assert_equal(stats['users'],
+                     {'studenta': {'consoles': 2, 'rss': 4000},
+                      'studentb': {'consoles': 1, 'rss': 500}})
+        assert_equal([s['user'] for s in stats['sessions']],
+                     ['studenta', 'studenta', 'studentb'])
+        assert_equal(self.ports(), [3001, 3002, 3003])
@@ -0,0 +1,124 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import __builtin__
+import sys
+from cStringIO import StringIO
+
+from nose.tools import assert_equal
+from storm.locals import create_database, Store
+
+import ivle.database
+from ivle.database import Exercise, ExerciseSolutionOutput
+from ivle.webapp.tutorial.test import TestFramework
+
+# Just enough of the schema for an exercise, its tests and the solution
+# output cache.
+SCHEMA = [
+    """CREATE TABLE exercise (identifier TEXT PRIMARY KEY, name TEXT,
+           description TEXT, description_xhtml_cache TEXT, partial TEXT,
+           solution TEXT, include TEXT, num_rows INT)""",
+    """CREATE TABLE test_suite (suiteid INTEGER PRIMARY KEY,
+           exerciseid TEXT, description TEXT, seq_no INT, function TEXT,
+           stdin TEXT)""",
+    """CREATE TABLE test_case (testid INTEGER PRIMARY KEY, suiteid INT,
+           passmsg TEXT, failmsg TEXT, test_default TEXT, seq_no INT)""",
+    """CREATE TABLE test_case_part (partid INTEGER PRIMARY KEY, testid INT,
+           part_type TEXT, test_type TEXT, data TEXT, filename TEXT)""",
+    """CREATE TABLE suite_variable (varid INTEGER PRIMARY KEY, suiteid INT,
+           var_name TEXT, var_value TEXT, var_type TEXT, arg_no INT)""",
+    """CREATE TABLE exercise_solution_output (exerciseid TEXT, key TEXT,
+           data BLOB, PRIMARY KEY (exerciseid, key))""",
+    ]
+
+
+class FakeConsole:
+    """Runs tests in this process, but with builtins of its own that
+    outlive each run, as a console process's do.
+    """
+    def __init__(self):
+        self.builtins = dict(__builtin__.__dict__)
+        self.runs = []
+
+    def run_test(self, globs, code, function=None, args=(), kwargs={},
+                 stdin='', allowed_exceptions=(), want_globals=()):
+        self.runs.append(code)
+        globs['__builtins__'] = self.builtins
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            exec code in globs
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        return {'result': None, 'stdout': output, 'stderr': '',
+                'exception': None, 'function_found': False, 'globals': {}}
+
+
+class TestSolutionCache(object):
+    SOLUTION = u'print abs(-3)'
+    # Breaks abs() for everything run in the console after it.
+    ATTEMPT = u"__builtins__['abs'] = lambda x: x\nprint abs(-3)"
+
+    def setUp(self):
+        self.store = Store(create_database('sqlite:'))
+        for statement in SCHEMA:
+            self.store.execute(statement)
+        self.exercise = Exercise(id=u'ex', name=u'Ex', include=u'',
+                                 solution=self.SOLUTION)
+        self.store.add(self.exercise)
+        # Two suites, differing only in their stdin.
+        for (i, stdin) in enumerate([u'a', u'b']):
+            self.add(ivle.database.TestSuite, suiteid=i,
+                     exercise=self.exercise, description=u'Suite', seq_no=i,
+                     function=u'', stdin=stdin)
+            self.add(ivle.database.TestCase, testid=i, suiteid=i,
+                     passmsg=u'Right', failmsg=u'Wrong',
+                     test_default=u'ignore', seq_no=0)
+            self.add(ivle.database.TestCasePart, partid=i, testid=i,
+                     part_type=u'stdout', test_type=u'match', data=u'')
+        self.store.flush()
+
+    def tearDown(self):
+        self.store.close()
+
+    def add(self, cls, **kwargs):
+        obj = cls()
+        for (name, value) in kwargs.items():
+            setattr(obj, name, value)
+        self.store.add(obj)
+
+    def grade(self, code):
+        console = FakeConsole()
+        suite = TestFramework.TestSuite(self.exercise, console)
+        result = suite.run_tests(code)
+        return (console, result)
+
+    def test_solution_runs_before_attempt(self):
+        (console, result) = self.grade(self.ATTEMPT)
+        assert_equal(console.runs, [self.SOLUTION, self.SOLUTION,
+                                    self.ATTEMPT, self.ATTEMPT])
+        assert_equal([case['passed'] for case in result['cases']],
+                     [False, False])
+
+    def test_cached_output_is_the_solutions(self):
+        self.grade(self.ATTEMPT)
+        (console, result) = self.grade(self.SOLUTION)
+        # Both outputs came from the cache, and are still right.
+        assert_equal(console.runs, [self.SOLUTION, self.SOLUTION])
+        assert_equal(result['passed'], True)
+        assert_equal(self.store.find(ExerciseSolutionOutput).count(), 2)
@@ -0,0 +1,165 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from nose.tools import assert_equal, raises
+
+import ivle.console
+import ivle.worksheet.grader
+import ivle.worksheet.utils
+
+CONFIG = {
+    'grading': {'workers': 2, 'max_per_user': 1, 'max_queued': 2,
+                'runners': 2, 'job_ttl': 600},
+    'console': {'pool_max_age': 600},
+    }
+
+
+class TestGrader(object):
+    def setUp(self):
+        # The workers aren't started; jobs are taken with _next_job.
+        self.grader = ivle.worksheet.grader.Grader(CONFIG)
+
+    def test_per_user_limit(self):
+        a1 = self.grader.submit(1, 10, 'a1')
+        a2 = self.grader.submit(1, 10, 'a2')
+        b1 = self.grader.submit(2, 10, 'b1')
+        assert self.grader._next_job() is a1
+        # User 1 is at their limit, so user 2's later job goes first.
+        assert self.grader._next_job() is b1
+        assert self.grader._next_job() is None
+        assert_equal(a2.state, 'queued')
+        assert_equal(self.grader.stats()['running'], 2)
+        assert_equal(self.grader.stats()['queued'], 1)
+
+    @raises(ivle.worksheet.grader.GraderBusy)
+    def test_queue_limit(self):
+        for i in range(3):
+            self.grader.submit(1, 10, 'code')
+
+    def test_jobs_are_private(self):
+        job = self.grader.submit(1, 10, 'code')
+        assert self.grader.get(job.id, 1) is job
+        assert self.grader.get(job.id, 2) is None
+        assert_equal(job.to_dict(), {'job': job.id, 'state': 'queued'})
+
+
+class FakeUser(object):
+    def __init__(self, id, login):
+        self.id = id
+        self.login = login
+
+
+class FakeWorksheetExercise(object):
+    exercise = 'exercise'
+
+
+class FakeStore(object):
+    def __init__(self, users):
+        self.users = users
+
+    def get(self, cls, id):
+        if cls is ivle.worksheet.grader.User:
+            return self.users.get(id)
+        return FakeWorksheetExercise()
+
+    def rollback(self):
+        pass
+
+
+class FakeRunner(object):
+    """A console whose state can (or, with dirty set, can't) be reset."""
+    def __init__(self, config, user, jail_path, working_dir):
+        self.login = user.login
+        self.working_dir = working_dir
+        self.dirty = False
+        self.resets = 0
+        self.closed = False
+
+    def reset(self, working_dir):
+        if self.dirty:
+            raise ivle.console.ConsoleError("Could not reset console")
+        self.resets += 1
+        self.working_dir = working_dir
+
+    def close(self):
+        self.closed = True
+
+
+class RecordlessGrader(ivle.worksheet.grader.Grader):
+    def _record_attempt(self, store, user, worksheet_exercise, job,
+                        complete):
+        pass
+
+
+class TestRunnerReuse(object):
+    def setUp(self):
+        self.grader = RecordlessGrader(dict(CONFIG, paths={'jails':
+                                                   {'mounts': '/jails'}},
+                                       tutorial={'use_progress_table': True}))
+        self.store = FakeStore({1: FakeUser(1, 'studenta'),
+                                2: FakeUser(2, 'studentb')})
+        # The runner used for each job, in order.
+        self.runners = []
+
+        def test_exercise_submission(config, user, exercise, code, console):
+            assert_equal(console.login, user.login)
+            self.runners.append(console)
+            if code == 'dirty':
+                console.dirty = True
+            return {'passed': True}
+
+        self.saved = (ivle.console.Console,
+                      ivle.worksheet.utils.test_exercise_submission,
+                      ivle.worksheet.utils.get_exercise_status)
+        ivle.console.Console = FakeRunner
+        ivle.worksheet.utils.test_exercise_submission = \
+            test_exercise_submission
+        ivle.worksheet.utils.get_exercise_status = \
+            lambda store, user, worksheet_exercise, use_progress: (True, 1)
+
+    def tearDown(self):
+        (ivle.console.Console,
+         ivle.worksheet.utils.test_exercise_submission,
+         ivle.worksheet.utils.get_exercise_status) = self.saved
+
+    def grade(self, user_id, code='code'):
+        job = ivle.worksheet.grader.GradingJob(user_id, 10, code)
+        return self.grader._grade(self.store, job)
+
+    def test_reused_for_the_same_user(self):
+        assert_equal(self.grade(1)['completed'], True)
+        self.grade(1)
+        self.grade(2)
+        (first, second, other) = self.runners
+        assert first is second
+        assert other is not first
+        # Reset in the user's home directory before it was reused.
+        assert_equal(first.resets, 1)
+        assert_equal(first.working_dir, '/home/studenta')
+        stats = self.grader.stats()
+        assert_equal(stats['runner_hits'], 1)
+        assert_equal(stats['runner_misses'], 2)
+        assert_equal(stats['idle_runners'], 2)
+
+    def test_recycled_if_reset_fails(self):
+        self.grade(1, 'dirty')
+        self.grade(1)
+        (first, second) = self.runners
+        assert first.closed
+        assert second is not first
+        assert_equal(self.grader.stats()['runner_hits'], 0)
+        assert_equal(self.grader.stats()['idle_runners'], 1)
@@ -0,0 +1,58 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+import ivle.makeuser
+
+
+class TestAuthzFragments(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conf = os.path.join(self.dir, 'svn.conf')
+        self.chown = ivle.makeuser.chown_to_webserver
+        ivle.makeuser.chown_to_webserver = lambda filename: None
+        self.fragments = ivle.makeuser.AuthzFragments(self.conf)
+
+    def tearDown(self):
+        ivle.makeuser.chown_to_webserver = self.chown
+        shutil.rmtree(self.dir)
+
+    def update(self, name, stamp, text):
+        self.fragments.update(name, stamp, lambda f: f.write(text))
+
+    def test_only_changed_fragments_are_regenerated(self):
+        self.update('a', 'one', '[a:/]\n')
+        self.update('b', 'one', '[b:/]\n')
+        self.update('a', 'one', 'not written\n')
+        self.update('b', 'two', '[b2:/]\n')
+        assert_equal(self.fragments.regenerated, 3)
+        assert_equal(self.fragments.stamp_of('b'), 'two')
+        assert self.fragments.stamp_of('c') is None
+
+    def test_assemble(self):
+        self.update('a', 'one', '[a:/]\n')
+        self.update('b', 'one', '[b:/]\n')
+        self.update('c', 'one', '[c:/]\n')
+        self.fragments.assemble('# header\n', ['b', 'a'])
+        assert_equal(open(self.conf).read(), '# header\n[b:/]\n[a:/]\n')
+        # Fragments that weren't used are discarded.
+        assert_equal(sorted(os.listdir(self.conf + '.d')), ['a', 'b'])
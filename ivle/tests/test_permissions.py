@@ -0,0 +1,109 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from nose.tools import assert_equal
+from storm.locals import create_database, Store
+from storm.tracer import install_tracer, remove_tracer
+
+from ivle.database import Exercise, Offering, ProjectGroup, User
+from ivle.tests.test_worksheet_utils import QueryCounter
+
+SCHEMA = [
+    """CREATE TABLE login (loginid INTEGER PRIMARY KEY, login TEXT,
+           passhash TEXT, state TEXT, admin BOOLEAN, unixid INT, nick TEXT,
+           pass_exp TIMESTAMP, acct_exp TIMESTAMP, last_login TIMESTAMP,
+           svn_pass TEXT, email TEXT, fullname TEXT, studentid TEXT,
+           settings TEXT)""",
+    """CREATE TABLE subject (subjectid INTEGER PRIMARY KEY, subj_code TEXT,
+           subj_name TEXT, subj_short_name TEXT)""",
+    """CREATE TABLE semester (semesterid INTEGER PRIMARY KEY, year TEXT,
+           code TEXT, url_name TEXT, display_name TEXT, state TEXT)""",
+    """CREATE TABLE offering (offeringid INTEGER PRIMARY KEY, subject INT,
+           semesterid INT, description TEXT, url TEXT,
+           show_worksheet_marks BOOLEAN, worksheet_cutoff TIMESTAMP,
+           groups_student_permissions TEXT)""",
+    """CREATE TABLE enrolment (loginid INT, offeringid INT, role TEXT,
+           notes TEXT, active BOOLEAN, PRIMARY KEY (loginid, offeringid))""",
+    """CREATE TABLE project_set (projectsetid INTEGER PRIMARY KEY,
+           offeringid INT, max_students_per_group INT)""",
+    """CREATE TABLE project_group (groupid INTEGER PRIMARY KEY,
+           groupnm TEXT, projectsetid INT, nick TEXT, createdby INT,
+           epoch TIMESTAMP)""",
+    """CREATE TABLE group_member (loginid INT, groupid INT,
+           PRIMARY KEY (loginid, groupid))""",
+    ]
+
+DATA = [
+    "INSERT INTO login (loginid, login, admin) VALUES (1, 'student', 0)",
+    "INSERT INTO login (loginid, login, admin) VALUES (2, 'other', 0)",
+    "INSERT INTO subject (subjectid) VALUES (1)",
+    "INSERT INTO semester (semesterid) VALUES (1)",
+    "INSERT INTO offering (offeringid, subject, semesterid) VALUES (1, 1, 1)",
+    "INSERT INTO offering (offeringid, subject, semesterid) VALUES (2, 1, 1)",
+    "INSERT INTO offering (offeringid, subject, semesterid) VALUES (3, 1, 1)",
+    "INSERT INTO enrolment VALUES (1, 1, 'student', NULL, 1)",
+    "INSERT INTO enrolment VALUES (1, 2, 'tutor', NULL, 0)",
+    "INSERT INTO enrolment VALUES (2, 3, 'lecturer', NULL, 1)",
+    "INSERT INTO project_set VALUES (1, 1, 3)",
+    "INSERT INTO project_set VALUES (2, 3, 3)",
+    "INSERT INTO project_group (groupid, projectsetid) VALUES (1, 1)",
+    "INSERT INTO project_group (groupid, projectsetid) VALUES (2, 1)",
+    "INSERT INTO project_group (groupid, projectsetid) VALUES (3, 2)",
+    "INSERT INTO group_member VALUES (1, 1)",
+    "INSERT INTO group_member VALUES (2, 2)",
+    "INSERT INTO group_member VALUES (2, 3)",
+    ]
+
+CONFIG = {'policy': {'tutors_can_enrol_students': False,
+                     'tutors_can_edit_worksheets': True,
+                     'tutors_can_admin_groups': False}}
+
+class TestLoadMemberships(object):
+    def setUp(self):
+        self.store = Store(create_database('sqlite:'))
+        for statement in SCHEMA + DATA:
+            self.store.execute(statement)
+
+    def permissions(self, user):
+        """Return the user's permissions over each offering, group and all
+        exercises."""
+        return ([self.store.get(Offering, i).get_permissions(user, CONFIG)
+                 for i in (1, 2, 3)] +
+                [self.store.get(ProjectGroup, i).get_permissions(user, CONFIG)
+                 for i in (1, 2, 3)] +
+                [Exercise.global_permissions(user, CONFIG)])
+
+    def test_same_permissions(self):
+        for user_id in (1, 2):
+            user = self.store.get(User, user_id)
+            expected = self.permissions(user)
+            user.load_memberships()
+            assert_equal(self.permissions(user), expected)
+
+    def test_one_query(self):
+        user = self.store.get(User, 1)
+        self.permissions(user)
+        counter = QueryCounter()
+        install_tracer(counter)
+        try:
+            user.load_memberships()
+            self.permissions(user)
+        finally:
+            remove_tracer(counter)
+        assert_equal(counter.count, 1)
+        assert_equal(sorted(user._memberships[0]), [1, 2])
+        assert_equal(user._memberships[1], set([1]))
@@ -0,0 +1,131 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import time
+
+from nose.tools import assert_equal
+
+from ivle.dispatch.request import (CookieSession, SQLiteSession,
+    SESSION_COOKIE)
+
+
+class SessionRequest(object):
+    '''A request carrying only what sessions use, recording the cookies
+    they set.'''
+    def __init__(self, cookie=None):
+        headers_in = {}
+        if cookie is not None:
+            headers_in['Cookie'] = '%s=%s' % (SESSION_COOKIE, cookie)
+        self.headers_in = headers_in
+        self.cookies = []
+
+    def is_https(self):
+        return False
+
+    def add_cookie(self, name, value, **attributes):
+        assert_equal(name, SESSION_COOKIE)
+        self.cookies.append(value)
+
+class TestCookieSession(object):
+    def make(self, cookie=None, secret='sekrit', timeout=60):
+        return CookieSession(SessionRequest(cookie), timeout, secret)
+
+    def save(self, session):
+        session.save()
+        return session._req.cookies[-1]
+
+    def test_new(self):
+        assert_equal(self.make(), {})
+
+    def test_round_trip(self):
+        session = self.make()
+        session['login'] = u'jdoe'
+        session['clipboard'] = {'mode': 'copy', 'files': ['a b', 'c;d']}
+        assert_equal(self.make(self.save(session)), session)
+
+    def test_tampered(self):
+        session = self.make()
+        session['login'] = u'jdoe'
+        cookie = self.save(session)
+        other = self.make()
+        other['login'] = u'admin'
+        forged = self.save(other).rsplit('.', 1)[0] + '.' + \
+                 cookie.rsplit('.', 1)[1]
+        assert_equal(self.make(forged), {})
+        assert_equal(self.make('garbage'), {})
+
+    def test_wrong_secret(self):
+        session = self.make()
+        session['login'] = u'jdoe'
+        assert_equal(self.make(self.save(session), secret='other'), {})
+
+    def test_expired(self):
+        session = self.make(timeout=-1)
+        session['login'] = u'jdoe'
+        assert_equal(self.make(self.save(session)), {})
+
+    def test_invalidate(self):
+        session = self.make()
+        session['login'] = u'jdoe'
+        session.invalidate()
+        assert_equal(session, {})
+        assert_equal(session._req.cookies[-1], '')
+
+class TestSQLiteSession(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sessions.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make(self, cookie=None, timeout=60):
+        return SQLiteSession(SessionRequest(cookie), timeout, self.path)
+
+    def test_round_trip(self):
+        session = self.make()
+        assert_equal(session, {})
+        session['login'] = u'jdoe'
+        session.save()
+        sid = session._req.cookies[-1]
+        assert_equal(self.make(sid), {'login': u'jdoe'})
+
+        # Saving again keeps the same ID.
+        session['login'] = u'other'
+        session.save()
+        assert_equal(session._req.cookies, [sid])
+        assert_equal(self.make(sid), {'login': u'other'})
+
+    def test_unknown(self):
+        assert_equal(self.make('0' * 32), {})
+
+    def test_expired(self):
+        session = self.make(timeout=-1)
+        session['login'] = u'jdoe'
+        session.save()
+        assert_equal(self.make(session._req.cookies[-1]), {})
+
+    def test_invalidate(self):
+        session = self.make()
+        session['login'] = u'jdoe'
+        session.save()
+        sid = session._req.cookies[-1]
+        self.make(sid).invalidate()
+        assert_equal(self.make(sid), {})
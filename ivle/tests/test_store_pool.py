@@ -0,0 +1,100 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import threading
+import time
+
+from nose.tools import assert_equal, raises
+from storm.locals import create_database, Store
+
+from ivle.database import StorePool, StorePoolTimeout
+
+CONFIG = {
+    'database': {'pool_size': 2, 'pool_timeout': 1.0,
+                 'pool_check_interval': 60},
+    }
+
+class SQLiteStorePool(StorePool):
+    def _connect(self):
+        self.connects += 1
+        store = Store(create_database('sqlite:'))
+        store.execute('CREATE TABLE t (x INTEGER)')
+        store.commit()
+        return store
+
+class BrokenStore(object):
+    def __init__(self):
+        self.closed = False
+
+    def execute(self, statement):
+        raise Exception('connection lost')
+
+    def close(self):
+        self.closed = True
+
+class TestStorePool(object):
+    def pool(self, **kwargs):
+        return SQLiteStorePool(CONFIG, **kwargs)
+
+    def test_reuse(self):
+        pool = self.pool()
+        store = pool.check_out()
+        pool.check_in(store)
+        assert pool.check_out() is store
+        assert_equal(pool.stats()['connects'], 1)
+
+    def test_check_in_abandons_transaction(self):
+        pool = self.pool(size=1)
+        store = pool.check_out()
+        store.execute('INSERT INTO t VALUES (1)')
+        pool.check_in(store)
+        store = pool.check_out()
+        assert_equal(store.execute('SELECT COUNT(*) FROM t').get_one(), (0,))
+
+    @raises(StorePoolTimeout)
+    def test_timeout(self):
+        pool = self.pool(size=1, timeout=0.05)
+        pool.check_out()
+        pool.check_out()
+
+    def test_wait(self):
+        pool = self.pool(size=1)
+        store = pool.check_out()
+        # Another request finishes while we wait.
+        timer = threading.Timer(0.05, pool.check_in, (store,))
+        timer.start()
+        assert pool.check_out() is store
+        timer.join()
+        assert_equal(pool.stats()['waits'], 1)
+        assert pool.stats()['wait_time_max'] > 0
+
+    def test_dead_store_replaced(self):
+        pool = self.pool(check_interval=0)
+        broken = BrokenStore()
+        pool.idle.append((time.time() - 1, broken))
+        store = pool.check_out()
+        assert store is not broken
+        assert broken.closed
+        assert_equal(pool.stats()['check_failures'], 1)
+        assert_equal(pool.stats()['checked_out'], 1)
+
+    def test_unpooled(self):
+        pool = self.pool(size=0)
+        store = pool.check_out()
+        pool.check_in(store)
+        assert pool.check_out() is not store
+        assert_equal(pool.stats()['idle'], 0)
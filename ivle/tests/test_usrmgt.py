@@ -0,0 +1,76 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import threading
+
+from nose.tools import assert_equal, raises
+
+import ivle.usrmgt
+
+
+class TestRebuildQueue(object):
+    def setUp(self):
+        self.rebuilt = []
+        self.fail = False
+        # Rebuilds of 'a' wait for this, so requests can pile up.
+        self.release = threading.Event()
+        self.release.set()
+        self.queue = ivle.usrmgt.RebuildQueue([('a', self.rebuild_a),
+                                               ('b', self.rebuild_b)])
+        self.queue.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.queue.stop()
+
+    def rebuild_a(self):
+        self.release.wait()
+        self.rebuilt.append('a')
+        if self.fail:
+            raise IOError('disk full')
+
+    def rebuild_b(self):
+        self.rebuilt.append('b')
+
+    def test_requests_are_merged(self):
+        self.release.clear()
+        first = self.queue.request(['a', 'b'])
+        tokens = [self.queue.request(['a', 'b']) for i in range(10)]
+        assert_equal(self.queue.state(tokens[-1]), 'pending')
+        self.release.set()
+        for token in [first] + tokens:
+            assert_equal(self.queue.wait(token, 5), 'done')
+        # The first request may be rebuilt alone; the rest are merged.
+        assert len(self.rebuilt) <= 4
+        assert_equal(self.queue.stats()['requests'], 11)
+
+    def test_failure(self):
+        self.fail = True
+        token = self.queue.request(['a'])
+        assert_equal(self.queue.wait(token, 5), 'failed')
+        self.fail = False
+        token = self.queue.request(['a'])
+        assert_equal(self.queue.wait(token, 5), 'done')
+
+    def test_unknown_token(self):
+        token = self.queue.request(['b'])
+        token['queue'] = 'elsewhere'
+        assert_equal(self.queue.state(token), 'unknown')
+
+    @raises(ivle.usrmgt.UsrmgtError)
+    def test_unknown_config(self):
+        self.queue.request(['c'])
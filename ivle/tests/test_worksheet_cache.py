@@ -0,0 +1,91 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import genshi
+from nose.tools import assert_equal
+
+from ivle.webapp.tutorial.cache import (placeholder, WorksheetBody,
+    WorksheetBodyCache, worksheet_fingerprint)
+
+
+class FakeWorksheet(object):
+    format = u'xml'
+    data = u'<worksheet><exercise src="a"/></worksheet>'
+
+class FakeExercise(object):
+    def __init__(self, id, description):
+        self.id = id
+        self.name = u'Exercise'
+        self.description = description
+        self.partial = None
+        self.num_rows = 4
+
+
+class TestWorksheetBody(object):
+    def test_fill(self):
+        # Placeholders can't be parsed from XML, so substitute them in.
+        events = []
+        for (kind, data, pos) in genshi.XML(
+                u'<div class="CLASS">Attempts: <span>SAVE</span></div>'):
+            if kind is genshi.core.TEXT and data == u'SAVE':
+                data = placeholder('save', 0)
+            elif kind is genshi.core.START and data[0].localname == 'div':
+                data = (data[0], data[1] | [('class',
+                                             placeholder('class', 0))])
+            events.append((kind, data, pos))
+        body = WorksheetBody(events, [(u'a', u'Exercise')])
+        assert_equal(len(body.slots), 2)
+        values = {'class_0': u'complete', 'save_0': u'<a> & b'}
+        assert_equal(body.generate(values).render('xhtml'),
+            '<div class="complete">Attempts: <span>&lt;a&gt; &amp; b</span>'
+            '</div>')
+        # The cached events are left alone.
+        assert_equal(body.generate({'class_0': u'x', 'save_0': u'y'}
+                                   ).render('xhtml'),
+            '<div class="x">Attempts: <span>y</span></div>')
+
+    def test_fingerprint(self):
+        worksheet = FakeWorksheet()
+        exercises = [FakeExercise(u'a', u'A'), FakeExercise(u'b', None)]
+        fingerprint = worksheet_fingerprint(worksheet, exercises, False)
+        assert_equal(fingerprint, worksheet_fingerprint(worksheet,
+            list(reversed(exercises)), False))
+        assert fingerprint != worksheet_fingerprint(worksheet, exercises,
+                                                    True)
+        exercises[1].description = u'B'
+        assert fingerprint != worksheet_fingerprint(worksheet, exercises,
+                                                    False)
+
+
+class TestWorksheetBodyCache(object):
+    def test_rebuilds_on_new_fingerprint(self):
+        cache = WorksheetBodyCache(2)
+        assert_equal(cache.get(1, 'x', lambda: 'one'), 'one')
+        assert_equal(cache.get(1, 'x', lambda: 'two'), 'one')
+        assert_equal(cache.get(1, 'y', lambda: 'three'), 'three')
+        assert_equal(len(cache.bodies), 1)
+        assert_equal((cache.hits, cache.misses), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        cache = WorksheetBodyCache(2)
+        cache.get(1, 'x', lambda: 'one')
+        cache.get(2, 'x', lambda: 'two')
+        cache.get(1, 'x', lambda: 'one')
+        cache.get(3, 'x', lambda: 'three')
+        assert_equal(sorted(cache.bodies), [1, 3])
+        cache.forget(1)
+        assert_equal(sorted(cache.bodies), [3])
@@ -0,0 +1,234 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import datetime
+
+from nose.tools import assert_equal
+from storm.locals import create_database, Store
+from storm.tracer import install_tracer, remove_tracer
+
+from ivle.database import (Exercise, ExerciseAttempt, ExerciseProgress,
+                           ExerciseSave, WorksheetExercise)
+from ivle.worksheet.utils import (_status_from_progress,
+    get_exercise_statistics, get_exercise_status, get_exercise_stored_text,
+    get_worksheet_exercise_states, get_worksheet_exercise_statistics,
+    median_attempts, record_exercise_attempt, refresh_exercise_statistics,
+    set_exercise_attempt_active)
+
+# Just enough of the schema for the exercise state queries.
+SCHEMA = [
+    """CREATE TABLE login (loginid INTEGER PRIMARY KEY, login TEXT,
+           passhash TEXT, state TEXT, admin BOOLEAN, unixid INT, nick TEXT,
+           pass_exp TIMESTAMP, acct_exp TIMESTAMP, last_login TIMESTAMP,
+           svn_pass TEXT, email TEXT, fullname TEXT, studentid TEXT,
+           settings TEXT)""",
+    """CREATE TABLE exercise (identifier TEXT PRIMARY KEY, name TEXT,
+           description TEXT, description_xhtml_cache TEXT, partial TEXT,
+           solution TEXT, include TEXT, num_rows INT)""",
+    """CREATE TABLE worksheet_exercise (ws_ex_id INTEGER PRIMARY KEY,
+           worksheetid INT, exerciseid TEXT, seq_no INT, active BOOLEAN,
+           optional BOOLEAN)""",
+    """CREATE TABLE exercise_save (loginid INT, ws_ex_id INT,
+           date TIMESTAMP, text TEXT, PRIMARY KEY (loginid, ws_ex_id))""",
+    """CREATE TABLE exercise_attempt (loginid INT, ws_ex_id INT,
+           date TIMESTAMP, attempt TEXT, complete BOOLEAN, active BOOLEAN,
+           PRIMARY KEY (loginid, ws_ex_id, date))""",
+    """CREATE TABLE exercise_progress (loginid INT, ws_ex_id INT,
+           first_success TIMESTAMP, attempts_to_success INT,
+           total_attempts INT, last_attempt TIMESTAMP,
+           PRIMARY KEY (loginid, ws_ex_id))""",
+    """CREATE TABLE exercise_statistics (ws_ex_id INTEGER PRIMARY KEY,
+           attempted INT, completed INT)""",
+    """CREATE TABLE exercise_success_count (ws_ex_id INT, attempts INT,
+           users INT, PRIMARY KEY (ws_ex_id, attempts))""",
+    ]
+
+
+def progress(first_success, attempts_to_success, total_attempts,
+             last_attempt):
+    return ExerciseProgress(first_success=first_success,
+                            attempts_to_success=attempts_to_success,
+                            total_attempts=total_attempts,
+                            last_attempt=last_attempt)
+
+def day(n):
+    return datetime.datetime(2010, 8, n)
+
+
+class TestStatusFromProgress(object):
+    def test_no_progress(self):
+        assert_equal(_status_from_progress(None, None), (False, 0))
+        assert_equal(_status_from_progress(None, day(1)), (False, 0))
+
+    def test_completed(self):
+        p = progress(day(3), 2, 5, day(9))
+        assert_equal(_status_from_progress(p, None), (True, 2))
+        assert_equal(_status_from_progress(p, day(3)), (True, 2))
+        assert_equal(_status_from_progress(p, day(20)), (True, 2))
+
+    def test_not_completed(self):
+        p = progress(None, None, 4, day(9))
+        assert_equal(_status_from_progress(p, None), (False, 4))
+        assert_equal(_status_from_progress(p, day(9)), (False, 4))
+
+    def test_unanswerable(self):
+        # Before the first success, the attempts must be counted.
+        assert _status_from_progress(progress(day(3), 2, 5, day(9)),
+                                     day(2)) is None
+        assert _status_from_progress(progress(None, None, 4, day(9)),
+                                     day(8)) is None
+
+
+class FakeObject(object):
+    def __init__(self, id):
+        self.id = id
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        self.count += 1
+
+    def connection_raw_execute_error(self, connection, raw_cursor,
+                                     statement, params, error):
+        pass
+
+    def connection_raw_execute_success(self, connection, raw_cursor,
+                                       statement, params):
+        pass
+
+
+class TestWorksheetExerciseStates(object):
+    def setUp(self):
+        self.store = Store(create_database('sqlite:'))
+        for statement in SCHEMA:
+            self.store.execute(statement)
+        self.store.execute("INSERT INTO login (loginid) VALUES (1)")
+        self.store.execute("INSERT INTO login (loginid) VALUES (2)")
+        self.user = FakeObject(1)
+        self.other = FakeObject(2)
+
+    def tearDown(self):
+        self.store.close()
+
+    def make_worksheet(self, id, exercises):
+        """Make a worksheet of some exercises, with a few saves and
+        attempts at each by two users."""
+        for i in range(exercises):
+            exercise = Exercise(id=u'ex%d-%d' % (id, i), name=u'Exercise',
+                                partial=u'partial')
+            worksheet_exercise = WorksheetExercise(worksheet_id=id,
+                exercise=exercise, seq_no=i, active=True, optional=False)
+            self.store.add(worksheet_exercise)
+            self.store.flush()
+            for (user, n) in ((self.user, i), (self.other, 2)):
+                for j in range(n):
+                    attempt = ExerciseAttempt(user_id=user.id,
+                        worksheet_exercise=worksheet_exercise,
+                        date=day(j + 1), text=u'attempt %d' % j,
+                        complete=j == 1, active=j != 2)
+                    self.store.add(attempt)
+                if i % 2:
+                    self.store.add(ExerciseSave(user_id=user.id,
+                        worksheet_exercise=worksheet_exercise,
+                        date=day(3), text=u'save'))
+        self.store.flush()
+        return FakeObject(id)
+
+    def count_queries(self, worksheet):
+        counter = QueryCounter()
+        install_tracer(counter)
+        try:
+            states = get_worksheet_exercise_states(self.store, self.user,
+                                                   worksheet, statistics=True)
+        finally:
+            remove_tracer(counter)
+        return states, counter.count
+
+    def test_query_count_is_constant(self):
+        small, small_count = self.count_queries(self.make_worksheet(1, 2))
+        large, large_count = self.count_queries(self.make_worksheet(2, 12))
+        assert_equal(len(small), 2)
+        assert_equal(len(large), 12)
+        assert_equal(small_count, large_count)
+        assert small_count <= 7, small_count
+
+    def test_matches_single_exercise_queries(self):
+        states = get_worksheet_exercise_states(self.store, self.user,
+            self.make_worksheet(1, 6), statistics=True)
+        for state in states.values():
+            worksheet_exercise = state['worksheet_exercise']
+            assert_equal((state['complete'], state['attempts']),
+                get_exercise_status(self.store, self.user,
+                                    worksheet_exercise))
+            assert_equal(state['save'], get_exercise_stored_text(self.store,
+                self.user, worksheet_exercise))
+            assert_equal(state['stats'], get_exercise_statistics(self.store,
+                worksheet_exercise))
+
+
+class TestExerciseStatistics(object):
+    def setUp(self):
+        self.store = Store(create_database('sqlite:'))
+        for statement in SCHEMA:
+            self.store.execute(statement)
+
+    def tearDown(self):
+        self.store.close()
+
+    def attempt(self, user_id, n, complete):
+        attempt = ExerciseAttempt(user_id=user_id, ws_ex_id=1, date=day(n),
+                                  text=u'code', complete=complete,
+                                  active=True)
+        record_exercise_attempt(self.store, attempt)
+        return attempt
+
+    def statistics(self):
+        return get_worksheet_exercise_statistics(self.store, [1])[1]
+
+    def test_median_attempts(self):
+        assert_equal(median_attempts([]), None)
+        assert_equal(median_attempts([(3, 1)]), 3)
+        assert_equal(median_attempts([(1, 1), (2, 1)]), 1.5)
+        assert_equal(median_attempts([(1, 2), (4, 1)]), 1)
+
+    def test_maintained_with_attempts(self):
+        self.attempt(1, 1, False)
+        first = self.attempt(1, 2, True)
+        self.attempt(1, 3, True)
+        self.attempt(2, 1, True)
+        self.attempt(3, 1, False)
+        assert_equal(self.statistics(), {'attempted': 3, 'completed': 2,
+            'successes': [(1, 1), (2, 1)], 'median': 1.5})
+
+        # Inactive attempts don't count, so without the first success user 1
+        # took two attempts: the failure and the later success.
+        set_exercise_attempt_active(self.store, first, False)
+        assert_equal(self.statistics()['successes'], [(1, 1), (2, 1)])
+        # And without any attempts they don't count at all.
+        for attempt in self.store.find(ExerciseAttempt, user_id=2):
+            set_exercise_attempt_active(self.store, attempt, False)
+        assert_equal(self.statistics(), {'attempted': 2, 'completed': 1,
+            'successes': [(2, 1)], 'median': 2})
+
+        incremental = self.statistics()
+        refresh_exercise_statistics(self.store, 1)
+        assert_equal(self.statistics(), incremental)
+        assert_equal(get_exercise_statistics(self.store, FakeObject(1),
+                                             use_progress=True), (1, 2))
@@ -0,0 +1,191 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import StringIO
+import os
+import tempfile
+import time
+import urllib
+
+from nose.tools import assert_equal, raises
+
+from ivle.dispatch.wsgi import (FieldStorage, Headers, ServerReturn,
+                                WSGIRequest)
+
+CONFIG = {'urls': {'public_host': 'public.example.com'}}
+
+def make_environ(uri='/', method='GET', body='', content_type=None,
+                 **headers):
+    (path, _, query) = uri.partition('?')
+    environ = {'REQUEST_METHOD': method,
+               'SCRIPT_NAME': '',
+               'PATH_INFO': urllib.unquote(path),
+               'QUERY_STRING': query,
+               'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80',
+               'HTTP_HOST': 'ivle.example.com:8080',
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.url_scheme': 'http',
+               'wsgi.input': StringIO.StringIO(body),
+               }
+    if content_type is not None:
+        environ['CONTENT_TYPE'] = content_type
+    for (name, value) in headers.items():
+        environ['HTTP_' + name.upper()] = value
+    return environ
+
+class TestHeaders:
+    def test_case_insensitive(self):
+        headers = Headers([('Content-Type', 'text/plain')])
+        assert_equal(headers['content-type'], 'text/plain')
+        assert 'CONTENT-TYPE' in headers
+        assert 'Location' not in headers
+        assert_equal(headers.get('Location'), None)
+
+    def test_add_and_set(self):
+        headers = Headers()
+        headers.add('Set-Cookie', 'a=1')
+        headers.add('Set-Cookie', 'b=2')
+        headers['X-Thing'] = 'one'
+        headers['x-thing'] = 'two'
+        assert_equal(headers.items(), [('Set-Cookie', 'a=1'),
+                                       ('Set-Cookie', 'b=2'),
+                                       ('x-thing', 'two')])
+
+class TestFieldStorage:
+    def fields(self, **kwargs):
+        environ = make_environ(**kwargs)
+        return FieldStorage(environ, environ['wsgi.input'])
+
+    def test_query(self):
+        fields = self.fields(uri='/?r=5&path=a&path=b&empty=')
+        assert_equal(fields.getfirst('r'), '5')
+        assert_equal(fields.getfirst('r').value, '5')
+        assert_equal(fields.getlist('path'), ['a', 'b'])
+        assert_equal(fields.getfirst('empty'), '')
+        assert_equal(fields.getfirst('missing', 'x'), 'x')
+        assert_equal(dict(fields), {'r': '5', 'path': ['a', 'b'],
+                                    'empty': ''})
+
+    def test_post(self):
+        fields = self.fields(uri='/?a=1', method='POST', body='b=2&c=%20',
+                     content_type='application/x-www-form-urlencoded')
+        assert_equal(sorted(fields.keys()), ['a', 'b', 'c'])
+        assert_equal(fields.getfirst('c'), ' ')
+
+    def test_upload(self):
+        body = ('--XX\r\n'
+                'Content-Disposition: form-data; name="path"\r\n\r\n'
+                'dir\r\n'
+                '--XX\r\n'
+                'Content-Disposition: form-data; name="data"; '
+                'filename="a.py"\r\n'
+                'Content-Type: text/plain\r\n\r\n'
+                'print 1\r\n'
+                '--XX--\r\n')
+        fields = self.fields(method='POST', body=body,
+                             content_type='multipart/form-data; boundary=XX')
+        assert_equal(fields.getfirst('path'), 'dir')
+        data = fields.getfirst('data')
+        assert_equal(data.filename, 'a.py')
+        assert_equal(data.file.read(), 'print 1')
+
+class TestWSGIRequest:
+    def test_attributes(self):
+        req = WSGIRequest(make_environ('/files/jdoe/a%20b?x=1',
+                                       Referer='http://x/'), CONFIG)
+        assert_equal(req.method, 'GET')
+        assert_equal(req.uri, '/files/jdoe/a b')
+        assert_equal(req.unparsed_uri, '/files/jdoe/a%20b?x=1')
+        assert_equal(req.app, 'files')
+        assert_equal(req.path, 'jdoe/a b')
+        assert_equal(req.hostname, 'ivle.example.com')
+        assert_equal(req.headers_in['referer'], 'http://x/')
+        assert not req.publicmode
+        assert not req.is_https()
+
+    def test_public_https(self):
+        environ = make_environ(X_FORWARDED_PROTO='https')
+        environ['HTTP_HOST'] = 'public.example.com'
+        req = WSGIRequest(environ, CONFIG)
+        assert req.publicmode
+        assert req.is_https()
+
+    def test_response(self):
+        req = WSGIRequest(make_environ(), CONFIG)
+        req.status = 404
+        req.content_type = 'text/html'
+        req.headers_out.add('X-IVLE-Error', 'Gone')
+        req.write(u'caf\xe9')
+        req.write('!')
+        assert_equal(req.status_line(), '404 Not Found')
+        assert_equal(req.get_headers(), [('X-IVLE-Error', 'Gone'),
+                                         ('Content-Type', 'text/html')])
+        assert_equal(''.join(req.iter_body()), 'caf\xc3\xa9!')
+
+    def test_sendfile(self):
+        (fd, filename) = tempfile.mkstemp()
+        try:
+            os.write(fd, 'x' * (WSGIRequest.BLOCK_SIZE + 1))
+            os.close(fd)
+            req = WSGIRequest(make_environ(), CONFIG)
+            req.write('a')
+            req.sendfile(filename)
+            assert_equal(''.join(req.iter_body()),
+                         'a' + 'x' * (WSGIRequest.BLOCK_SIZE + 1))
+        finally:
+            os.unlink(filename)
+
+    def test_read(self):
+        environ = make_environ(method='POST', body='abcdef')
+        # Anything after the body isn't read.
+        environ['wsgi.input'] = StringIO.StringIO('abcdefghi')
+        req = WSGIRequest(environ, CONFIG)
+        assert_equal(req.read(2), 'ab')
+        assert_equal(req.read(), 'cdef')
+        assert_equal(req.read(), '')
+
+    def test_short_read(self):
+        class ShortInput(StringIO.StringIO):
+            def read(self, size=-1):
+                return StringIO.StringIO.read(self, min(size, 2))
+        environ = make_environ(method='POST', body='abcdef')
+        environ['wsgi.input'] = ShortInput('abcdefghi')
+        req = WSGIRequest(environ, CONFIG)
+        assert_equal(req.read(4), 'ab')
+        # Still reads to the end of the body, and no further.
+        assert_equal(req.read(), 'cd')
+        assert_equal(req.read(), 'ef')
+        assert_equal(req.read(), '')
+
+    @raises(ServerReturn)
+    def test_redirect(self):
+        req = WSGIRequest(make_environ(), CONFIG)
+        try:
+            req.throw_redirect('/+login')
+        finally:
+            assert_equal(req.status_line(), '302 Found')
+            assert_equal(dict(req.get_headers())['Location'], '/+login')
+
+    def test_add_cookie(self):
+        req = WSGIRequest(make_environ(), CONFIG)
+        req.add_cookie('ivle_session', 'abc', path='/', secure=True)
+        req.add_cookie('nominate', '', expires=1, path='/')
+        assert_equal(req.headers_out.items(), [
+            ('Set-Cookie', 'ivle_session=abc; Path=/; secure'),
+            ('Set-Cookie', 'nominate=; expires=Thu, 01 Jan 1970 00:00:01 '
+                           'GMT; Path=/')])
@@ -0,0 +1,231 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+User Management Server Rebuild Queue
+
+usrmgt-server rebuilds the Subversion authorization files in the
+background with a RebuildQueue. Requests that arrive while a rebuild is
+waiting or running are merged, so that a burst of submissions costs a couple
+of rebuilds rather than one each. The web application queues rebuilds with
+queue_rebuild, and may wait for them with wait_for_rebuild.
+"""
+
+import logging
+import threading
+import time
+import traceback
+import uuid
+
+import ivle.chat
+
+__all__ = ['UsrmgtError', 'RebuildQueue', 'queue_rebuild',
+           'wait_for_rebuild']
+
+# The Subversion configuration files, in the order they are rebuilt.
+SVN_CONFIGS = ['svn_group_config', 'svn_config']
+
+class UsrmgtError(Exception):
+    """The user management server failed to carry out a request."""
+    pass
+
+class RebuildQueue(object):
+    """Rebuilds configuration files on a background thread, merging
+    requests.
+
+    rebuilders is a list of (name, function) pairs. Requests are numbered
+    per name. A rebuild takes in every request made before it starts, so
+    when it finishes they are all complete. A request made while a rebuild
+    is running may not be reflected in it, and so waits for the next one.
+
+    A request returns a token, which can be given to state() or wait() to
+    find out whether the rebuilds it asked for are 'done', 'pending' or
+    'failed'. Tokens from another queue (eg. before a restart) are
+    'unknown'.
+    """
+    def __init__(self, rebuilders):
+        self.order = [name for (name, func) in rebuilders]
+        self.rebuilders = dict(rebuilders)
+        self.id = uuid.uuid4().hex
+
+        self.cond = threading.Condition()
+        # The number of the latest request, the latest taken in by a
+        # rebuild, the latest rebuilt, and the latest whose rebuild failed.
+        self.requested = dict((name, 0) for name in self.order)
+        self.started = dict((name, 0) for name in self.order)
+        self.completed = dict((name, 0) for name in self.order)
+        self.failed = dict((name, 0) for name in self.order)
+        self.stopping = False
+        self.thread = None
+
+        self.requests = 0
+        self.rebuilds = 0
+        self.failures = 0
+
+    def start(self):
+        """Start the rebuild thread."""
+        self.thread = threading.Thread(target=self._work)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the rebuild thread once pending rebuilds are done."""
+        self.cond.acquire()
+        try:
+            self.stopping = True
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+        if self.thread is not None:
+            self.thread.join()
+
+    def request(self, names):
+        """Ask for the named files to be rebuilt, returning a token."""
+        self.cond.acquire()
+        try:
+            seqs = {}
+            for name in names:
+                if name not in self.rebuilders:
+                    raise UsrmgtError("Unknown configuration: %s" % name)
+                self.requested[name] += 1
+                seqs[name] = self.requested[name]
+            self.requests += 1
+            self.cond.notifyAll()
+            return {'queue': self.id, 'seqs': seqs}
+        finally:
+            self.cond.release()
+
+    def _state(self, token):
+        """Return the state of a token. The condition must be held."""
+        if token.get('queue') != self.id:
+            return 'unknown'
+        state = 'done'
+        for name, seq in token['seqs'].items():
+            if name not in self.completed:
+                return 'unknown'
+            if self.completed[name] >= seq:
+                continue
+            if self.failed[name] >= seq:
+                return 'failed'
+            state = 'pending'
+        return state
+
+    def state(self, token):
+        self.cond.acquire()
+        try:
+            return self._state(token)
+        finally:
+            self.cond.release()
+
+    def wait(self, token, timeout):
+        """Wait up to timeout seconds for the token's rebuilds to finish,
+        returning its state."""
+        deadline = time.time() + timeout
+        self.cond.acquire()
+        try:
+            state = self._state(token)
+            while state == 'pending':
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+                state = self._state(token)
+            return state
+        finally:
+            self.cond.release()
+
+    def stats(self):
+        """Return a dictionary of the queue's counters."""
+        self.cond.acquire()
+        try:
+            return {
+                'requests': self.requests,
+                'rebuilds': self.rebuilds,
+                'failures': self.failures,
+                'pending': [name for name in self.order
+                            if self.requested[name] > self.completed[name]
+                            and self.requested[name] > self.failed[name]],
+                }
+        finally:
+            self.cond.release()
+
+    def _next(self):
+        """Return the name of the next file to rebuild, or None. The
+        condition must be held."""
+        for name in self.order:
+            if self.requested[name] > self.started[name]:
+                return name
+        return None
+
+    def _work(self):
+        while True:
+            self.cond.acquire()
+            try:
+                name = self._next()
+                while name is None:
+                    if self.stopping:
+                        return
+                    self.cond.wait()
+                    name = self._next()
+                target = self.requested[name]
+                self.started[name] = target
+            finally:
+                self.cond.release()
+
+            try:
+                self.rebuilders[name]()
+                ok = True
+            except Exception:
+                logging.error('Rebuild of %s failed:\n%s' %
+                              (name, traceback.format_exc()))
+                ok = False
+
+            self.cond.acquire()
+            try:
+                self.rebuilds += 1
+                if ok:
+                    self.completed[name] = target
+                else:
+                    self.failures += 1
+                    self.failed[name] = target
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+
+
+def _chat(config, msg):
+    response = ivle.chat.chat(config['usrmgt']['host'],
+                              config['usrmgt']['port'],
+                              msg,
+                              config['usrmgt']['magic'],
+                              )
+    if response.get('response') != 'okay':
+        raise UsrmgtError("User management server failure: %s" %
+                          str(response))
+    return response
+
+def queue_rebuild(config, names=SVN_CONFIGS):
+    """Ask usrmgt-server to rebuild the named Subversion configuration
+    files, returning a token for wait_for_rebuild. Doesn't wait for the
+    rebuild."""
+    return _chat(config, {'queue_rebuild': {'configs': list(names)}})['token']
+
+def wait_for_rebuild(config, token, timeout):
+    """Wait up to timeout seconds for a queued rebuild, returning its state:
+    'done', 'pending', 'failed' or 'unknown'."""
+    return _chat(config, {'rebuild_status': {'token': token,
+                                             'timeout': timeout}})['state']
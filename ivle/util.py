@@ -21,6 +21,7 @@
 
 # Contains common utility functions.
 
+import hmac
 import os
 import sys
 import stat
@@ -183,6 +184,19 @@ def incomplete_utf8_sequence(byteseq):
         # Incomplete
         return count
 
+def constant_time_equal(a, b):
+    """Compare two strings (eg. digests) in time independent of where they
+    differ, so an attacker can't learn how much of a forgery is right."""
+    if hasattr(hmac, 'compare_digest'):
+        # Python 2.7.7 and later.
+        return hmac.compare_digest(a, b)
+    if len(a) != len(b):
+        return False
+    result = 0
+    for (x, y) in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
 def safe_rmtree(path, ignore_errors=False, onerror=None):
     """Recursively delete a directory tree.
 
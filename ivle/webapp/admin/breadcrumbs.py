@@ -37,7 +37,7 @@ class UserBreadcrumb(object):
 
     @property
     def text(self):
-        perms = self.context.get_permissions(self.req.user, self.req.config)
+        perms = self.req.get_permissions(self.context)
         # Show nickname iff current user has permission to view this user
         # (Else, show just the login name)
         if 'view' in perms:
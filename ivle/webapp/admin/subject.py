@@ -293,7 +293,7 @@ class SubjectView(XHTMLView):
         ctx['req'] = req
         ctx['user'] = req.user
         ctx['offerings'] = list(self.context.offerings)
-        ctx['permissions'] = self.context.get_permissions(req.user,req.config)
+        ctx['permissions'] = req.get_permissions(self.context)
         ctx['SubjectEdit'] = SubjectEdit
         ctx['SubjectOfferingNew'] = SubjectOfferingNew
 
@@ -309,7 +309,7 @@ class OfferingView(XHTMLView):
         self.plugin_styles[TutorialPlugin] = ['tutorial.css']
         ctx['context'] = self.context
         ctx['req'] = req
-        ctx['permissions'] = self.context.get_permissions(req.user,req.config)
+        ctx['permissions'] = req.get_permissions(self.context)
         ctx['format_submission_principal'] = util.format_submission_principal
         ctx['format_datetime'] = ivle.date.make_date_nice
         ctx['format_datetime_short'] = ivle.date.format_datetime_for_paragraph
@@ -605,8 +605,7 @@ class EnrolmentsView(XHTMLView):
         ctx['req'] = req
         ctx['offering'] = self.context
         ctx['mediapath'] = media_url(req, CorePlugin, 'images/')
-        ctx['offering_perms'] = self.context.get_permissions(
-            req.user, req.config)
+        ctx['offering_perms'] = req.get_permissions(self.context)
         ctx['EnrolView'] = EnrolView
         ctx['EnrolmentEdit'] = EnrolmentEdit
         ctx['EnrolmentDelete'] = EnrolmentDelete
@@ -639,7 +638,7 @@ class EnrolView(XHTMLView):
 
         ctx['data'] = data or {}
         ctx['offering'] = self.context
-        ctx['roles_auth'] = self.context.get_permissions(req.user, req.config)
+        ctx['roles_auth'] = req.get_permissions(self.context)
         ctx['errors'] = errors
         # If all of the fields validated, set the global form error.
         if isinstance(errors, basestring):
@@ -678,8 +677,7 @@ class EnrolmentEdit(BaseFormView):
 
     def populate(self, req, ctx):
         super(EnrolmentEdit, self).populate(req, ctx)
-        ctx['offering_perms'] = self.context.offering.get_permissions(
-            req.user, req.config)
+        ctx['offering_perms'] = req.get_permissions(self.context.offering)
 
 
 class EnrolmentDelete(XHTMLView):
@@ -755,7 +753,7 @@ class ProjectView(XHTMLView):
         self.plugin_styles[Plugin] = ["project.css"]
 
         ctx['req'] = req
-        ctx['permissions'] = self.context.get_permissions(req.user,req.config)
+        ctx['permissions'] = req.get_permissions(self.context)
         ctx['GroupsView'] = GroupsView
         ctx['EnrolView'] = EnrolView
         ctx['format_datetime'] = ivle.date.make_date_nice
@@ -774,7 +772,7 @@ class ProjectBashExportView(TextView):
 
     def populate(self, req, ctx):
         ctx['req'] = req
-        ctx['permissions'] = self.context.get_permissions(req.user,req.config)
+        ctx['permissions'] = req.get_permissions(self.context)
         ctx['format_datetime'] = ivle.date.make_date_nice
         ctx['format_datetime_short'] = ivle.date.format_datetime_for_paragraph
         ctx['project'] = self.context
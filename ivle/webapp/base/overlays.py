@@ -21,6 +21,7 @@ import os
 import inspect
 
 import genshi
+import genshi.template
 
 from ivle.webapp.base.xhtml import GenshiLoaderMixin
 
@@ -30,12 +31,29 @@ class BaseOverlay(object):
     plugin_scripts = {}
     plugin_styles = {}
     plugin_scripts_init = []
+    # If True, the overlay isn't rendered with the page, but loaded with a
+    # separate request once the page has been shown. Its scripts_init are
+    # run then.
+    deferred = False
+
     def __init__(self, req):
         self.req = req
 
+    def prepare(self, req):
+        """Do any work needed for each page the overlay is shown on.
+
+        This is called even if the overlay is deferred, so should be cheap.
+        """
+        pass
+
     def render(self, req):
         raise NotImplementedError()
 
+    def render_markup(self, req):
+        """Render the overlay as an XHTML string, for loading it when it is
+        deferred."""
+        raise NotImplementedError()
+
 
 class XHTMLOverlay(GenshiLoaderMixin, BaseOverlay):
     """Abstract base class for XHTML overlays.
@@ -46,9 +64,31 @@ class XHTMLOverlay(GenshiLoaderMixin, BaseOverlay):
     """
 
     template = 'template.html'
+    # If True, the overlay's markup doesn't depend on the request or user,
+    # so each process only renders it once.
+    static = False
+
+    # Maps static overlay classes to their rendered markup.
+    _markup = {}
 
     def render(self, req):
         """Renders an XML stream from the template for this overlay."""
+        if self.static:
+            return genshi.Markup(self.render_markup(req))
+        return self.generate(req)
+
+    def render_markup(self, req):
+        if not self.static:
+            return self.generate(req).render('xhtml')
+        try:
+            return self._markup[type(self)]
+        except KeyError:
+            markup = self.generate(req).render('xhtml')
+            self._markup[type(self)] = markup
+            return markup
+
+    def generate(self, req):
+        """Generate an XML stream from the template for this overlay."""
         ctx = genshi.template.Context()
         # This is where the sub-class is actually called
         self.populate(req, ctx)
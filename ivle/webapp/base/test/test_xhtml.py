@@ -0,0 +1,120 @@
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+import genshi.template
+
+import ivle.webapp.admin
+from ivle.webapp.admin.subject import Plugin as SubjectPlugin
+from ivle.webapp.base import xhtml
+from ivle.webapp.base.overlays import XHTMLOverlay
+from ivle.webapp.base.plugins import OverlayPlugin
+from ivle.webapp.base.xhtml import (GenshiLoaderMixin, load_templates,
+                                    overlay_url, record_render_time,
+                                    render_stats, template_files)
+
+class FakeConfig(object):
+    plugins = {'ivle.webapp.admin.subject': SubjectPlugin}
+
+class SomeView(object):
+    pass
+
+class TestLoadTemplates:
+    def setUp(self):
+        self.loader = GenshiLoaderMixin._loader
+
+    def tearDown(self):
+        GenshiLoaderMixin._loader = self.loader
+
+    def test_template_files(self):
+        admin = os.path.dirname(ivle.webapp.admin.__file__)
+        base = os.path.dirname(xhtml.__file__)
+        files = dict(template_files(FakeConfig()))
+        assert_equal(files[os.path.join(admin, 'templates', 'subject.html')],
+                     genshi.template.MarkupTemplate)
+        assert_equal(files[os.path.join(base, 'ivle-headings.html')],
+                     genshi.template.MarkupTemplate)
+
+    def test_load_templates(self):
+        load_templates(FakeConfig())
+        loader = GenshiLoaderMixin._loader
+        assert not loader.auto_reload
+        for (filename, cls) in template_files(FakeConfig()):
+            assert isinstance(loader.load(filename), cls)
+
+        # Loading again gives the same compiled template.
+        filename = template_files(FakeConfig())[0][0]
+        assert loader.load(filename) is loader.load(filename)
+
+class TestRenderStats:
+    def test_render_stats(self):
+        view = SomeView()
+        record_render_time(view, 0.5)
+        record_render_time(view, 0.25)
+        stats = render_stats()['SomeView']
+        assert_equal(stats['renders'], 2)
+        assert_equal(stats['mean'], 0.375)
+        assert_equal(stats['max'], 0.5)
+
+class CountingOverlay(XHTMLOverlay):
+    renders = 0
+
+    def populate(self, req, ctx):
+        type(self).renders += 1
+        ctx['renders'] = self.renders
+
+class StaticOverlay(CountingOverlay):
+    deferred = True
+    static = True
+
+class OverlayTestPlugin(OverlayPlugin):
+    overlays = [CountingOverlay, StaticOverlay]
+
+class OverlayConfig(dict):
+    plugin_index = {OverlayPlugin: [OverlayTestPlugin]}
+    reverse_plugins = {OverlayTestPlugin: 'test.overlays'}
+
+class OverlayRequest(object):
+    def __init__(self, version=None):
+        self.config = OverlayConfig(media={'version': version})
+
+    def make_path(self, path):
+        return '/' + path
+
+class TestOverlays:
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        template = os.path.join(self.dir, 'overlay.html')
+        open(template, 'w').write(
+            '<div xmlns:py="http://genshi.edgewall.org/">${renders}</div>')
+        CountingOverlay.template = template
+        CountingOverlay.renders = StaticOverlay.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        del CountingOverlay.template
+        XHTMLOverlay._markup.clear()
+
+    def test_static(self):
+        req = OverlayRequest()
+        for i in range(2):
+            assert_equal(StaticOverlay(req).render_markup(req),
+                         '<div>1</div>')
+            assert_equal(str(StaticOverlay(req).render(req)),
+                         '<div>1</div>')
+        assert_equal(StaticOverlay.renders, 1)
+
+    def test_not_static(self):
+        req = OverlayRequest()
+        assert_equal(CountingOverlay(req).render_markup(req), '<div>1</div>')
+        assert_equal(CountingOverlay(req).render(req).render('xhtml'),
+                     '<div>2</div>')
+
+    def test_overlay_url(self):
+        assert_equal(overlay_url(OverlayRequest(), StaticOverlay),
+                     '/+overlays/test.overlays/StaticOverlay')
+        assert_equal(overlay_url(OverlayRequest('1.0'), StaticOverlay),
+                     '/+overlays/+1.0/test.overlays/StaticOverlay')
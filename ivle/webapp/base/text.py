@@ -19,11 +19,12 @@
 
 import inspect
 import os.path
+import time
 
 import genshi.template
 
 from ivle.webapp.base.views import BaseView
-from ivle.webapp.base.xhtml import GenshiLoaderMixin
+from ivle.webapp.base.xhtml import GenshiLoaderMixin, record_render_time
 
 
 class TextView(GenshiLoaderMixin, BaseView):
@@ -48,6 +49,7 @@ class TextView(GenshiLoaderMixin, BaseView):
         viewctx = genshi.template.Context()
         self.populate(req, viewctx)
 
+        start = time.time()
         # The template is found in the directory of the module containing the
         # view.
         app_template = os.path.join(os.path.dirname(
@@ -57,7 +59,9 @@ class TextView(GenshiLoaderMixin, BaseView):
         app = self.filter(tmpl.generate(viewctx), viewctx)
 
         self.populate_headings(req, viewctx)
-        req.write(tmpl.generate(viewctx).render())
+        page = tmpl.generate(viewctx).render()
+        record_render_time(self, time.time() - start)
+        req.write(page)
 
     def populate(self, req, ctx):
         raise NotImplementedError()
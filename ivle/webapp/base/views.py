@@ -35,6 +35,8 @@ class BaseView(object):
         raise NotImplementedError()
 
     def get_permissions(self, user, config):
+        if user is self.req.user:
+            return self.req.get_permissions(self.context)
         return self.context.get_permissions(user, config)
 
     def authorize(self, req):
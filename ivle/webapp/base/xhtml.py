@@ -18,9 +18,13 @@
 # Author: Nick Chadwick
 
 import inspect
+import os
 import os.path
+import threading
+import time
 import urllib
 
+import genshi.input
 import genshi.template
 
 from ivle.webapp.media import media_url
@@ -45,12 +49,87 @@ class GenshiLoaderMixin(object):
 
         # We use a single loader for all views, so we can cache the
         # parsed templates. auto_reload is convenient and has a minimal
-        # performance penalty, so we'll leave it on.
+        # performance penalty, so we'll leave it on unless load_templates
+        # has set up a loader for production.
         if GenshiLoaderMixin._loader is None:
             GenshiLoaderMixin._loader = genshi.template.TemplateLoader(
                 ".", auto_reload=True,
                 max_cache_size=100)
 
+def template_files(config):
+    """Find the templates of all plugins.
+
+    Templates are looked for beside each plugin's module and in its
+    templates directory. Returns a list of (filename, template class) pairs.
+    """
+    dirs = set([os.path.dirname(__file__)])
+    for plugin in config.plugins.values():
+        dirs.add(os.path.dirname(inspect.getmodule(plugin).__file__))
+
+    templates = []
+    for dir in dirs:
+        for subdir in (dir, os.path.join(dir, 'templates')):
+            if not os.path.isdir(subdir):
+                continue
+            for name in sorted(os.listdir(subdir)):
+                if name.endswith('.html'):
+                    cls = genshi.template.MarkupTemplate
+                elif name.endswith('.txt'):
+                    cls = genshi.template.text.NewTextTemplate
+                else:
+                    continue
+                templates.append((os.path.join(subdir, name), cls))
+    return templates
+
+def load_templates(config):
+    """Set up the shared TemplateLoader for production.
+
+    Every plugin's templates are parsed now, rather than on first use. They
+    are never checked for changes, and the cache is big enough that none are
+    evicted.
+    """
+    templates = template_files(config)
+    # Leave room for templates found elsewhere.
+    loader = genshi.template.TemplateLoader(".", auto_reload=False,
+                                            max_cache_size=len(templates) * 2)
+    for (filename, cls) in templates:
+        try:
+            loader.load(filename, cls=cls)
+        except (genshi.template.TemplateError, genshi.input.ParseError):
+            # Not a template. If it is used as one, it will fail then.
+            pass
+    GenshiLoaderMixin._loader = loader
+
+# Maps a view class name to [renders, total seconds, maximum seconds].
+_render_times = {}
+_render_times_lock = threading.Lock()
+
+def record_render_time(view, seconds):
+    """Count the time a view took to render its templates."""
+    name = type(view).__name__
+    _render_times_lock.acquire()
+    try:
+        times = _render_times.setdefault(name, [0, 0.0, 0.0])
+        times[0] += 1
+        times[1] += seconds
+        times[2] = max(times[2], seconds)
+    finally:
+        _render_times_lock.release()
+
+def render_stats():
+    """Return a dictionary mapping the name of each view class rendered by
+    this process to a dictionary of its render count, and mean and maximum
+    render time in seconds."""
+    _render_times_lock.acquire()
+    try:
+        return dict((name, {'renders': renders,
+                            'mean': total / renders,
+                            'max': longest})
+                    for (name, (renders, total, longest))
+                    in _render_times.items())
+    finally:
+        _render_times_lock.release()
+
 
 class XHTMLView(GenshiLoaderMixin, BaseView):
     """
@@ -88,6 +167,7 @@ class XHTMLView(GenshiLoaderMixin, BaseView):
         viewctx = genshi.template.Context()
         self.populate(req, viewctx)
 
+        start = time.time()
         # The template is found in the directory of the module containing the
         # view.
         app_template = os.path.join(os.path.dirname(
@@ -95,36 +175,18 @@ class XHTMLView(GenshiLoaderMixin, BaseView):
         tmpl = self._loader.load(app_template)
         app = self.filter(tmpl.generate(viewctx), viewctx)
 
-        view_scripts = []
-        for plugin in self.plugin_scripts:
-            for path in self.plugin_scripts[plugin]:
-                view_scripts.append(media_url(req, plugin, path))
-
-        view_styles = []
-        for plugin in self.plugin_styles:
-            for path in self.plugin_styles[plugin]:
-                view_styles.append(media_url(req, plugin, path))
+        chrome = self.get_chrome(req)
 
         # Global template
         ctx = genshi.template.Context()
 
-        overlay_bits = self.render_overlays(req) if req.user else [[]]*4
-        ctx['overlays'] = overlay_bits[0]
-
-        ctx['styles'] = [media_url(req, CorePlugin, 'ivle.css')]
-        ctx['styles'] += view_styles
-        ctx['styles'] += overlay_bits[1]
-
-        ctx['scripts'] = [media_url(req, CorePlugin, path) for path in
-                           ('util.js', 'json2.js', 'md5.js')]
-        ctx['scripts'].append(media_url(req, '+external/jquery', 'jquery.js'))
-        ctx['scripts'] += view_scripts
-        ctx['scripts'] += overlay_bits[2]
-
-        ctx['scripts_init'] = self.scripts_init + overlay_bits[3]
+        ctx['overlays'] = self.render_overlays(req) if req.user else []
+        ctx['deferred_overlays'] = chrome['deferred_overlays']
+        ctx['styles'] = chrome['styles']
+        ctx['scripts'] = chrome['scripts']
+        ctx['scripts_init'] = self.scripts_init + chrome['scripts_init']
         ctx['app_template'] = app
-        ctx['title_img'] = media_url(req, CorePlugin,
-                                     "images/chrome/root-breadcrumb.png")
+        ctx['title_img'] = chrome['title_img']
         try:
             ancestry = self.get_context_ancestry(req)
         except NoPath:
@@ -155,13 +217,72 @@ class XHTMLView(GenshiLoaderMixin, BaseView):
         self.populate_headings(req, ctx)
         tmpl = self._loader.load(os.path.join(os.path.dirname(__file__), 
                                                         'ivle-headings.html'))
-        req.write(tmpl.generate(ctx).render('xhtml', doctype='xhtml'))
-        
+        page = tmpl.generate(ctx).render('xhtml', doctype='xhtml')
+        record_render_time(self, time.time() - start)
+        req.write(page)
+
+    # Maps the things the page chrome depends on to the chrome, as returned
+    # by get_chrome. Shared between all views in the process.
+    _chrome = {}
+
+    def get_chrome(self, req):
+        """Return the parts of the page around the view that only depend on
+        the view's class and media, and whether anyone is logged in.
+
+        This is a dictionary of styles, scripts, scripts_init (of the
+        overlays), deferred_overlays (as from get_overlay_media) and
+        title_img. It is only worked out once for each view
+        class, and must not be modified.
+        """
+        def assets(media):
+            return tuple((plugin, tuple(paths))
+                         for (plugin, paths) in media.items())
+        key = (type(self), tuple(self.overlay_blacklist),
+               assets(self.plugin_scripts), assets(self.plugin_styles),
+               req.user is not None)
+        try:
+            return self._chrome[key]
+        except KeyError:
+            pass
+
+        view_scripts = []
+        for plugin in self.plugin_scripts:
+            for path in self.plugin_scripts[plugin]:
+                view_scripts.append(media_url(req, plugin, path))
+
+        view_styles = []
+        for plugin in self.plugin_styles:
+            for path in self.plugin_styles[plugin]:
+                view_styles.append(media_url(req, plugin, path))
+
+        (overlay_styles, overlay_scripts, overlay_scripts_init,
+         deferred_overlays) = \
+            self.get_overlay_media(req) if req.user else ([], [], [], [])
+
+        chrome = {}
+        chrome['styles'] = [media_url(req, CorePlugin, 'ivle.css')]
+        chrome['styles'] += view_styles
+        chrome['styles'] += overlay_styles
+
+        chrome['scripts'] = [media_url(req, CorePlugin, path) for path in
+                           ('util.js', 'json2.js', 'md5.js')]
+        chrome['scripts'].append(media_url(req, '+external/jquery',
+                                           'jquery.js'))
+        chrome['scripts'] += view_scripts
+        chrome['scripts'] += overlay_scripts
+
+        chrome['scripts_init'] = overlay_scripts_init
+        chrome['deferred_overlays'] = deferred_overlays
+        chrome['title_img'] = media_url(req, CorePlugin,
+                                        "images/chrome/root-breadcrumb.png")
+        # Any thread may have got here first; they'll have the same result.
+        self._chrome[key] = chrome
+        return chrome
+
     def populate(self, req, ctx):
         raise NotImplementedError()
 
     def populate_headings(self, req, ctx):
-        ctx['favicon'] = None
         ctx['root_dir'] = req.config['urls']['root']
         ctx['public_host'] = req.config['urls']['public_host']
         ctx['svn_base'] = req.config['urls']['svn_addr']
@@ -177,7 +298,26 @@ class XHTMLView(GenshiLoaderMixin, BaseView):
         if hasattr(self, 'help'):
             ctx['help_path'] = self.help
 
-        ctx['apps_in_tabs'] = []
+        (ctx['apps_in_tabs'], ctx['favicon']) = self.get_tabs(req)
+
+    # Maps (view class, whether the user is an admin) to the result of
+    # get_tabs.
+    _tabs = {}
+
+    def get_tabs(self, req):
+        """Return the tabs to show, and the favicon of this view's tab.
+
+        This is only worked out once for each view class, and must not be
+        modified.
+        """
+        key = (type(self), bool(req.user and req.user.admin))
+        try:
+            return self._tabs[key]
+        except KeyError:
+            pass
+
+        favicon = None
+        apps_in_tabs = []
         for plugin in req.config.plugin_index[ViewPlugin]:
             if not hasattr(plugin, 'tabs'):
                 continue
@@ -195,54 +335,80 @@ class XHTMLView(GenshiLoaderMixin, BaseView):
                     icon_url = media_url(req, plugin, tab[3])
                     new_app['icon_url'] = icon_url
                     if new_app['this_app']:
-                        ctx['favicon'] = icon_url
+                        favicon = icon_url
                 else:
                     new_app['has_icon'] = False
                 # The following check is here, so it is AFTER setting the
                 # icon, but BEFORE actually installing the tab in the menu
                 if len(tab) > 6 and tab[6]:
                     # Admin-only tab
-                    if not (req.user and req.user.admin):
+                    if not key[1]:
                         break
                 new_app['path'] = req.make_path(tab[4])
                 new_app['desc'] = tab[2]
                 new_app['name'] = tab[1]
                 new_app['weight'] = tab[5]
-                ctx['apps_in_tabs'].append(new_app)
+                apps_in_tabs.append(new_app)
 
-        ctx['apps_in_tabs'].sort(key=lambda tab: tab['weight'])
+        apps_in_tabs.sort(key=lambda tab: tab['weight'])
+        self._tabs[key] = (apps_in_tabs, favicon)
+        return self._tabs[key]
 
     def render_overlays(self, req):
         """Generate XML streams for the overlays.
         
-        Returns a list of streams. Populates the scripts, styles, and 
-        scripts_init.
+        Returns a list of streams. Deferred overlays are only prepared.
         """
+        if not self.allow_overlays:
+            return []
         overlays = []
+        for overclass in self.get_overlay_classes(req):
+            overlay = overclass(req)
+            overlay.prepare(req)
+            if not overclass.deferred:
+                overlays.append(overlay.render(req))
+        return overlays
+
+    def get_overlay_classes(self, req):
+        overclasses = []
+        for plugin in req.config.plugin_index[OverlayPlugin]:
+            for overclass in plugin.overlays:
+                if overclass not in self.overlay_blacklist:
+                    overclasses.append(overclass)
+        return overclasses
+
+    def get_overlay_media(self, req):
+        """Return the styles, scripts and scripts_init of the overlays, and
+        the deferred overlays.
+
+        These are taken from the overlay classes, so must not vary between
+        instances. The scripts_init of deferred overlays are left out, to be
+        run once they have loaded. Each deferred overlay is a dictionary of
+        the URL to load it from, and its scripts_init.
+        """
         styles = []
         scripts = []
         scripts_init = []
+        deferred = []
         if not self.allow_overlays:
-            return (overlays, styles, scripts, scripts_init)
+            return (styles, scripts, scripts_init, deferred)
 
-        for plugin in req.config.plugin_index[OverlayPlugin]:
-            for overclass in plugin.overlays:
-                if overclass in self.overlay_blacklist:
-                    continue
-                overlay = overclass(req)
-                #TODO: Re-factor this to look nicer
-                for mplugin in overlay.plugin_scripts:
-                    for path in overlay.plugin_scripts[mplugin]:
-                        scripts.append(media_url(req, mplugin, path))
-
-                for mplugin in overlay.plugin_styles:
-                    for path in overlay.plugin_styles[mplugin]:
-                        styles.append(media_url(req, mplugin, path))
+        for overclass in self.get_overlay_classes(req):
+            #TODO: Re-factor this to look nicer
+            for mplugin in overclass.plugin_scripts:
+                for path in overclass.plugin_scripts[mplugin]:
+                    scripts.append(media_url(req, mplugin, path))
 
-                scripts_init += overlay.plugin_scripts_init
+            for mplugin in overclass.plugin_styles:
+                for path in overclass.plugin_styles[mplugin]:
+                    styles.append(media_url(req, mplugin, path))
 
-                overlays.append(overlay.render(req))
-        return (overlays, styles, scripts, scripts_init)
+            if overclass.deferred:
+                deferred.append({'url': overlay_url(req, overclass),
+                                 'scripts_init': overclass.plugin_scripts_init})
+            else:
+                scripts_init += overclass.plugin_scripts_init
+        return (styles, scripts, scripts_init, deferred)
 
     @classmethod
     def get_error_view(cls, e):
@@ -252,6 +418,21 @@ class XHTMLView(GenshiLoaderMixin, BaseView):
             if exccls in view_map:
                 return view_map[exccls]
 
+def overlay_url(req, overclass):
+    """Generate the URL to load a deferred overlay from.
+
+    If a version is specified in the IVLE configuration, a versioned URL will
+    be generated, like for media.
+    """
+    for plugin in req.config.plugin_index[OverlayPlugin]:
+        if overclass in plugin.overlays:
+            break
+    path = ['+overlays', req.config.reverse_plugins[plugin],
+            overclass.__name__]
+    if req.config['media']['version']:
+        path.insert(1, '+' + req.config['media']['version'])
+    return req.make_path(os.path.join(*path))
+
 class XHTMLErrorView(XHTMLView):
     template = 'xhtmlerror.html'
 
@@ -33,8 +33,7 @@ console_filler = null;
 
 windowpane_mode = false;
 server_started = false;
-
-interrupted = false;
+prewarm_requested = false;
 
 
 function get_console_start_directory()
@@ -77,6 +76,14 @@ function get_console_start_directory()
  */
 function start_server(callback)
 {
+    if (document.getElementById("console_body") == null &&
+        overlays_loading > 0)
+    {
+        /* The console overlay is loaded after the page. If the user is
+         * quicker (eg. they click "Run"), wait for it. */
+        when_overlays_loaded(function() { start_server(callback); });
+        return;
+    }
     if (server_started)
     {
         callback();
@@ -117,6 +124,20 @@ function start_server(callback)
         "POST");
 }
 
+/** Ask for a console to be started in the background, as the user looks
+ * likely to need one soon (eg. they have started typing in the console or a
+ * worksheet exercise). Only asks once per page, and not if a console has
+ * already been started.
+ */
+function console_prewarm()
+{
+    if (server_started || prewarm_requested)
+        return;
+    prewarm_requested = true;
+    ajax_call(function(xhr) {}, "console", "service",
+              {"ivle.op": "prewarm"}, "POST");
+}
+
 /** Start up the console backend before the user has entered text.
  * This will disable the text input, start a backend, and enable the input
  * again.
@@ -275,7 +296,16 @@ var hist = new History();
 
 function set_interrupt()
 {
-    interrupted = true;
+    /* Sent straight away rather than in place of the next poll, which may
+     * not come for some seconds if the code is quiet. The poll under way
+     * collects the outcome. */
+    if (!server_started)
+        return;
+    var args = {
+        "ivle.op": "chat", "kind": "interrupt", "key": server_key,
+        "text": '', "cwd": get_console_start_directory()
+        };
+    ajax_call(function(xhr) {}, "console", "service", args, "POST");
 }
 
 function clear_output()
@@ -293,8 +323,6 @@ function clear_output()
  */
 function console_enter_line(inputbox, which)
 {
-    interrupted = false;
-
     // Open up the console so we can see the output
     console_maximize();
 
@@ -401,16 +429,9 @@ function console_response(inputbox, inputline, responseText)
             {
                 console_response(inputbox, null, xhr.responseText);
             }
-        if (interrupted)
-        {
-            var kind = "interrupt";
-        }
-        else
-        {
-            var kind = "chat";
-        }
+        // More output (or the command's result) is on its way; ask for it.
         var args = {
-            "ivle.op": "chat", "kind": kind, "key": server_key,
+            "ivle.op": "chat", "kind": "poll", "key": server_key,
             "text": '', "cwd": get_console_start_directory()
             };
         ajax_call(callback, "console", "service", args, "POST");
@@ -435,7 +456,6 @@ function console_response(inputbox, inputline, responseText)
     {
         /* Re-enable the text box */
         inputbox.removeAttribute("disabled");
-        interrupted = false;
     }
 
     /* Auto-scrolling */
@@ -27,6 +27,10 @@ class ConsoleOverlay(XHTMLOverlay):
     plugin_scripts = {'ivle.webapp.console': ['console.js']}
     plugin_styles  = {'ivle.webapp.console': ['console.css']}
     plugin_scripts_init = ['console_init']
+
+    # The console is loaded after the page, and is the same for everyone.
+    deferred = True
+    static = True
     
     def populate(self, req, ctx):
         ctx['windowpane'] = True
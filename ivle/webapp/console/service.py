@@ -35,7 +35,8 @@ import errno
 
 import ivle.console
 import ivle.chat
-from ivle.webapp.base.rest import JSONRESTView, write_operation
+from ivle.webapp.base.rest import (JSONRESTView, read_operation,
+    write_operation)
 from ivle.webapp.errors import BadRequest
 
 # XXX: Should be RPC view, with actions in URL?
@@ -43,6 +44,8 @@ class ConsoleServiceRESTView(JSONRESTView):
     '''An RPC interface to a Python console.'''
     def get_permissions(self, user, config):
         if user is not None:
+            if user.admin:
+                return set(['use', 'admin'])
             return set(['use'])
         else:
             return set()
@@ -51,17 +54,33 @@ class ConsoleServiceRESTView(JSONRESTView):
     def start(self, req, cwd=''):
         working_dir = os.path.join("/home", req.user.login, cwd)
 
-        # Start the server
-        jail_path = os.path.join(req.config['paths']['jails']['mounts'],
-                                 req.user.login)
-        cons = ivle.console.Console(req.config, req.user, jail_path,
-                working_dir)
+        # Reuse (after resetting) one of the user's idle consoles, or take a
+        # new one.
+        cons = ivle.console.find_console(req.store, req.user, working_dir)
+        if cons is None:
+            jail_path = os.path.join(req.config['paths']['jails']['mounts'],
+                                     req.user.login)
+            cons = new_console(req.store, req.config, req.user, jail_path,
+                               working_dir)
 
         # Assemble the key and return it. Yes, it is double-encoded.
         return {'key': json.dumps({"host": cons.host,
                                    "port": cons.port,
                                    "magic": cons.magic}).encode('hex')}
 
+    @write_operation('use')
+    def prewarm(self, req):
+        """Start a console for the user in the background, as they are
+        about to need one (eg. they have started typing in the console).
+
+        This is asked for by the client, rather than done for every page
+        offering a console, so only users who use consoles get spares.
+        """
+        jail_path = os.path.join(req.config['paths']['jails']['mounts'],
+                                 req.user.login)
+        ivle.console.get_pool(req.config).prewarm(req.user, jail_path)
+        return {}
+
     @write_operation('use')
     def chat(self, req, key, text='', cwd='', kind="chat"):
         # The request *should* have the following four fields:
@@ -98,32 +117,53 @@ class ConsoleServiceRESTView(JSONRESTView):
                 response = {"terminate":
                     "Communication lost"}
             if "terminate" in response:
-                response = restart_console(req.config, req.user, jail_path,
-                    working_dir, response["terminate"])
+                ivle.chat.discard_connections(host, port, magic)
+                response = restart_console(req.store, req.config, req.user,
+                    jail_path, working_dir, response["terminate"])
         except socket.error, (enumber, estring):
             if enumber == errno.ECONNREFUSED:
                 # Timeout: Restart the session
-                response = restart_console(req.config, req.user, jail_path,
-                    working_dir,
+                response = restart_console(req.store, req.config, req.user,
+                    jail_path, working_dir,
                     "Timed out due to inactivity")
             elif enumber == errno.ECONNRESET:
                 # Communication issue: Restart the session
-                response = restart_console(req.config, req.user, jail_path,
-                    working_dir,
+                response = restart_console(req.store, req.config, req.user,
+                    jail_path, working_dir,
                     "Connection reset")
             else:
                 # Some other error - probably serious
                 raise socket.error, (enumber, estring)
         return response
 
+    @read_operation('admin')
+    def pool_stats(self, req):
+        """Return the console pool counters of this server process."""
+        return ivle.console.get_pool(req.config).stats()
+
+    @read_operation('admin')
+    def sessions(self, req):
+        """Return the number and memory use of registered consoles."""
+        return ivle.console.console_stats(req.store)
+
+
+def new_console(store, config, user, jail_path, working_dir):
+    """Starts a console for the user (or takes a pre-started one from the
+    pool) and registers it, first reaping idle consoles if this host is
+    short of memory.
+    """
+    ivle.console.reap_consoles(store, config)
+    cons = ivle.console.get_pool(config).get(user, jail_path, working_dir)
+    ivle.console.register_console(store, config, user, cons)
+    return cons
 
-def restart_console(config, user, jail_path, working_dir, reason):
+def restart_console(store, config, user, jail_path, working_dir, reason):
     """Tells the client that it must be issued a new console since the old 
     console is no longer availible. The client must accept the new key.
     Returns the JSON response to be given to the client.
     """
     # Start a new console server console
-    cons = ivle.console.Console(config, user, jail_path, working_dir)
+    cons = new_console(store, config, user, jail_path, working_dir)
 
     # Make a JSON object to tell the browser to restart its console client
     new_key = json.dumps(
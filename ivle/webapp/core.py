@@ -17,8 +17,57 @@
 
 # Author: Will Grant
 
-from ivle.webapp.base.plugins import MediaPlugin
+import email.utils
+import time
+
+from ivle.webapp import ApplicationRoot
+from ivle.webapp.base.plugins import MediaPlugin, OverlayPlugin, ViewPlugin
+from ivle.webapp.base.views import BaseView
+from ivle.webapp.errors import NotFound
+
+class OverlayView(BaseView):
+    '''A view of a deferred overlay on its own, to be loaded into a page.
+
+    The subpath is the media version (if configured, prefixed with a '+'),
+    the name of the overlay's plugin and the name of the overlay class.
+    Static overlays are cached by the browser if the version is given.
+    '''
+    subpath_allowed = True
+
+    def authorize(self, req):
+        return req.user is not None
+
+    def render(self, req):
+        path = list(self.subpath)
+        version = None
+        if path and path[0].startswith('+'):
+            version = path.pop(0)[1:]
+            if version != req.config['media']['version']:
+                raise NotFound()
+        if len(path) != 2:
+            raise NotFound()
+        (plugin_name, class_name) = path
+
+        plugin = req.config.plugins.get(plugin_name)
+        if plugin is None or not issubclass(plugin, OverlayPlugin):
+            raise NotFound()
+        for overclass in plugin.overlays:
+            if overclass.__name__ == class_name and overclass.deferred:
+                break
+        else:
+            raise NotFound()
+
+        if version is not None and getattr(overclass, 'static', False):
+            req.headers_out['Cache-Control'] = 'private'
+            req.headers_out['Expires'] = email.utils.formatdate(
+                                timeval=time.time() + (60*60*24*365),
+                                localtime=False,
+                                usegmt=True)
+        req.content_type = 'text/html'
+        req.write(overclass(req).render_markup(req))
+
+class Plugin(ViewPlugin, MediaPlugin):
+    '''Plugin class for IVLE common media and views of the framework.'''
+    views = [(ApplicationRoot, '+overlays', OverlayView)]
 
-class Plugin(MediaPlugin):
-    '''Plugin class for IVLE common media.'''
     media = 'coremedia'
@@ -718,3 +718,51 @@ function decode_response(response)
     
      return null;
 }
+
+/* The number of deferred overlays still loading, and the functions waiting
+ * for them to finish (see when_overlays_loaded). */
+overlays_loading = 0;
+overlays_waiting = [];
+
+/** Loads a deferred overlay into the page, then runs its initialisation
+ * functions.
+ *
+ * \param url URL of the overlay's markup.
+ * \param scripts_init Array of functions to run once it is loaded. Like
+ *      with $(document).ready, each is passed the jQuery object.
+ */
+function load_overlay(url, scripts_init)
+{
+    overlays_loading++;
+    $.ajax({
+        url: url,
+        dataType: "html",
+        success: function(markup)
+        {
+            $("#ivleoverlays").append(markup);
+            for (var i = 0; i < scripts_init.length; i++)
+                scripts_init[i](jQuery);
+        },
+        complete: function()
+        {
+            overlays_loading--;
+            if (overlays_loading > 0)
+                return;
+            var waiting = overlays_waiting;
+            overlays_waiting = [];
+            for (var i = 0; i < waiting.length; i++)
+                waiting[i]();
+        }
+    });
+}
+
+/** Calls a function once the deferred overlays have loaded (or failed to),
+ * or straight away if there are none loading.
+ */
+function when_overlays_loaded(callback)
+{
+    if (overlays_loading > 0)
+        overlays_waiting.push(callback);
+    else
+        callback();
+}
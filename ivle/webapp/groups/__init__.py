@@ -48,7 +48,7 @@ class GroupsView(XHTMLView):
         ctx['ProjectNew'] = ProjectNew
         ctx['ProjectEdit'] = ProjectEdit
         ctx['ProjectDelete'] = ProjectDelete
-        ctx['permissions'] = self.context.get_permissions(req.user,req.config)
+        ctx['permissions'] = req.get_permissions(self.context)
 
 class Plugin(ViewPlugin, MediaPlugin):
     """
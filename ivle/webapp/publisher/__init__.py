@@ -41,6 +41,10 @@ class RouteConflict(PublishingError):
     """A route with the same discriminator is already registered."""
     pass
 
+class PublisherFrozen(PublishingError):
+    """A route was added to a publisher after it was frozen."""
+    pass
+
 def _segment_path(path):
     """Split a path into its segments, after normalisation.
 
@@ -70,6 +74,9 @@ class Publisher(object):
 
     Maintains a registry of forward and reverse routes, dealing with paths
     to objects and views published in the URL space.
+
+    Once all routes are registered, a publisher may be frozen and then bound
+    to different roots, so that the routes are built only once.
     '''
 
     def __init__(self, root, default='+index', viewset=None):
@@ -82,9 +89,32 @@ class Publisher(object):
         self.root = root
         self.default = default
         self.viewset = viewset
+        self.frozen = False
+
+    def freeze(self):
+        """Prevent any more routes being registered.
+
+        The route tables are shared by every publisher made by bind(), so
+        must not change after this.
+        """
+        self.frozen = True
+
+    def bind(self, root):
+        """Return a frozen publisher with these routes and the given root."""
+        self.freeze()
+        # A shallow copy, sharing the route tables.
+        publisher = object.__new__(type(self))
+        publisher.__dict__.update(self.__dict__)
+        publisher.root = root
+        return publisher
+
+    def _check_not_frozen(self):
+        if self.frozen:
+            raise PublisherFrozen(self)
 
     def add_forward(self, src, segment, func, argc):
         """Register a forward (path resolution) route."""
+        self._check_not_frozen()
 
         if src not in self.fmap:
             self.fmap[src] = {}
@@ -103,6 +133,7 @@ class Publisher(object):
 
     def add_reverse(self, src, func):
         """Register a reverse (path generation) route."""
+        self._check_not_frozen()
 
         if src in self.rmap:
              raise RouteConflict((src, func), (src, self.rmap[src]))
@@ -119,6 +150,7 @@ class Publisher(object):
         subpath -- otherwise just using a view with the default name is
         better.
         """
+        self._check_not_frozen()
 
         if src not in self.vmap:
             self.vmap[src] = {}
@@ -138,6 +170,7 @@ class Publisher(object):
 
     def add_set_switch(self, segment, viewset):
         """Register a leading path segment to switch to a view set."""
+        self._check_not_frozen()
 
         if segment in self.smap:
             raise RouteConflict((segment, viewset),
@@ -1,7 +1,10 @@
+import time
+
 from nose.tools import assert_equal, raises
 
 from ivle.webapp.publisher import (INF, InsufficientPathSegments, NoPath,
-                                   NotFound, RouteConflict, Publisher, ROOT)
+                                   NotFound, RouteConflict, Publisher, ROOT,
+                                   PublisherFrozen)
 
 class Root(object):
     def __init__(self):
@@ -545,3 +548,113 @@ class TestErrors(BaseTest):
     @raises(InsufficientPathSegments)
     def testInsufficientPathSegments(self):
         self.rtr.resolve('/info1/foo')
+
+
+def build_publisher(root):
+    """Build a publisher with both forward and reverse routes."""
+    rtr = Publisher(root=root, viewset='browser')
+    rtr.add_set_switch('api', 'api')
+    rtr.add_forward(Root, None, root_to_subject_or_user, 1)
+    rtr.add_forward(Subject, None, subject_to_offering, 2)
+    rtr.add_forward(Offering, '+files', offering_to_files, 0)
+    rtr.add_forward(OfferingFiles, None, offering_files_to_file, INF)
+    rtr.add_forward(Offering, '+projects', offering_to_project, 1)
+    rtr.add_reverse(Subject, subject_url)
+    rtr.add_reverse(Offering, offering_url)
+    rtr.add_reverse(OfferingFiles, offering_files_url)
+    rtr.add_reverse(Project, project_url)
+    rtr.add_view(User, None, UserServeView, viewset='browser')
+    rtr.add_view(Subject, '+index', SubjectIndex, viewset='browser')
+    rtr.add_view(Subject, '+edit', SubjectEdit, viewset='browser')
+    rtr.add_view(Offering, '+index', OfferingIndex, viewset='browser')
+    rtr.add_view(Offering, '+index', OfferingAPIIndex, viewset='api')
+    rtr.add_view(OfferingFiles, '+index', OfferingFilesIndex,
+                 viewset='browser')
+    rtr.add_view(OfferingFile, '+index', OfferingFileIndex, viewset='browser')
+    rtr.add_view(Project, '+index', ProjectIndex, viewset='browser')
+    rtr.add_view(Offering, ('+projects', '+new'), OfferingAddProject,
+                 viewset='browser')
+    rtr.add_view(Offering, ('+projects', '+index'), OfferingProjects,
+                 viewset='browser')
+    rtr.add_view(Offering, ('+worksheets', '+index'), OfferingWorksheets,
+                 viewset='browser')
+    rtr.add_view(Offering, ('+worksheets', '+marks', '+index'),
+                 OfferingWorksheetMarks, viewset='browser')
+    rtr.add_view(Offering, ('+worksheets', '+marks', 'marks.csv'),
+                 OfferingWorksheetCSVMarks, viewset='browser')
+    return rtr
+
+
+class TestBinding(BaseTest):
+    def setUp(self):
+        super(TestBinding, self).setUp()
+        self.rtr = build_publisher(None)
+
+    def testBoundRoot(self):
+        other = Root()
+        other.add_subject(Subject('info1', '600151'))
+        bound = self.rtr.bind(self.r)
+        other_bound = self.rtr.bind(other)
+        assert_equal(bound.resolve('/info1'),
+                     (self.r.subjects['info1'], SubjectIndex, ()))
+        assert_equal(other_bound.resolve('/info1'),
+                     (other.subjects['info1'], SubjectIndex, ()))
+        assert_equal(bound.generate(self.r), '/')
+        assert_equal(bound.generate(
+            self.r.subjects['info1'].offerings[(2009, 1)].projects['p1']),
+            '/info1/2009/1/+projects/p1')
+
+    def testRoutesShared(self):
+        bound = self.rtr.bind(self.r)
+        assert bound.fmap is self.rtr.fmap
+        assert bound.vmap is self.rtr.vmap
+        assert self.rtr.root is None
+
+    @raises(PublisherFrozen)
+    def testFrozen(self):
+        self.rtr.bind(self.r)
+        self.rtr.add_view(Subject, '+delete', View)
+
+    @raises(PublisherFrozen)
+    def testBoundFrozen(self):
+        self.rtr.bind(self.r).add_forward(Project, '+foo', object(), 0)
+
+
+def benchmark(n=20000):
+    """Time building or binding a publisher, and resolving and generating
+    paths with it, in microseconds per operation."""
+    fixture = BaseTest()
+    fixture.setUp()
+    root = fixture.r
+    project = root.subjects['info1'].offerings[(2009, 1)].projects['p1']
+    shared = build_publisher(None)
+
+    def timed(label, func):
+        start = time.time()
+        for i in xrange(n):
+            func()
+        print '%-40s %8.2f us' % (label, (time.time() - start) / n * 1e6)
+
+    timed('build routes', lambda: build_publisher(root))
+    timed('bind root', lambda: shared.bind(root))
+    bound = shared.bind(root)
+    timed('resolve /info1/2009/1/+projects/p1',
+          lambda: bound.resolve('/info1/2009/1/+projects/p1'))
+    timed('resolve deep view',
+          lambda: bound.resolve('/info1/2009/1/+worksheets/+marks/marks.csv'))
+    timed('generate project', lambda: bound.generate(project))
+    timed('generate view',
+          lambda: bound.generate(project.offering, OfferingProjects))
+
+    def per_request(make):
+        rtr = make()
+        rtr.resolve('/info1/2009/1/+projects/p1')
+        rtr.generate(project)
+
+    timed('build, resolve and generate',
+          lambda: per_request(lambda: build_publisher(root)))
+    timed('bind, resolve and generate',
+          lambda: per_request(lambda: shared.bind(root)))
+
+if __name__ == '__main__':
+    benchmark()
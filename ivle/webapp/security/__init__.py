@@ -31,12 +31,12 @@ def get_user_details(req):
 
     # Check the session to see if someone is logged in. If so, go with it.
     try:
-        login = session['login']
-    except KeyError:
+        login = session.get('login')
+    finally:
+        session.unlock()
+    if login is None:
         return None
 
-    session.unlock()
-
     # Get the full User object from the db associated with this login
     return ivle.database.User.get_by_login(req.store, login)
 
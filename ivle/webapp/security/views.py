@@ -19,11 +19,6 @@
 
 import urllib
 import datetime
-try:
-    import mod_python.Cookie
-except ImportError:
-    # This needs to be importable from outside Apache.
-    pass
 
 import ivle.pulldown_subj
 import ivle.webapp.security
@@ -136,8 +131,8 @@ class LoginView(XHTMLView):
                                 # The function can be None if they just need to be
                                 # deleted at logout.
                                 if plugin.cookies[cookie] is not None:
-                                    req.add_cookie(mod_python.Cookie.Cookie(cookie,
-                                          plugin.cookies[cookie](user), path='/'))
+                                    req.add_cookie(cookie,
+                                          plugin.cookies[cookie](user), path='/')
 
                         # Add any new enrolments.
                         ivle.pulldown_subj.enrol_user(req.config, req.store, user)
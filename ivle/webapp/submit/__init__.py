@@ -33,7 +33,7 @@ from ivle.webapp.base.plugins import ViewPlugin
 from ivle.webapp import ApplicationRoot
 
 import ivle.date
-import ivle.chat
+import ivle.usrmgt
 from ivle import util
 
 class SubmitView(XHTMLView):
@@ -114,29 +114,10 @@ class SubmitView(XHTMLView):
                 # commit early so usrmgt-server can see the new submission.
                 req.store.commit()
 
-                # Instruct usrmgt-server to rebuild the SVN group authz file.
-                msg = {'rebuild_svn_group_config': {}}
-                usrmgt = ivle.chat.chat(req.config['usrmgt']['host'],
-                                        req.config['usrmgt']['port'],
-                                        msg,
-                                        req.config['usrmgt']['magic'],
-                                        )
-
-                if usrmgt.get('response') in (None, 'failure'):
-                    raise Exception("Failure creating repository: "
-                                    + str(usrmgt))
-
-                # Instruct usrmgt-server to rebuild the SVN user authz file.
-                msg = {'rebuild_svn_config': {}}
-                usrmgt = ivle.chat.chat(req.config['usrmgt']['host'],
-                                        req.config['usrmgt']['port'],
-                                        msg,
-                                        req.config['usrmgt']['magic'],
-                                        )
-
-                if usrmgt.get('response') in (None, 'failure'):
-                    raise Exception("Failure creating repository: "
-                                    + str(usrmgt))
+                # Instruct usrmgt-server to rebuild the SVN group and user
+                # authz files. It merges this with other pending rebuilds,
+                # so we don't wait for it.
+                ivle.usrmgt.queue_rebuild(req.config)
 
                 self.template = 'submitted.html'
                 ctx['project'] = project
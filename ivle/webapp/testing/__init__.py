@@ -55,6 +55,7 @@ class FakeRequest(Request):
         # and public FQDN) in the output HTML. In that case, set this to 0.
         self.write_javascript_settings = True
         self.got_common_vars = False
+        self._permissions = {}
 
     def __del__(self):
         '''Cleanup, but don't close the nonexistent store.'''
@@ -66,6 +67,9 @@ class FakeRequest(Request):
            been written.'''
         pass
 
+    def is_https(self):
+        return False
+
     def read(self, len=None):
         if len is None:
             data = self.request_body
@@ -87,3 +91,68 @@ class FakeRequest(Request):
         '''Fake a flush.'''
         pass
 
+
+class FakeApacheRequest(object):
+    '''A fake mod_python request object, for driving the dispatch handler
+    without a web server.
+
+    The response is collected in status, headers_out and response_body.
+    '''
+    def __init__(self, uri, method='GET', hostname='fakehost',
+                 headers_in=None, body=''):
+        self.method = method
+        self.uri = uri.split('?', 1)[0]
+        self.unparsed_uri = uri
+        self.args = uri.split('?', 1)[1] if '?' in uri else None
+        self.hostname = hostname
+        self.headers_in = headers_in or {}
+        self.headers_out = {}
+        self.subprocess_env = {}
+        self.content_type = None
+        self.status = None
+        self.request_body = body
+        self.response_body = ''
+
+    def is_https(self):
+        return False
+
+    def add_common_vars(self):
+        pass
+
+    def set_content_length(self, length):
+        self.headers_out['Content-Length'] = str(length)
+
+    def read(self, len=None):
+        if len is None:
+            data = self.request_body
+            self.request_body = ''
+        else:
+            data = self.request_body[:len]
+            self.request_body = self.request_body[len:]
+        return data
+
+    def write(self, string, flush=1):
+        self.response_body += string
+
+    def flush(self):
+        pass
+
+    def sendfile(self, filename):
+        self.response_body += open(filename, 'rb').read()
+
+class FakeSession(dict):
+    '''A fake mod_python session, holding values in memory.'''
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+    def save(self):
+        pass
+
+    def invalidate(self):
+        self.clear()
+
+    def delete(self):
+        self.clear()
@@ -66,6 +66,21 @@ from ivle.webapp.tutorial.media import (SubjectMediaFile, SubjectMediaView,
     subject_to_media)
 from ivle.webapp.tutorial.marks import (WorksheetsMarksView,
             WorksheetsMarksCSVView)
+from ivle.webapp.tutorial.statistics import WorksheetsStatisticsView
+from ivle.webapp.tutorial.cache import (placeholder, WorksheetBody,
+            WorksheetBodyCache, worksheet_fingerprint)
+
+# The rendered bodies of recently viewed worksheets, shared by every request
+# this process handles. Created by get_worksheet_bodies.
+worksheet_bodies = None
+
+def get_worksheet_bodies(config):
+    """Get this process's WorksheetBodyCache."""
+    global worksheet_bodies
+    if worksheet_bodies is None:
+        worksheet_bodies = WorksheetBodyCache(
+            config['tutorial']['worksheet_cache_size'])
+    return worksheet_bodies
 
 
 class WorksheetView(XHTMLView):
@@ -86,17 +101,28 @@ class WorksheetView(XHTMLView):
         ctx['semester'] = self.context.offering.semester.url_name
         ctx['year'] = self.context.offering.semester.year
 
-        ctx['worksheetstream'] = genshi.Stream(list(genshi.XML(self.context.data_xhtml)))
         ctx['user'] = req.user
         ctx['config'] = req.config
 
-        ctx['show_exercise_stats'] = \
-            'edit' in self.context.get_permissions(req.user,
-                                                   req.config)
+        ctx['permissions'] = req.get_permissions(self.context)
+        ctx['show_exercise_stats'] = 'edit' in ctx['permissions']
 
-        generate_worksheet_data(ctx, req, self._loader, self.context)
+        states = ivle.worksheet.utils.get_worksheet_exercise_states(
+            req.store, req.user, self.context,
+            statistics=ctx['show_exercise_stats'],
+            use_progress=req.config['tutorial']['use_progress_table'])
 
-        ctx['worksheetstream'] = add_exercises(ctx['worksheetstream'], ctx, req)
+        # The body is the same for everyone, apart from the per-user values
+        # filled in by present_worksheet_exercises.
+        fingerprint = worksheet_fingerprint(self.context,
+            [state['exercise'] for state in states.values()],
+            self.context.offering.has_worksheet_cutoff_passed(req.user))
+        body = get_worksheet_bodies(req.config).get(self.context.id,
+            fingerprint, lambda: generate_worksheet_body(
+                req, self._loader, self.context, states))
+
+        ctx['exercises'], values = present_worksheet_exercises(body, states)
+        ctx['worksheetstream'] = body.generate(values)
 
 def get_worksheets(subjectfile):
     '''Given a subject stream, get all the worksheets and put them in ctx'''
@@ -151,32 +177,62 @@ def add_exercises(stream, ctx, req):
         else:
             yield kind, data, pos
 
-# This function runs through the worksheet, to get data on the exercises to
-# build a Table of Contents, as well as fill in details in ctx
-def generate_worksheet_data(ctx, req, loader, worksheet):
-    """Runs through the worksheetstream, generating the exericises"""
-    ctx['exercises'] = []
-    ctx['exerciselist'] = []
-    for kind, data, pos in ctx['worksheetstream']:
-        if kind is genshi.core.START:
-            if data[0] == 'exercise':
-                src = ""
-                optional = False
-                for attr in data[1]:
-                    if attr[0] == 'src':
-                        src = attr[1]
-                    if attr[0] == 'optional':
-                        optional = attr[1] == 'true'
-                # Each item in toc is of type (name, complete, stream)
-                if src != "":
-                    ctx['exercises'].append(
-                        present_exercise(req, loader, src, worksheet))
-                    ctx['exerciselist'].append((src, optional))
-            elif data[0] == 'worksheet':
-                ctx['worksheetname'] = 'bob'
-                for attr in data[1]:
-                    if attr[0] == 'name':
-                        ctx['worksheetname'] = attr[1]
+# This function runs through the worksheet, rendering the exercises with
+# placeholders for each user's saved text and results.
+def generate_worksheet_body(req, loader, worksheet, states):
+    """Render the parts of a worksheet that are the same for every user.
+
+    states is the worksheet's get_worksheet_exercise_states. Returns a
+    WorksheetBody.
+    """
+    worksheetstream = genshi.Stream(list(genshi.XML(worksheet.data_xhtml)))
+    fragments = []
+    exercises = []
+    for kind, data, pos in worksheetstream:
+        if kind is genshi.core.START and data[0] == 'exercise':
+            src = dict(data[1]).get('src', '')
+            if src == '':
+                continue
+            if src not in states:
+                raise NotFound()
+            exercise = states[src]['exercise']
+            index = len(exercises)
+            fragments.append({'stream': list(render_exercise(req, loader,
+                exercise, worksheet,
+                exercisesave=placeholder('save', index),
+                complete=placeholder('complete', index),
+                complete_class=placeholder('class', index),
+                attempts=placeholder('attempts', index)))})
+            exercises.append((src, exercise.name))
+
+    events = list(add_exercises(worksheetstream, {'exercises': fragments},
+                                req))
+    return WorksheetBody(events, exercises)
+
+def present_worksheet_exercises(body, states):
+    """Work out the user's values for a WorksheetBody's placeholders.
+
+    Returns the list of exercises for the table of contents, and the
+    values to fill in.
+    """
+    exercises = []
+    values = {}
+    for (index, (src, name)) in enumerate(body.exercises):
+        state = states[src]
+        if state['save'] is not None:
+            exercisesave = state['save'].text
+        else:
+            exercisesave = state['exercise'].partial
+        complete = 'Complete' if state['complete'] else 'Incomplete'
+        values['save_%d' % index] = exercisesave or u''
+        values['complete_%d' % index] = complete
+        values['class_%d' % index] = complete.lower()
+        values['attempts_%d' % index] = unicode(state['attempts'])
+        exercises.append({'name': name,
+                          'complete': complete.lower(),
+                          'exid': src,
+                          'stats': state['stats']})
+    return exercises, values
 
 def innerXML(elem):
     """Given an element, returns its children as XML strings concatenated
@@ -201,19 +257,16 @@ def getTextData(element):
 
     return data.strip()
 
-def present_exercise(req, loader, identifier, worksheet=None):
+def present_exercise(req, loader, identifier, worksheet=None, state=None):
     """Render an HTML representation of an exercise.
 
     identifier: The exercise identifier (URL name).
     worksheet: An optional worksheet from which to retrieve saved results.
                If omitted, a clean exercise will be presented.
+    state: The exercise's entry in get_worksheet_exercise_states for the
+           worksheet, if it has already been loaded.
     """
-    # Exercise-specific context is used here, as we already have all the data
-    # we need
-    curctx = genshi.template.Context()
-    curctx['worksheet'] = worksheet
-
-    if worksheet is not None:
+    if worksheet is not None and state is None:
         worksheet_exercise = req.store.find(WorksheetExercise,
             WorksheetExercise.worksheet_id == worksheet.id,
             WorksheetExercise.exercise_id == identifier).one()
@@ -221,13 +274,71 @@ def present_exercise(req, loader, identifier, worksheet=None):
         if worksheet_exercise is None:
             raise NotFound()
 
-    # Retrieve the exercise details from the database
-    exercise = req.store.find(Exercise, 
-        Exercise.id == identifier).one()
+        save = ivle.worksheet.utils.get_exercise_stored_text(
+                            req.store, req.user, worksheet_exercise)
+        # Also get the number of attempts taken and whether this is complete.
+        complete, attempts = ivle.worksheet.utils.get_exercise_status(
+            req.store, req.user, worksheet_exercise,
+            use_progress=req.config['tutorial']['use_progress_table'])
+        # Store exercise statistics
+        if 'edit' in req.get_permissions(worksheet):
+            exercise_stats = ivle.worksheet.utils.get_exercise_statistics(
+                req.store, worksheet_exercise)
+        else:
+            exercise_stats = None
+    elif worksheet is not None:
+        save = state['save']
+        complete = state['complete']
+        attempts = state['attempts']
+        exercise_stats = state['stats']
+    else:
+        save = None
+        complete = False
+        attempts = 0
+        exercise_stats = None
+
+    if state is not None:
+        exercise = state['exercise']
+    else:
+        # Retrieve the exercise details from the database
+        exercise = req.store.find(Exercise,
+            Exercise.id == identifier).one()
 
     if exercise is None:
         raise ivle.worksheet.utils.ExerciseNotFound(identifier)
 
+    # If the user has already saved some text for this problem, or submitted
+    # an attempt, then use that text instead of the supplied "partial".
+    # Get exercise stored text will return a save, or the most recent attempt,
+    # whichever is more recent
+    if save is not None:
+        exercisesave = save.text
+    else:
+        exercisesave = exercise.partial
+    complete = 'Complete' if complete else 'Incomplete'
+
+    #Save the exercise details to the Table of Contents
+
+    ex_stream = render_exercise(req, loader, exercise, worksheet,
+        exercisesave, complete, complete.lower(), attempts)
+    return {'name': exercise.name,
+            'complete': complete.lower(),
+            'stream': ex_stream,
+            'exid': exercise.id,
+            'stats': exercise_stats}
+
+def render_exercise(req, loader, exercise, worksheet, exercisesave, complete,
+                    complete_class, attempts):
+    """Render an exercise's fragment template, returning a Genshi stream.
+
+    The user's saved text, "Complete" or "Incomplete", its CSS class and
+    attempt count are given.
+    """
+    # Exercise-specific context is used here, as we already have all the data
+    # we need
+    curctx = genshi.template.Context()
+    curctx['worksheet'] = worksheet
+
     # Read exercise file and present the exercise
     # Note: We do not use the testing framework because it does a lot more
     # work than we need. We just need to get the exercise name and a few other
@@ -246,47 +357,14 @@ def present_exercise(req, loader, identifier, worksheet=None):
     except docutils.utils.SystemMessage, e:
         curctx['error'] = "Error processing reStructuredText: '%s'" % str(e)
 
-    # If the user has already saved some text for this problem, or submitted
-    # an attempt, then use that text instead of the supplied "partial".
-    # Get exercise stored text will return a save, or the most recent attempt,
-    # whichever is more recent
-    if worksheet is not None:
-        save = ivle.worksheet.utils.get_exercise_stored_text(
-                            req.store, req.user, worksheet_exercise)
-
-        # Also get the number of attempts taken and whether this is complete.
-        complete, curctx['attempts'] = \
-                ivle.worksheet.utils.get_exercise_status(req.store, req.user, 
-                                                         worksheet_exercise)
-        if save is not None:
-            curctx['exercisesave'] = save.text
-        else:
-            curctx['exercisesave']= exercise.partial
-        curctx['complete'] = 'Complete' if complete else 'Incomplete'
-        curctx['complete_class'] = curctx['complete'].lower()
-    else:
-        curctx['exercisesave'] = exercise.partial
-        curctx['complete'] = 'Incomplete'
-        curctx['complete_class'] = curctx['complete'].lower()
-        curctx['attempts'] = 0
-
-    #Save the exercise details to the Table of Contents
+    curctx['exercisesave'] = exercisesave
+    curctx['complete'] = complete
+    curctx['complete_class'] = complete_class
+    curctx['attempts'] = attempts
 
     tmpl = loader.load(os.path.join(os.path.dirname(__file__),
         "templates/exercise_fragment.html"))
-    ex_stream = tmpl.generate(curctx)
-    # Store exercise statistics
-    if (worksheet is not None and
-        'edit' in worksheet.get_permissions(req.user, req.config)):
-        exercise_stats = ivle.worksheet.utils.get_exercise_statistics(
-            req.store, worksheet_exercise)
-    else:
-        exercise_stats = None
-    return {'name': exercise.name,
-            'complete': curctx['complete_class'],
-            'stream': ex_stream,
-            'exid': exercise.id,
-            'stats': exercise_stats}
+    return tmpl.generate(curctx)
 
 
 # The first element is the default format
@@ -600,6 +678,8 @@ class Plugin(ViewPlugin, MediaPlugin):
               WorksheetsMarksView),
              (Offering, ('+worksheets', '+marks', 'marks.csv'),
               WorksheetsMarksCSVView),
+             (Offering, ('+worksheets', '+statistics'),
+              WorksheetsStatisticsView),
              (Worksheet, '+index', WorksheetView),
              (Worksheet, '+edit', WorksheetEditView),
              (ApplicationRoot, ('+exercises', '+index'), ExercisesView),
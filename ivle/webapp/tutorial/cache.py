@@ -0,0 +1,148 @@
+# IVLE
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Caching of the parts of worksheet pages which are the same for everyone.
+
+Rendering a worksheet means parsing its XHTML and rendering a template for
+every exercise in it, but only an exercise's saved text, completion and
+attempt count differ between users. A WorksheetBody holds the rendered
+page with placeholders for those, and is filled in for each request.
+"""
+
+import hashlib
+import re
+import threading
+
+import genshi
+from genshi.core import Attrs
+
+__all__ = ['placeholder', 'WorksheetBody', 'WorksheetBodyCache',
+           'worksheet_fingerprint']
+
+# NUL can't appear in XML, so placeholders can't clash with real content.
+PLACEHOLDER = re.compile(u'\x00(\\w+)\x00')
+
+def placeholder(name, index):
+    """Return a placeholder for a per-user value of the index'th exercise.
+    """
+    return u'\x00%s_%d\x00' % (name, index)
+
+def _fill(text, values):
+    return PLACEHOLDER.sub(lambda m: values[m.group(1)], text)
+
+class WorksheetBody(object):
+    """A rendered worksheet, with placeholders for per-user values.
+
+    events is the list of Genshi events of the worksheet body. exercises is
+    a list of the (identifier, name) of each exercise in it, in order.
+    """
+    def __init__(self, events, exercises):
+        self.events = events
+        self.exercises = exercises
+        # The indices of the events which contain placeholders.
+        self.slots = []
+        for (i, (kind, data, pos)) in enumerate(events):
+            if kind is genshi.core.TEXT and PLACEHOLDER.search(data):
+                self.slots.append(i)
+            elif kind is genshi.core.START and [value for (name, value)
+                    in data[1] if PLACEHOLDER.search(value)]:
+                self.slots.append(i)
+
+    def generate(self, values):
+        """Return a Genshi stream of the worksheet, with each placeholder
+        replaced by its value in the given dictionary."""
+        events = list(self.events)
+        for i in self.slots:
+            kind, data, pos = events[i]
+            if kind is genshi.core.TEXT:
+                data = _fill(data, values)
+            else:
+                data = (data[0], Attrs([(name, _fill(value, values))
+                                        for (name, value) in data[1]]))
+            events[i] = (kind, data, pos)
+        return genshi.Stream(events)
+
+def worksheet_fingerprint(worksheet, exercises, *extra):
+    """Return a digest of everything a worksheet's body is rendered from.
+
+    Editing the worksheet (Worksheet.set_data) or any of its exercises
+    (Exercise.set_description, or the exercise edit forms) changes the
+    fingerprint, so stale bodies are never used by any process.
+    """
+    digest = hashlib.sha1()
+    parts = [worksheet.format, worksheet.data]
+    for exercise in sorted(exercises, key=lambda e: e.id):
+        parts += [exercise.id, exercise.name, exercise.description,
+                  exercise.partial, exercise.num_rows]
+    for part in parts + list(extra):
+        if part is None:
+            part = u''
+        digest.update(unicode(part).encode('utf-8'))
+        digest.update('\0')
+    return digest.hexdigest()
+
+class WorksheetBodyCache(object):
+    """The latest WorksheetBody of each worksheet.
+
+    Bodies are stored by worksheet ID with the fingerprint they were built
+    from; a body with a different fingerprint is rebuilt and replaces it.
+    At most size worksheets are kept, discarding the least recently used.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.bodies = {}
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, worksheet_id, fingerprint, build):
+        """Return the worksheet's body with the given fingerprint, calling
+        build() to make it if it isn't cached."""
+        self.lock.acquire()
+        try:
+            self.used += 1
+            entry = self.bodies.get(worksheet_id)
+            if entry is not None and entry[0] == fingerprint:
+                entry[2] = self.used
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        # Build outside the lock; two requests may do the work at once, but
+        # they'll build the same thing.
+        body = build()
+
+        self.lock.acquire()
+        try:
+            self.bodies[worksheet_id] = [fingerprint, body, self.used]
+            while len(self.bodies) > self.size:
+                oldest = min(self.bodies, key=lambda k: self.bodies[k][2])
+                del self.bodies[oldest]
+        finally:
+            self.lock.release()
+        return body
+
+    def forget(self, worksheet_id):
+        """Discard any cached body of the worksheet."""
+        self.lock.acquire()
+        try:
+            self.bodies.pop(worksheet_id, None)
+        finally:
+            self.lock.release()
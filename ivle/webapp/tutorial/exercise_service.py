@@ -85,6 +85,7 @@ class ExerciseRESTView(JSONRESTView):
         self.context.solution = unicode(solution)
         self.context.include = unicode(include)
         self.context.num_rows = int(num_rows)
+        self.context.invalidate_solution_outputs()
         return {'result': 'ok'}
     
     @write_operation(u'edit')
@@ -104,6 +105,7 @@ class ExerciseRESTView(JSONRESTView):
         new_suite.exercise = self.context
         
         req.store.add(new_suite)
+        self.context.invalidate_solution_outputs()
         
         return {'result': 'ok'}
         
@@ -120,6 +122,7 @@ class ExerciseRESTView(JSONRESTView):
         suite.description = unicode(description)
         suite.function = unicode(function)
         suite.stdin = unicode(stdin)
+        self.context.invalidate_solution_outputs()
         
         return {'result': 'ok'}
     
@@ -133,6 +136,7 @@ class ExerciseRESTView(JSONRESTView):
             raise NotFound()
         
         suite.delete()
+        self.context.invalidate_solution_outputs()
         
         return {'result': 'ok'}
       
@@ -154,6 +158,7 @@ class ExerciseRESTView(JSONRESTView):
         new_var.suite = suite
         
         req.store.add(new_var)
+        self.context.invalidate_solution_outputs()
         
         return {'result': 'ok'}
 
@@ -171,6 +176,7 @@ class ExerciseRESTView(JSONRESTView):
         var.var_name = unicode(var_name)
         var.var_value = unicode(var_val)
         var.arg_no = int(argno) if len(argno) else None
+        self.context.invalidate_solution_outputs()
         
         return {'result': 'ok'}
     
@@ -183,6 +189,7 @@ class ExerciseRESTView(JSONRESTView):
             raise NotFound()
         
         var.delete()
+        self.context.invalidate_solution_outputs()
         
         return {'result': 'ok'}
         
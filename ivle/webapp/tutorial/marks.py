@@ -62,7 +62,8 @@ class WorksheetsMarksView(XHTMLView):
         ctx['error'] = error
 
         # "worksheets" is a list of (assessable, published) worksheet names
-        worksheets = offering.worksheets.find(assessable=True, published=True)
+        worksheets = list(offering.worksheets.find(assessable=True,
+                                                   published=True))
         ctx['worksheets'] = [ws.name for ws in worksheets]
 
         # "students" is a list of tuples:
@@ -71,13 +72,13 @@ class WorksheetsMarksView(XHTMLView):
         # worksheet), total_pct is a float, mark is an int
         ctx['students'] = students = []
         # Get all users enrolled in this offering
-        users = req.store.find(ivle.database.User,
+        users = list(req.store.find(ivle.database.User,
                        ivle.database.User.id == ivle.database.Enrolment.user_id,
                        offering.id == ivle.database.Enrolment.offering).order_by(
-                            ivle.database.User.login)
+                            ivle.database.User.login))
+        marks = get_marks_users(req, worksheets, users, as_of=cutoff)
         for user in users:
-            worksheet_pcts, total_pct, mark = get_marks_user(req, worksheets,
-                                                user, as_of=cutoff)
+            worksheet_pcts, total_pct, mark = marks[user.id]
             students.append((user, worksheet_pcts, total_pct, mark))
 
 class WorksheetsMarksCSVView(BaseView):
@@ -110,19 +111,22 @@ class WorksheetsMarksCSVView(BaseView):
              offering.semester.url_name))
 
         # "worksheets" is a list of (assessable, published) worksheet names
-        worksheets = offering.worksheets.find(assessable=True, published=True)
+        worksheets = list(offering.worksheets.find(assessable=True,
+                                                   published=True))
 
         # Start writing the CSV file - header
         csvfile = csv.writer(req)
         csvfile.writerow(csv_get_header(worksheets))
 
         # Get all users enrolled in this offering
-        users = req.store.find(ivle.database.User,
+        users = list(req.store.find(ivle.database.User,
                    ivle.database.User.id == ivle.database.Enrolment.user_id,
                    offering.id == ivle.database.Enrolment.offering).order_by(
-                        ivle.database.User.login)
+                        ivle.database.User.login))
+        marks = get_marks_users(req, worksheets, users, as_of=cutoff)
         for user in users:
-            csv_writeuser(req, worksheets, user, csvfile, cutoff)
+            csv_writeuser(req, worksheets, user, csvfile, cutoff,
+                          marks=marks[user.id])
 
 def get_marks_user(req, worksheets, user, as_of=None):
     """Gets marks for a particular user for a particular set of worksheets.
@@ -131,17 +135,38 @@ def get_marks_user(req, worksheets, user, as_of=None):
     @param as_of: Optional datetime. If supplied, gets the marks as of as_of.
     @returns: (worksheet_pcts, total_pct, mark)
     """
+    return _marks_from_scores(
+        [ivle.worksheet.utils.calculate_score(req.store, user, worksheet,
+            as_of, req.config['tutorial']['use_progress_table'])
+         for worksheet in worksheets])
+
+def get_marks_users(req, worksheets, users, as_of=None):
+    """Gets marks for many users at once, with a few aggregate queries.
+    @param worksheets: List of Worksheet objects to get marks for.
+    @param users: List of Users to get marks for.
+    @param as_of: Optional datetime. If supplied, gets the marks as of as_of.
+    @returns: A dict mapping user IDs to the same (worksheet_pcts,
+        total_pct, mark) tuples as get_marks_user.
+    """
+    user_ids = [user.id for user in users]
+    scores = ivle.worksheet.utils.calculate_scores(req.store, user_ids,
+        worksheets, as_of, req.config['tutorial']['use_progress_table'])
+    return dict((user_id,
+                 _marks_from_scores([scores[(user_id, worksheet.id)]
+                                     for worksheet in worksheets]))
+                for user_id in user_ids)
+
+def _marks_from_scores(scores):
+    """Turns a user's calculate_score results for each worksheet into
+    (worksheet_pcts, total_pct, mark)."""
     worksheet_pcts = []
     # As we go, calculate the total score for this subject
     # (Assessable worksheets only, mandatory problems only)
     problems_done = 0
     problems_total = 0
 
-    for worksheet in worksheets:
+    for (mand_done, mand_total, _, _) in scores:
         # We simply ignore optional exercises here
-        mand_done, mand_total, _, _ = (
-            ivle.worksheet.utils.calculate_score(req.store, user, worksheet,
-                                                 as_of))
         if mand_total > 0:
             worksheet_pcts.append(float(mand_done) / mand_total)
         else:
@@ -173,10 +198,11 @@ def csv_get_header(worksheets):
     return (csv_userdata_header + [ws.name for ws in worksheets]
             + ["Total %", "Mark"])
 
-def csv_writeuser(req, worksheets, user, csvfile, cutoff=None):
+def csv_writeuser(req, worksheets, user, csvfile, cutoff=None, marks=None):
     userdata = csv_get_userdata(user)
-    worksheet_pcts, total_pct, mark = get_marks_user(req, worksheets, user,
-                                                     cutoff)
+    if marks is None:
+        marks = get_marks_user(req, worksheets, user, cutoff)
+    worksheet_pcts, total_pct, mark = marks
     data = userdata + worksheet_pcts + [total_pct, mark]
     # CSV writer can't handle non-ASCII characters. Encode to UTF-8.
     data = [unicode(x).encode('utf-8') for x in data]
@@ -88,6 +88,17 @@ function submitexercise(exerciseid, filename)
                 set_submit_status(exerciseid, filename, "Submit");
                 return;
             }
+            if (testresponse.hasOwnProperty('job'))
+            {
+                /* Still being tested. Ask again shortly. */
+                setTimeout(function()
+                    {
+                        ajax_call(callback, attempts_path, "",
+                            {'ivle.op': 'job', 'job': testresponse.job},
+                            "GET");
+                    }, 1000);
+                return;
+            }
             handle_testresponse(exercisediv, exerciseid, testresponse);
             set_saved_status(exerciseid, filename, "Saved");
             set_submit_status(exerciseid, filename, "Submit");
@@ -453,6 +464,9 @@ function catch_textbox_input(exerciseid, filename, key)
     /* Always update the saved status, so it will enable the save button and
      * auto-save timer. */
     set_saved_status(exerciseid, filename, "Save");
+    /* They may well run it in the console soon, if this page has one. */
+    if (typeof(console_prewarm) == "function")
+        console_prewarm();
     var inp = document.getElementById('textarea_' + exerciseid);
     switch (key)
     {
@@ -27,10 +27,11 @@ from storm.locals import Store
 import ivle.database
 from ivle.database import Exercise, ExerciseAttempt, ExerciseSave, Worksheet, \
                           Offering, Subject, Semester, User, WorksheetExercise
+import ivle.worksheet.grader
 import ivle.worksheet.utils
-from ivle.webapp.base.rest import (JSONRESTView, write_operation,
-                                   require_permission)
-from ivle.webapp.errors import NotFound
+from ivle.webapp.base.rest import (JSONRESTView, read_operation,
+                                   write_operation, require_permission)
+from ivle.webapp.errors import BadRequest, NotFound
 
 
 TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
@@ -55,34 +56,49 @@ class AttemptsRESTView(JSONRESTView):
 
     @require_permission('edit')
     def PUT(self, req, data):
-        """ Tests the given submission """
+        """ Tests the given submission
+
+        The submission is queued with the grading server, which records the
+        attempt. Unless 'wait' is false, we wait for the results; if they
+        take too long, or 'wait' is false, a job to poll with the 'job'
+        operation is returned instead.
+        """
         # Trim off any trailing whitespace (can cause syntax errors in python)
         # While technically this is a user error, it causes a lot of confusion 
         # for student since it's "invisible".
         code = data['code'].rstrip()
 
-        test_results = ivle.worksheet.utils.test_exercise_submission(
-            req.config, req.user, self.context.worksheet_exercise.exercise,
-            code)
-
-        attempt = ivle.database.ExerciseAttempt(user=req.user,
-            worksheet_exercise = self.context.worksheet_exercise,
-            date = datetime.datetime.now(),
-            complete = test_results['passed'],
-            text = unicode(code)
-        )
-
-        req.store.add(attempt)
-
-        # Query the DB to get an updated score on whether or not this problem
-        # has EVER been completed (may be different from "passed", if it has
-        # been completed before), and the total number of attempts.
-        completed, attempts = ivle.worksheet.utils.get_exercise_status(
-                req.store, req.user, self.context.worksheet_exercise)
-        test_results["completed"] = completed
-        test_results["attempts"] = attempts
-
-        return test_results
+        try:
+            job = ivle.worksheet.grader.submit_job(req.config, req.user,
+                self.context.worksheet_exercise, code)
+        except ivle.worksheet.grader.GraderBusy, e:
+            raise BadRequest(str(e))
+
+        if data.get('wait', True):
+            job = ivle.worksheet.grader.wait_for_job(req.config, req.user,
+                job, req.config['grading']['wait_timeout'])
+        return self._job_response(job)
+
+    @read_operation('edit')
+    def job(self, req, job):
+        """Get the results of a submission, or its job if it is still being
+        graded."""
+        job = ivle.worksheet.grader.get_job(req.config, req.user, job)
+        if job is None:
+            raise NotFound()
+        return self._job_response(job)
+
+    def _job_response(self, job):
+        if job['state'] == 'done':
+            # The results, with the updated score on whether or not this
+            # problem has EVER been completed (may be different from
+            # "passed", if it has been completed before), and the total
+            # number of attempts.
+            return job['result']
+        elif job['state'] == 'failed':
+            raise ivle.worksheet.grader.GraderError(
+                "Failure testing submission: " + job['error'])
+        return job
 
 
 class AttemptRESTView(JSONRESTView):
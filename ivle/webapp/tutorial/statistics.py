@@ -0,0 +1,73 @@
+# IVLE
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Worksheet exercise statistics for subject staff.
+
+Shows how many users have attempted and completed each exercise in an
+offering's worksheets, and how many attempts they took, from the
+incrementally maintained ExerciseStatistics.
+"""
+
+from ivle.database import Enrolment, Exercise, WorksheetExercise
+import ivle.worksheet.utils
+from ivle.webapp.base.xhtml import XHTMLView
+
+class WorksheetsStatisticsView(XHTMLView):
+    """Dashboard of the statistics of all exercises in an offering."""
+    permission = 'view_exercise_statistics'
+    template = 'templates/worksheets_statistics.html'
+    tab = 'subjects'
+
+    def populate(self, req, ctx):
+        offering = self.context
+        ctx['req'] = req
+        ctx['context'] = offering
+
+        # Unless we can edit worksheets, hide unpublished ones.
+        worksheets = offering.worksheets
+        if 'edit_worksheets' not in req.get_permissions(offering):
+            worksheets = worksheets.find(published=True)
+        worksheets = list(worksheets)
+
+        exercises = {}
+        for (worksheet_exercise, exercise) in req.store.find(
+                (WorksheetExercise, Exercise),
+                WorksheetExercise.worksheet_id.is_in(
+                    [worksheet.id for worksheet in worksheets]),
+                WorksheetExercise.active == True,
+                WorksheetExercise.exercise_id == Exercise.id
+                ).order_by(WorksheetExercise.seq_no):
+            exercises.setdefault(worksheet_exercise.worksheet_id, []).append(
+                (worksheet_exercise, exercise))
+
+        statistics = ivle.worksheet.utils.get_worksheet_exercise_statistics(
+            req.store, [worksheet_exercise.id
+                        for pairs in exercises.values()
+                        for (worksheet_exercise, exercise) in pairs])
+
+        # "worksheets" is a list of (worksheet, exercises) pairs, where
+        # exercises is a list of (worksheet exercise, exercise, statistics).
+        ctx['worksheets'] = [
+            (worksheet, [(worksheet_exercise, exercise,
+                          statistics[worksheet_exercise.id])
+                         for (worksheet_exercise, exercise)
+                         in exercises.get(worksheet.id, [])])
+            for worksheet in worksheets]
+        ctx['students'] = req.store.find(Enrolment,
+            Enrolment.offering_id == offering.id,
+            Enrolment.role == u'student',
+            Enrolment.active == True).count()
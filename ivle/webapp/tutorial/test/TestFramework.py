@@ -40,9 +40,15 @@ in a safe environment.
 """
 
 import sys, copy
+import cPickle
+import hashlib
 import types
 
+from storm.locals import Store
+from storm.exceptions import IntegrityError
+
 from ivle import testfilespace
+from ivle.database import ExerciseSolutionOutput
 
 # Don't let nose into here, as it has lots of stuff named Test* without being
 # tests.
@@ -373,6 +379,11 @@ class TestCase:
         """
         self._console = console
         self._name = suite.description
+        self._solution_cache = None
+        # Everything about the suite that affects the solution's output.
+        self._cache_parts = (suite.function, suite.stdin,
+            [(var.var_type, var.var_name, var.var_value, var.arg_no)
+             for var in suite.variables])
         
         function = suite.function
         if function == '': function = None
@@ -462,43 +473,44 @@ class TestCase:
         """ Get the name of the test case """
         return self._name
 
-    def run(self, solution, attempt_code, include_space, stop_on_fail=True):
-        """ Run the solution and the attempt with the inputs specified for this test case.
-        Then pass the outputs to each test part and collate the results.
+    def set_solution_cache(self, cache, include_code):
+        """ Use the given SolutionCache for the solution's outputs. """
+        self._solution_cache = cache
+        self._include_code = include_code
+
+    def run_solution(self, solution):
+        """ Return the outputs of the solution with the inputs specified for
+        this test case, running it unless they are already cached.
+
+        The solution must be run before any attempt code in this console, as
+        the attempt may have changed state (eg. builtins) that outlives it.
         """
-        case_dict = {}
-        case_dict['name'] = self._name
-        
-        # Run solution
+        if self._solution_cache is not None:
+            cache_key = self._solution_cache.key(solution,
+                self._include_code, *self._cache_parts)
+            solution_data = self._solution_cache.get(cache_key)
+            if solution_data is not None:
+                return solution_data
         try:
-            global_space_copy = copy.deepcopy(self._global_space)
-            solution_data = self._execstring(solution, global_space_copy)
-            self._console.stdin.truncate(0)
-            self._console.stdin.write(self._stdin)
-            
-            # if we are just testing a function
-            if not self._function == None:
-                if self._function not in solution_data['globals']:
-                    raise FunctionNotFoundError(self._function)
-                solution_data = self._run_function(self._function,
-                    self._list_args, self._keyword_args, solution)
-                
+            solution_data = self._run_code(solution)
         except Exception, e:
             raise TestError(sys.exc_info())
-
+        if self._solution_cache is not None:
+            self._solution_cache.put(cache_key, solution_data)
+        return solution_data
+
+    def run(self, solution_data, attempt_code, include_space,
+            stop_on_fail=True):
+        """ Run the attempt with the inputs specified for this test case.
+        Then pass its outputs and the solution's (from run_solution) to each
+        test part and collate the results.
+        """
+        case_dict = {}
+        case_dict['name'] = self._name
+        
         # Run student attempt
         try:
-            global_space_copy = copy.deepcopy(self._global_space)
-            attempt_data = self._execstring(attempt_code, global_space_copy)
-            self._console.stdin.truncate(0)
-            self._console.stdin.write(self._stdin)
-            
-            # if we are just testing a function
-            if not self._function == None:
-                if self._function not in attempt_data['globals']:
-                    raise FunctionNotFoundError(self._function)
-                attempt_data = self._run_function(self._function,
-                    self._list_args, self._keyword_args, attempt_code)
+            attempt_data = self._run_code(attempt_code)
         except:
             case_dict['exception'] = ScriptExecutionError(sys.exc_info()).to_dict()
             case_dict['passed'] = False
@@ -532,71 +544,76 @@ class TestCase:
         case_dict['passed'] = passed
 
         return case_dict
-                
-    def _execfile(self, filename, global_space):
-        """ Execute the file given by 'filename' in global_space, and return the outputs. """
-        self._initialise_global_space(global_space)
-        data = self._run_function(lambda: execfile(filename, global_space),
-            code = open(filename).read())
-        return data
-
-    def _execstring(self, string, global_space):
-        """ Execute the given string in global_space, and return the outputs. 
+
+    def _run_code(self, code):
+        """ Run the code (and then the function, if we are just testing a
+        function) with the inputs of this test case, and return all the
+        output data. This takes a single round trip to the console.
         """
-        self._initialise_global_space(global_space)
-        
-        inspection = self._console.execute(string)
+        s_args = map(repr, self._list_args)
+        s_kwargs = dict(zip(self._keyword_args.keys(),
+                            map(repr, self._keyword_args.values())))
+        run = self._console.run_test(copy.deepcopy(self._global_space), code,
+            self._function, s_args, s_kwargs, self._stdin,
+            self._allowed_exceptions)
 
         exception_name = None
-        if 'exception' in inspection:
-            exception = inspection['exception']
+        if run['exception'] is not None:
+            exception = run['exception']['except']
             exception_name = type(exception).__name__
-            if exception_name not in self._allowed_exceptions:
+            if run['exception']['phase'] == 'call' or \
+               exception_name not in self._allowed_exceptions:
                 raise(exception)
 
-        return {'code': string,
-                'result': None,
-                'globals': self._console.globals(),
-                'exception': exception_name,
-                'stdout': self._console.stdout.read(),
-                'stderr': self._console.stderr.read(),
-                'modified_files': None}
-
-    def _initialise_global_space(self, global_space):
-        """ Modify the provided global_space so that file, open and raw_input are redefined
-        to use our methods instead.
-        """
-        self._console.globals(global_space)
-        self._current_filespace_copy = self._filespace.copy()
-        global_space['file'] = lambda filename, mode='r', bufsize=-1: self._current_filespace_copy.openfile(filename, mode)
-        global_space['open'] = global_space['file']
-        global_space['raw_input'] = lambda x=None: raw_input()
-        return global_space
-
-    def _run_function(self, function, args, kwargs, code):
-        """ Run the provided function with the provided stdin, capturing stdout and stderr
-        and the return value.
-        Return all the output data.
-        code: The full text of the code, which needs to be stored as part of
-        the returned dictionary.
-        """
-        s_args = map(repr, args)
-        s_kwargs = dict(zip(kwargs.keys(), map(repr, kwargs.values())))
-        call = self._console.call(function, *s_args, **s_kwargs)
-
-        exception_name = None
-        if 'exception' in call:
-            exception = call['exception']['except']
-            exception_name = type(exception).__name__
-            raise(exception)
+        if self._function is not None:
+            if not run['function_found']:
+                raise FunctionNotFoundError(self._function)
+            # Only exceptions from the function itself are of interest.
+            exception_name = None
 
         return {'code': code,
-                'result': call['result'],
+                'result': run['result'],
                 'exception': exception_name,
-                'stdout': self._console.stdout.read(),
-                'stderr': self._console.stderr.read(),
+                'stdout': run['stdout'],
+                'stderr': run['stderr'],
                 'modified_files': None}
 
+class SolutionCache:
+    """
+    The outputs of an exercise's solution, stored in the database.
+
+    Outputs are keyed by a hash of everything that affects them, and are
+    dropped when the exercise is edited.
+    """
+    def __init__(self, store, exercise):
+        self._store = store
+        self._exercise_id = exercise.id
+
+    def key(self, *parts):
+        return unicode(hashlib.sha1(repr(parts)).hexdigest())
+
+    def get(self, key):
+        output = self._store.get(ExerciseSolutionOutput,
+                                 (self._exercise_id, key))
+        if output is None:
+            return None
+        return cPickle.loads(output.data)
+
+    def put(self, key, solution_data):
+        # Somebody else may be caching the same output, so don't let
+        # a collision break the surrounding transaction.
+        self._store.execute("SAVEPOINT solution_cache")
+        try:
+            self._store.execute(
+                "INSERT INTO exercise_solution_output (exerciseid, key, data) "
+                "VALUES (?, ?, ?)", (self._exercise_id, key,
+                cPickle.dumps(solution_data, cPickle.HIGHEST_PROTOCOL)),
+                noresult=True)
+        except IntegrityError:
+            self._store.execute("ROLLBACK TO SAVEPOINT solution_cache")
+        else:
+            self._store.execute("RELEASE SAVEPOINT solution_cache")
+
 class TestSuite:
     """
     The complete collection of test cases for a given exercise
@@ -617,8 +634,17 @@ class TestSuite:
         self._console = console
         self.add_include_code(exercise.include)
         
+        store = Store.of(exercise)
+        if store is not None:
+            solution_cache = SolutionCache(store, exercise)
+        else:
+            solution_cache = None
+
         for test_case in exercise.test_suites:
             new_case = TestCase(console, test_case)
+            if solution_cache is not None:
+                new_case.set_solution_cache(solution_cache,
+                                            self._include_code)
             self.add_case(new_case)
 
     def has_solution(self):
@@ -656,10 +682,15 @@ class TestSuite:
         exercise_dict = {}
         exercise_dict['name'] = self._name
         
+        # Get all of the solution's outputs before the attempt gets a chance
+        # to interfere with the console.
+        solution_data = [test.run_solution(self._solution)
+                         for test in self._tests]
+
         test_case_results = []
         passed = True
-        for test in self._tests:
-            result_dict = test.run(self._solution, attempt_code, self._include_space)
+        for (test, data) in zip(self._tests, solution_data):
+            result_dict = test.run(data, attempt_code, self._include_space)
             if 'exception' in result_dict and result_dict['exception']['critical']:
                 # critical error occured, running more cases is useless
                 # FunctionNotFound, Syntax, Indentation
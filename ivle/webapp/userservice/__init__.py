@@ -290,7 +290,7 @@ def handle_get_project_groups(req, fields):
 
     offering = req.store.get(ivle.database.Offering, offeringid)
 
-    if 'admin_groups' not in offering.get_permissions(req.user, req.config):
+    if 'admin_groups' not in req.get_permissions(offering):
         raise Unauthorized()
 
     dict_projectsets = []
@@ -339,8 +339,7 @@ def handle_create_group(req, fields):
         raise BadRequest("Invalid projectsetid")
     if not projectset.is_group:
         raise BadRequest("Not a group project set")
-    if 'admin_groups' not in projectset.offering.get_permissions(
-        req.user, req.config):
+    if 'admin_groups' not in req.get_permissions(projectset.offering):
         raise Unauthorized()
 
     # Get optional fields
@@ -411,7 +410,7 @@ def handle_get_group_membership(req, fields):
         raise BadRequest("offeringid must be an integer")
     offering = req.store.get(ivle.database.Offering, offeringid)
 
-    if 'admin_groups' not in offering.get_permissions(req.user, req.config):
+    if 'admin_groups' not in req.get_permissions(offering):
         raise Unauthorized()
 
     offeringmembers = [{'login': user.login,
@@ -452,8 +451,7 @@ def handle_assign_group(req, fields):
     group = req.store.get(ivle.database.ProjectGroup, int(groupid))
     user = ivle.database.User.get_by_login(req.store, login)
 
-    if 'admin_groups' not in group.project_set.offering.get_permissions(
-        req.user, req.config):
+    if 'admin_groups' not in req.get_permissions(group.project_set.offering):
         raise Unauthorized()
 
     # Add membership to database
@@ -499,8 +497,7 @@ def handle_unassign_group(req, fields):
     group = req.store.get(ivle.database.ProjectGroup, int(groupid))
     user = ivle.database.User.get_by_login(req.store, login)
 
-    if 'admin_groups' not in group.project_set.offering.get_permissions(
-        req.user, req.config):
+    if 'admin_groups' not in req.get_permissions(group.project_set.offering):
         raise Unauthorized()
 
     # Remove membership from the database
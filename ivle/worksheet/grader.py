@@ -0,0 +1,413 @@
+# IVLE - Informatics Virtual Learning Environment
+# Copyright (C) 2007-2010 The University of Melbourne
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Exercise Grading Service
+
+Runs exercise submissions against their test suites on a fixed set of
+worker threads, reusing each user's console between submissions rather
+than starting a new one every time. The grading-server service exposes a
+Grader over ivle.chat; the web application talks to it with submit_job and
+get_job.
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from storm.exceptions import OperationalError
+
+import ivle.chat
+import ivle.console
+import ivle.database
+from ivle.database import ExerciseAttempt, User, WorksheetExercise
+import ivle.worksheet.utils
+
+__all__ = ['GraderError', 'GraderBusy', 'Grader', 'submit_job', 'get_job',
+           'wait_for_job']
+
+# How many times to retry recording an attempt when its transaction can't be
+# serialized with another, and the PostgreSQL error codes meaning so
+# (serialization_failure and deadlock_detected).
+RECORD_RETRIES = 3
+SERIALIZATION_FAILURES = ('40001', '40P01')
+
+class GraderError(Exception):
+    """The grading service failed to grade a submission."""
+    pass
+
+class GraderBusy(GraderError):
+    """The grading service has too many submissions queued."""
+    pass
+
+class GradingJob(object):
+    """A submission waiting to be, being, or having been graded."""
+    def __init__(self, user_id, ws_ex_id, code):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.ws_ex_id = ws_ex_id
+        self.code = code
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        job = {'job': self.id, 'state': self.state}
+        if self.state == 'done':
+            job['result'] = self.result
+        elif self.state == 'failed':
+            job['error'] = self.error
+        return job
+
+class Grader(object):
+    """A queue of grading jobs and the workers that run them.
+
+    At most `workers` jobs run at once, and at most `max_per_user` of those
+    for any one user. A user may have at most `max_queued` jobs waiting.
+
+    Consoles run as their user inside that user's jail, so a runner can't
+    be shared between users. Instead each worker leaves its console idle
+    for the user's next job, reset to a clean state, keeping at most
+    `runners` idle consoles in total.
+    """
+    def __init__(self, config, workers=None, max_per_user=None,
+                 max_queued=None, runners=None):
+        self.config = config
+        gconfig = config['grading']
+        self.workers = workers or gconfig['workers']
+        self.max_per_user = max_per_user or gconfig['max_per_user']
+        self.max_queued = max_queued or gconfig['max_queued']
+        self.max_runners = runners or gconfig['runners']
+        self.max_idle = config['console']['pool_max_age']
+        self.job_ttl = gconfig['job_ttl']
+
+        self.cond = threading.Condition()
+        self.jobs = {}
+        self.pending = []
+        self.running = {}
+        # Maps a user ID to a list of (last used, Console) pairs.
+        self.idle_runners = {}
+        self.stopping = False
+        self.threads = []
+
+        self.completed = 0
+        self.failed = 0
+        self.runner_hits = 0
+        self.runner_misses = 0
+
+    def start(self):
+        """Start the worker threads."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Stop the workers once their current jobs finish, and close all
+        idle runners."""
+        self.cond.acquire()
+        try:
+            self.stopping = True
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+        for thread in self.threads:
+            thread.join()
+        for runners in self.idle_runners.values():
+            for (used, cons) in runners:
+                self._close_runner(cons)
+        self.idle_runners = {}
+
+    def submit(self, user_id, ws_ex_id, code):
+        """Queue a submission for grading, returning the new GradingJob."""
+        self.cond.acquire()
+        try:
+            self._expire_jobs()
+            queued = len([j for j in self.pending if j.user_id == user_id])
+            if queued >= self.max_queued:
+                raise GraderBusy("Too many submissions are waiting to be "
+                                 "graded.")
+            job = GradingJob(user_id, ws_ex_id, code)
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self.cond.notify()
+            return job
+        finally:
+            self.cond.release()
+
+    def get(self, job_id, user_id):
+        """Return the user's job with the given ID, or None."""
+        self.cond.acquire()
+        try:
+            job = self.jobs.get(job_id)
+            if job is None or job.user_id != user_id:
+                return None
+            return job
+        finally:
+            self.cond.release()
+
+    def stats(self):
+        """Return a dictionary of the grader's counters."""
+        self.cond.acquire()
+        try:
+            return {
+                'workers': self.workers,
+                'queued': len(self.pending),
+                'running': sum(self.running.values()),
+                'completed': self.completed,
+                'failed': self.failed,
+                'idle_runners': sum(len(r) for r in
+                                    self.idle_runners.values()),
+                'runner_hits': self.runner_hits,
+                'runner_misses': self.runner_misses,
+                }
+        finally:
+            self.cond.release()
+
+    def _expire_jobs(self):
+        """Forget finished jobs nobody has asked about for a while. The
+        condition must be held."""
+        now = time.time()
+        for job_id, job in self.jobs.items():
+            if job.finished is not None and now - job.finished > self.job_ttl:
+                del self.jobs[job_id]
+
+    def _next_job(self):
+        """Take the oldest pending job whose user is under their limit. The
+        condition must be held."""
+        for i, job in enumerate(self.pending):
+            if self.running.get(job.user_id, 0) < self.max_per_user:
+                del self.pending[i]
+                self.running[job.user_id] = \
+                    self.running.get(job.user_id, 0) + 1
+                job.state = 'running'
+                return job
+        return None
+
+    def _work(self):
+        store = ivle.database.get_store(self.config)
+        while True:
+            self.cond.acquire()
+            try:
+                job = self._next_job()
+                while job is None:
+                    if self.stopping:
+                        return
+                    self.cond.wait()
+                    job = self._next_job()
+            finally:
+                self.cond.release()
+
+            try:
+                job.result = self._grade(store, job)
+                job.state = 'done'
+            except Exception, e:
+                store.rollback()
+                logging.error('Grading job %s failed:\n%s' %
+                              (job.id, traceback.format_exc()))
+                job.error = str(e)
+                job.state = 'failed'
+
+            self.cond.acquire()
+            try:
+                job.finished = time.time()
+                job.code = None
+                self.running[job.user_id] -= 1
+                if not self.running[job.user_id]:
+                    del self.running[job.user_id]
+                if job.state == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                # A job held back by the per-user limit may now run.
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+
+    def _grade(self, store, job):
+        """Test the job's code, record the attempt and return the results.
+        """
+        # Start from a fresh transaction, so edits to the exercise are seen.
+        store.rollback()
+        user = store.get(User, job.user_id)
+        worksheet_exercise = store.get(WorksheetExercise, job.ws_ex_id)
+        if user is None or worksheet_exercise is None:
+            raise GraderError("Submission no longer exists.")
+
+        cons = self._take_runner(user)
+        try:
+            test_results = ivle.worksheet.utils.test_exercise_submission(
+                self.config, user, worksheet_exercise.exercise, job.code,
+                console=cons)
+        except:
+            self._close_runner(cons)
+            raise
+        self._release_runner(user, cons)
+
+        self._record_attempt(store, user, worksheet_exercise, job,
+                             test_results['passed'])
+
+        completed, attempts = ivle.worksheet.utils.get_exercise_status(
+                store, user, worksheet_exercise,
+                use_progress=self.config['tutorial']['use_progress_table'])
+        test_results["completed"] = completed
+        test_results["attempts"] = attempts
+        return test_results
+
+    def _record_attempt(self, store, user, worksheet_exercise, job, complete):
+        """Record and commit the job's attempt.
+
+        Recording an attempt updates the exercise's statistics, which other
+        workers (or other graders) may be updating at the same time for
+        other users. If so, PostgreSQL aborts the transaction and we try
+        again.
+        """
+        for retry in range(RECORD_RETRIES, -1, -1):
+            attempt = ExerciseAttempt(user=user,
+                worksheet_exercise=worksheet_exercise,
+                date=datetime.datetime.fromtimestamp(job.submitted),
+                complete=complete,
+                active=True,
+                text=unicode(job.code))
+            try:
+                ivle.worksheet.utils.record_exercise_attempt(store, attempt)
+                store.commit()
+                return
+            except OperationalError, e:
+                store.rollback()
+                if not retry or getattr(e, 'pgcode', None) not in \
+                   SERIALIZATION_FAILURES:
+                    raise
+
+    def _take_runner(self, user):
+        """Return a clean console for the user, reusing an idle one if we
+        can."""
+        while True:
+            cons = None
+            self.cond.acquire()
+            try:
+                runners = self.idle_runners.get(user.id)
+                if runners:
+                    used, cons = runners.pop()
+                    if not runners:
+                        del self.idle_runners[user.id]
+            finally:
+                self.cond.release()
+
+            if cons is None:
+                break
+            if time.time() - used >= self.max_idle:
+                self._close_runner(cons)
+                continue
+            try:
+                cons.reset(os.path.join('/home', user.login))
+            except (ivle.console.ConsoleError,
+                    ivle.console.ConsoleException, socket.error):
+                # It has died (eg. from CPU limits). Try the next.
+                self._close_runner(cons)
+                continue
+            self._count_runner(hit=True)
+            return cons
+
+        self._count_runner(hit=False)
+        jail_path = os.path.join(self.config['paths']['jails']['mounts'],
+                                 user.login)
+        return ivle.console.Console(self.config, user, jail_path,
+                                    os.path.join('/home', user.login))
+
+    def _count_runner(self, hit):
+        self.cond.acquire()
+        try:
+            if hit:
+                self.runner_hits += 1
+            else:
+                self.runner_misses += 1
+        finally:
+            self.cond.release()
+
+    def _release_runner(self, user, cons):
+        """Keep a console idle for the user's next job, closing the least
+        recently used console if there are too many."""
+        evicted = None
+        self.cond.acquire()
+        try:
+            self.idle_runners.setdefault(user.id, []).append(
+                (time.time(), cons))
+            if sum(len(r) for r in self.idle_runners.values()) > \
+               self.max_runners:
+                oldest = min(self.idle_runners.keys(),
+                             key=lambda k: self.idle_runners[k][0][0])
+                used, evicted = self.idle_runners[oldest].pop(0)
+                if not self.idle_runners[oldest]:
+                    del self.idle_runners[oldest]
+        finally:
+            self.cond.release()
+        if evicted is not None:
+            self._close_runner(evicted)
+
+    def _close_runner(self, cons):
+        try:
+            cons.close()
+        except (ivle.console.ConsoleError, socket.error):
+            pass
+
+
+def _chat(config, msg):
+    response = ivle.chat.chat(config['grading']['host'],
+                              config['grading']['port'],
+                              msg,
+                              config['grading']['magic'],
+                              )
+    if response.get('response') == 'busy':
+        raise GraderBusy(response.get('message'))
+    if response.get('response') != 'okay':
+        raise GraderError("Grading service failure: %s" % str(response))
+    return response
+
+def submit_job(config, user, worksheet_exercise, code):
+    """Queue a submission with the grading service, returning its job
+    dictionary ({'job': ..., 'state': ...})."""
+    return _chat(config, {'submit': {'user_id': user.id,
+                                     'ws_ex_id': worksheet_exercise.id,
+                                     'code': code}})['job']
+
+def get_job(config, user, job_id):
+    """Return the job dictionary of one of the user's grading jobs, or None
+    if there is no such job."""
+    return _chat(config, {'status': {'user_id': user.id,
+                                     'job': job_id}})['job']
+
+def wait_for_job(config, user, job, timeout):
+    """Poll a job until it finishes or timeout seconds pass, returning the
+    latest job dictionary."""
+    deadline = time.time() + timeout
+    delay = 0.05
+    while job['state'] in ('queued', 'running') and time.time() < deadline:
+        time.sleep(min(delay, max(0, deadline - time.time())))
+        delay = min(delay * 2, 0.5)
+        job = get_job(config, user, job['job'])
+        if job is None:
+            raise GraderError("Grading job has been lost.")
+    return job
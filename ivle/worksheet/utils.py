@@ -25,36 +25,53 @@ This module provides functions for tutorial and worksheet computations.
 
 import os.path
 
-from storm.locals import And, Asc, Desc, Store
+from storm.locals import And, Asc, Desc, Store, ClassAlias
+from storm.expr import Count, Max, Min, Select
 import genshi
 
 import ivle.database
-from ivle.database import ExerciseAttempt, ExerciseSave, Worksheet, \
-                          WorksheetExercise, Exercise, User
+from ivle.database import ExerciseAttempt, ExerciseProgress, ExerciseSave, \
+                          ExerciseStatistics, ExerciseSuccessCount, \
+                          Worksheet, WorksheetExercise, Exercise, User
 import ivle.webapp.tutorial.test
 
 __all__ = ['ExerciseNotFound', 'get_exercise_status',
-           'get_exercise_statistics',
+           'get_exercise_statuses', 'get_exercise_statistics',
            'get_exercise_stored_text', 'get_exercise_attempts',
-           'get_exercise_attempt', 'test_exercise_submission',
+           'get_exercise_attempt', 'get_worksheet_exercise_states',
+           'test_exercise_submission',
+           'record_exercise_attempt', 'set_exercise_attempt_active',
+           'refresh_exercise_progress', 'refresh_exercise_statistics',
+           'get_worksheet_exercise_statistics', 'median_attempts',
           ]
 
 class ExerciseNotFound(Exception):
     pass
 
-def get_exercise_status(store, user, worksheet_exercise, as_of=None):
+def get_exercise_status(store, user, worksheet_exercise, as_of=None,
+                        use_progress=False):
     """Given a storm.store, User and Exercise, returns information about
     the user's performance on that problem.
     @param store: A storm.store
     @param user: A User.
     @param worksheet_exercise: An Exercise.
     @param as_of: Optional datetime. If supplied, gets the status as of as_of.
+    @param use_progress: If True, read the status from the user's
+        ExerciseProgress where it can answer the question, rather than
+        counting attempts.
     Returns a tuple of:
         - A boolean, whether they have successfully passed this exercise.
         - An int, the number of attempts they have made up to and
           including the first successful attempt (or the total number of
           attempts, if not yet successful).
     """
+    if use_progress:
+        progress = store.get(ExerciseProgress,
+                             (worksheet_exercise.id, user.id))
+        status = _status_from_progress(progress, as_of)
+        if status is not None:
+            return status
+
     # A Storm expression denoting all active attempts by this user for this
     # exercise.
     is_relevant = ((ExerciseAttempt.user_id == user.id) &
@@ -83,10 +100,20 @@ def get_exercise_status(store, user, worksheet_exercise, as_of=None):
 
     return first_success is not None, num_attempts
 
-def get_exercise_statistics(store, worksheet_exercise):
+def get_exercise_statistics(store, worksheet_exercise, use_progress=False):
     """Return statistics about an exercise (with respect to a given
     worksheet).
-    (number of students completed, number of students attempted)."""
+    (number of students completed, number of students attempted).
+
+    If use_progress is True, they are read from ExerciseStatistics, which
+    only counts active attempts.
+    """
+    if use_progress:
+        statistics = store.get(ExerciseStatistics, worksheet_exercise.id)
+        if statistics is None:
+            return 0, 0
+        return statistics.completed, statistics.attempted
+
     # Count the set of Users whose ID matches an attempt in this worksheet
     num_completed = store.find(User, User.id == ExerciseAttempt.user_id,
         ExerciseAttempt.ws_ex_id == worksheet_exercise.id,
@@ -130,6 +157,87 @@ def get_exercise_stored_text(store, user, worksheet_exercise):
         else:
             return None
 
+def get_worksheet_exercise_states(store, user, worksheet, statistics=False,
+                                  use_progress=False):
+    """Load everything needed to present each of a worksheet's exercises to
+    a user, in a fixed number of queries however many exercises there are.
+    @param store: A storm.store
+    @param user: A User.
+    @param worksheet: A Worksheet.
+    @param statistics: If True, also get the get_exercise_statistics of
+        each exercise.
+    @param use_progress: As for get_exercise_statuses, and read the
+        statistics from ExerciseStatistics.
+    Returns a dict mapping each exercise identifier in the worksheet to a
+    dict of:
+        - 'worksheet_exercise': The WorksheetExercise.
+        - 'exercise': The Exercise.
+        - 'save': The get_exercise_stored_text of the user, or None.
+        - 'complete', 'attempts': The get_exercise_status of the user.
+        - 'stats': The get_exercise_statistics, or None.
+    """
+    states = {}
+    for (worksheet_exercise, exercise) in store.find(
+            (WorksheetExercise, Exercise),
+            WorksheetExercise.worksheet_id == worksheet.id,
+            WorksheetExercise.exercise_id == Exercise.id):
+        states[exercise.id] = {'worksheet_exercise': worksheet_exercise,
+                               'exercise': exercise,
+                               'save': None,
+                               'complete': False,
+                               'attempts': 0,
+                               'stats': None}
+    if not states:
+        return states
+    by_id = dict((state['worksheet_exercise'].id, state)
+                 for state in states.values())
+    ws_ex_ids = by_id.keys()
+
+    # The stored text is the user's save or latest active attempt,
+    # whichever is more recent.
+    for saved in store.find(ExerciseSave, ExerciseSave.user_id == user.id,
+            ExerciseSave.ws_ex_id.is_in(ws_ex_ids)):
+        by_id[saved.ws_ex_id]['save'] = saved
+    Latest = ClassAlias(ExerciseAttempt)
+    latest_date = Select(Max(Latest.date),
+        (Latest.user_id == ExerciseAttempt.user_id) &
+        (Latest.ws_ex_id == ExerciseAttempt.ws_ex_id) &
+        (Latest.active == True), tables=Latest)
+    for attempt in store.find(ExerciseAttempt,
+            ExerciseAttempt.user_id == user.id,
+            ExerciseAttempt.ws_ex_id.is_in(ws_ex_ids),
+            ExerciseAttempt.active == True,
+            ExerciseAttempt.date == latest_date):
+        state = by_id[attempt.ws_ex_id]
+        if state['save'] is None or attempt.date >= state['save'].date:
+            state['save'] = attempt
+
+    for ((user_id, ws_ex_id), (complete, attempts)) in \
+            get_exercise_statuses(store, [user.id], ws_ex_ids,
+                                  use_progress=use_progress).items():
+        by_id[ws_ex_id]['complete'] = complete
+        by_id[ws_ex_id]['attempts'] = attempts
+
+    if statistics and use_progress:
+        for (ws_ex_id, stats) in get_worksheet_exercise_statistics(store,
+                ws_ex_ids, histograms=False).items():
+            by_id[ws_ex_id]['stats'] = (stats['completed'],
+                                        stats['attempted'])
+    elif statistics:
+        stats = dict((ws_ex_id, [0, 0]) for ws_ex_id in ws_ex_ids)
+        for (index, conditions) in enumerate(
+                [[ExerciseAttempt.complete == True], []]):
+            for (ws_ex_id, count) in store.find(
+                    (ExerciseAttempt.ws_ex_id,
+                     Count(ExerciseAttempt.user_id, distinct=True)),
+                    ExerciseAttempt.ws_ex_id.is_in(ws_ex_ids),
+                    *conditions).group_by(ExerciseAttempt.ws_ex_id):
+                stats[ws_ex_id][index] = count
+        for (ws_ex_id, (num_completed, num_attempted)) in stats.items():
+            by_id[ws_ex_id]['stats'] = (num_completed, num_attempted)
+
+    return states
+
 def _get_exercise_attempts(store, user, worksheet_exercise, as_of=None,
         allow_inactive=False):
     """Same as get_exercise_attempts, but doesn't convert Storm's iterator
@@ -189,7 +297,230 @@ def save_exercise(store, user, worksheet_exercise, text, date):
     saved.date = date
     saved.text = text
 
-def calculate_score(store, user, worksheet, as_of=None):
+def _status_from_progress(progress, as_of):
+    """Work out a get_exercise_status result from an ExerciseProgress (or
+    None, if there is none). Returns None if the progress can't say, which
+    is when as_of falls before both the first success and the last attempt.
+    """
+    if progress is None:
+        return False, 0
+    if progress.first_success is not None and (as_of is None or
+                                               as_of >= progress.first_success):
+        return True, progress.attempts_to_success
+    if progress.last_attempt is None or as_of is None or \
+       as_of >= progress.last_attempt:
+        return False, progress.total_attempts
+    return None
+
+def refresh_exercise_progress(store, user_id, ws_ex_id):
+    """Recompute a user's ExerciseProgress on a worksheet exercise from
+    their active attempts, returning it.
+
+    The ExerciseProgress is removed (and None returned) if there are no
+    active attempts.
+    """
+    is_relevant = ((ExerciseAttempt.user_id == user_id) &
+            (ExerciseAttempt.ws_ex_id == ws_ex_id) &
+            (ExerciseAttempt.active == True))
+    progress = store.get(ExerciseProgress, (ws_ex_id, user_id))
+    before = _statistics_key(progress)
+
+    total_attempts = store.find(ExerciseAttempt, is_relevant).count()
+    if not total_attempts:
+        if progress is not None:
+            store.remove(progress)
+        _update_exercise_statistics(store, ws_ex_id, before, None)
+        return None
+
+    if progress is None:
+        progress = ExerciseProgress(user_id=user_id, ws_ex_id=ws_ex_id)
+        store.add(progress)
+    progress.total_attempts = total_attempts
+    progress.last_attempt = store.find(ExerciseAttempt.date, is_relevant
+        ).order_by(Desc(ExerciseAttempt.date)).first()
+    progress.first_success = store.find(ExerciseAttempt.date, is_relevant,
+        ExerciseAttempt.complete == True
+        ).order_by(Asc(ExerciseAttempt.date)).first()
+    if progress.first_success is not None:
+        progress.attempts_to_success = store.find(ExerciseAttempt,
+            is_relevant,
+            ExerciseAttempt.date <= progress.first_success).count()
+    else:
+        progress.attempts_to_success = None
+    _update_exercise_statistics(store, ws_ex_id, before,
+                                _statistics_key(progress))
+    return progress
+
+def record_exercise_attempt(store, attempt):
+    """Add a new active ExerciseAttempt to the store, updating the user's
+    ExerciseProgress and the ExerciseStatistics in the same transaction.
+    """
+    store.add(attempt)
+    progress = store.get(ExerciseProgress,
+                         (attempt.ws_ex_id, attempt.user_id))
+    if progress is not None and progress.last_attempt is not None and \
+       attempt.date <= progress.last_attempt:
+        # Not the latest attempt, so the counts up to the first success may
+        # change. Start again.
+        return refresh_exercise_progress(store, attempt.user_id,
+                                         attempt.ws_ex_id)
+
+    before = _statistics_key(progress)
+    if progress is None:
+        progress = ExerciseProgress(user_id=attempt.user_id,
+                                    ws_ex_id=attempt.ws_ex_id,
+                                    total_attempts=0)
+        store.add(progress)
+    progress.total_attempts += 1
+    progress.last_attempt = attempt.date
+    if attempt.complete and progress.first_success is None:
+        progress.first_success = attempt.date
+        progress.attempts_to_success = progress.total_attempts
+    _update_exercise_statistics(store, attempt.ws_ex_id, before,
+                                _statistics_key(progress))
+    return progress
+
+def set_exercise_attempt_active(store, attempt, active):
+    """Activate or deactivate an ExerciseAttempt, updating the user's
+    ExerciseProgress and the ExerciseStatistics in the same transaction.
+    """
+    if attempt.active == active:
+        return
+    attempt.active = active
+    refresh_exercise_progress(store, attempt.user_id, attempt.ws_ex_id)
+
+def _statistics_key(progress):
+    """The part of an ExerciseProgress that ExerciseStatistics counts: None
+    if there is none, otherwise its attempts_to_success (or None) in a
+    tuple."""
+    if progress is None:
+        return None
+    return (progress.attempts_to_success,)
+
+def _update_exercise_statistics(store, ws_ex_id, before, after):
+    """Move one user's contribution to a worksheet exercise's statistics
+    from one _statistics_key to another."""
+    if before == after:
+        return
+    statistics = store.get(ExerciseStatistics, ws_ex_id)
+    if statistics is None:
+        statistics = ExerciseStatistics(ws_ex_id=ws_ex_id, attempted=0,
+                                        completed=0)
+        store.add(statistics)
+
+    for (key, change) in ((before, -1), (after, 1)):
+        if key is None:
+            continue
+        statistics.attempted += change
+        attempts = key[0]
+        if attempts is None:
+            continue
+        statistics.completed += change
+        count = store.get(ExerciseSuccessCount, (ws_ex_id, attempts))
+        if count is None:
+            count = ExerciseSuccessCount(ws_ex_id=ws_ex_id,
+                                         attempts=attempts, users=0)
+            store.add(count)
+        count.users += change
+        if count.users <= 0:
+            store.remove(count)
+
+    if statistics.attempted <= 0:
+        store.remove(statistics)
+
+def refresh_exercise_statistics(store, ws_ex_id):
+    """Recompute a worksheet exercise's ExerciseStatistics and
+    ExerciseSuccessCounts from its ExerciseProgress, returning the
+    statistics.
+
+    The ExerciseStatistics is removed (and None returned) if nobody has
+    attempted the exercise.
+    """
+    successes = dict(store.find(
+        (ExerciseProgress.attempts_to_success, Count()),
+        ExerciseProgress.ws_ex_id == ws_ex_id,
+        ExerciseProgress.first_success != None
+        ).group_by(ExerciseProgress.attempts_to_success))
+    for count in store.find(ExerciseSuccessCount,
+                            ExerciseSuccessCount.ws_ex_id == ws_ex_id):
+        if count.attempts in successes:
+            count.users = successes.pop(count.attempts)
+        else:
+            store.remove(count)
+    for (attempts, users) in successes.items():
+        store.add(ExerciseSuccessCount(ws_ex_id=ws_ex_id, attempts=attempts,
+                                       users=users))
+
+    attempted = store.find(ExerciseProgress,
+                           ExerciseProgress.ws_ex_id == ws_ex_id).count()
+    statistics = store.get(ExerciseStatistics, ws_ex_id)
+    if not attempted:
+        if statistics is not None:
+            store.remove(statistics)
+        return None
+    if statistics is None:
+        statistics = ExerciseStatistics(ws_ex_id=ws_ex_id)
+        store.add(statistics)
+    statistics.attempted = attempted
+    statistics.completed = store.find(ExerciseProgress,
+        ExerciseProgress.ws_ex_id == ws_ex_id,
+        ExerciseProgress.first_success != None).count()
+    return statistics
+
+def median_attempts(successes):
+    """Return the median number of attempts users took to complete an
+    exercise, given a list of (attempts, users) pairs in order of attempts,
+    or None if nobody has completed it."""
+    total = sum(users for (attempts, users) in successes)
+    if total == 0:
+        return None
+    # The middle one or two users' attempts, counting from 0.
+    middle = [(total - 1) // 2, total // 2]
+    values = []
+    seen = 0
+    for (attempts, users) in successes:
+        for position in middle:
+            if seen <= position < seen + users:
+                values.append(attempts)
+        seen += users
+    return sum(values) / float(len(values))
+
+def get_worksheet_exercise_statistics(store, worksheet_exercise_ids,
+                                      histograms=True):
+    """Read the ExerciseStatistics of many worksheet exercises at once.
+    @param store: A storm.store
+    @param worksheet_exercise_ids: A list of WorksheetExercise IDs.
+    @param histograms: If True, also read their ExerciseSuccessCounts.
+    Returns a dict mapping each worksheet exercise ID to a dict of:
+        - 'attempted', 'completed': The number of users who have attempted
+          and completed it.
+        - 'successes': A list of (attempts, users) pairs, the number of
+          users who first completed it on each attempt (if histograms).
+        - 'median': The median_attempts of the successes (if histograms).
+    """
+    worksheet_exercise_ids = list(worksheet_exercise_ids)
+    statistics = dict((ws_ex_id, {'attempted': 0, 'completed': 0,
+                                  'successes': [], 'median': None})
+                      for ws_ex_id in worksheet_exercise_ids)
+    if not worksheet_exercise_ids:
+        return statistics
+
+    for row in store.find(ExerciseStatistics,
+            ExerciseStatistics.ws_ex_id.is_in(worksheet_exercise_ids)):
+        statistics[row.ws_ex_id]['attempted'] = row.attempted
+        statistics[row.ws_ex_id]['completed'] = row.completed
+
+    if histograms:
+        for count in store.find(ExerciseSuccessCount,
+                ExerciseSuccessCount.ws_ex_id.is_in(worksheet_exercise_ids)
+                ).order_by(ExerciseSuccessCount.attempts):
+            statistics[count.ws_ex_id]['successes'].append(
+                (count.attempts, count.users))
+        for stats in statistics.values():
+            stats['median'] = median_attempts(stats['successes'])
+    return statistics
+
+def calculate_score(store, user, worksheet, as_of=None, use_progress=False):
     """
     Given a storm.store, User, Exercise and Worksheet, calculates a score for
     the user on the given worksheet.
@@ -197,6 +528,7 @@ def calculate_score(store, user, worksheet, as_of=None):
     @param user: A User.
     @param worksheet: A Worksheet.
     @param as_of: Optional datetime. If supplied, gets the score as of as_of.
+    @param use_progress: As for get_exercise_status.
     Returns a 4-tuple of ints, consisting of:
     (No. mandatory exercises completed,
      Total no. mandatory exercises,
@@ -214,7 +546,8 @@ def calculate_score(store, user, worksheet, as_of=None):
         worksheet = worksheet_exercise.worksheet
         optional = worksheet_exercise.optional
 
-        done, _ = get_exercise_status(store, user, worksheet_exercise, as_of)
+        done, _ = get_exercise_status(store, user, worksheet_exercise, as_of,
+                                      use_progress)
         # done is a bool, whether this student has completed that problem
         if optional:
             opt_total += 1
@@ -225,6 +558,129 @@ def calculate_score(store, user, worksheet, as_of=None):
 
     return mand_done, mand_total, opt_done, opt_total
 
+def get_exercise_statuses(store, user_ids, worksheet_exercise_ids,
+                          as_of=None, use_progress=False):
+    """Bulk version of get_exercise_status, for many users and exercises
+    at once, using three aggregate queries rather than two queries per pair.
+    @param store: A storm.store
+    @param user_ids: A list of User IDs.
+    @param worksheet_exercise_ids: A list of WorksheetExercise IDs.
+    @param as_of: Optional datetime. If supplied, gets the statuses as of
+        as_of.
+    @param use_progress: If True, read the statuses from ExerciseProgress
+        in one query, only counting attempts for the pairs it can't answer.
+    Returns a dict mapping (user ID, worksheet exercise ID) to the same
+    (completed, attempts) tuple as get_exercise_status. Pairs without any
+    active attempts are left out; their status is (False, 0).
+    """
+    user_ids = list(user_ids)
+    worksheet_exercise_ids = list(worksheet_exercise_ids)
+    if not user_ids or not worksheet_exercise_ids:
+        return {}
+    if not use_progress:
+        return _count_exercise_statuses(store, user_ids,
+                                        worksheet_exercise_ids, as_of)
+
+    statuses = {}
+    unanswered = set()
+    for progress in store.find(ExerciseProgress,
+            ExerciseProgress.user_id.is_in(user_ids),
+            ExerciseProgress.ws_ex_id.is_in(worksheet_exercise_ids)):
+        pair = (progress.user_id, progress.ws_ex_id)
+        status = _status_from_progress(progress, as_of)
+        if status is None:
+            unanswered.add(pair)
+        elif status[1] > 0:
+            statuses[pair] = status
+
+    if unanswered:
+        counted = _count_exercise_statuses(store,
+            set(user_id for (user_id, ws_ex_id) in unanswered),
+            set(ws_ex_id for (user_id, ws_ex_id) in unanswered), as_of)
+        for pair in unanswered:
+            if pair in counted:
+                statuses[pair] = counted[pair]
+    return statuses
+
+def _count_exercise_statuses(store, user_ids, worksheet_exercise_ids, as_of):
+    """Count the attempts behind get_exercise_statuses."""
+    is_relevant = (ExerciseAttempt.user_id.is_in(user_ids) &
+            ExerciseAttempt.ws_ex_id.is_in(worksheet_exercise_ids) &
+            (ExerciseAttempt.active == True))
+    if as_of is not None:
+        is_relevant &= ExerciseAttempt.date <= as_of
+    pair = (ExerciseAttempt.user_id, ExerciseAttempt.ws_ex_id)
+
+    # The total number of active attempts at each pair.
+    statuses = {}
+    for (user_id, ws_ex_id, count) in store.find(pair + (Count(),),
+            is_relevant).group_by(*pair):
+        statuses[(user_id, ws_ex_id)] = (False, count)
+
+    # Pairs with a successful attempt count only the attempts up to and
+    # including the first success.
+    Success = ClassAlias(ExerciseAttempt)
+    is_success = ((Success.user_id == ExerciseAttempt.user_id) &
+            (Success.ws_ex_id == ExerciseAttempt.ws_ex_id) &
+            (Success.active == True) & (Success.complete == True))
+    if as_of is not None:
+        is_success &= Success.date <= as_of
+    first_success = Select(Min(Success.date), is_success, tables=Success)
+    for (user_id, ws_ex_id, count) in store.find(pair + (Count(),),
+            is_relevant, ExerciseAttempt.date <= first_success
+            ).group_by(*pair):
+        statuses[(user_id, ws_ex_id)] = (True, count)
+
+    return statuses
+
+def calculate_scores(store, user_ids, worksheets, as_of=None,
+                     use_progress=False):
+    """Bulk version of calculate_score, for many users and worksheets at
+    once.
+    @param store: A storm.store
+    @param user_ids: A list of User IDs.
+    @param worksheets: A list of Worksheets.
+    @param as_of: Optional datetime. If supplied, gets the scores as of
+        as_of.
+    @param use_progress: As for get_exercise_statuses.
+    Returns a dict mapping (user ID, worksheet ID) to the same 4-tuple as
+    calculate_score.
+    """
+    user_ids = list(user_ids)
+    worksheet_ids = [worksheet.id for worksheet in worksheets]
+
+    # The active exercises of all the worksheets, in one query.
+    worksheet_exercises = {}
+    for (ws_ex_id, worksheet_id, optional) in store.find(
+            (WorksheetExercise.id, WorksheetExercise.worksheet_id,
+             WorksheetExercise.optional),
+            WorksheetExercise.worksheet_id.is_in(worksheet_ids),
+            WorksheetExercise.active == True):
+        worksheet_exercises.setdefault(worksheet_id, []).append(
+            (ws_ex_id, optional))
+
+    statuses = get_exercise_statuses(store, user_ids,
+        [ws_ex_id for exercises in worksheet_exercises.values()
+                  for (ws_ex_id, optional) in exercises],
+        as_of, use_progress)
+
+    scores = {}
+    for user_id in user_ids:
+        for worksheet_id in worksheet_ids:
+            mand_done = mand_total = opt_done = opt_total = 0
+            for (ws_ex_id, optional) in worksheet_exercises.get(
+                    worksheet_id, []):
+                done, _ = statuses.get((user_id, ws_ex_id), (False, 0))
+                if optional:
+                    opt_total += 1
+                    if done: opt_done += 1
+                else:
+                    mand_total += 1
+                    if done: mand_done += 1
+            scores[(user_id, worksheet_id)] = (mand_done, mand_total,
+                                               opt_done, opt_total)
+    return scores
+
 def calculate_mark(mand_done, mand_total):
     """Calculate a subject mark, given the result of all worksheets.
     @param mand_done: The total number of mandatory exercises completed by
@@ -299,11 +755,17 @@ def update_exerciselist(worksheet):
         worksheet_exercise.optional = optional
 
 
-def test_exercise_submission(config, user, exercise, code):
+def test_exercise_submission(config, user, exercise, code, console=None):
     """Test the given code against an exercise.
 
-    The code is run in a console process as the provided user.
+    The code is run in a console process as the provided user. If console is
+    given, it is used (and left running) instead of starting a new one.
     """
+    if console is not None:
+        exercise_obj = ivle.webapp.tutorial.test.parse_exercise_file(
+            exercise, console)
+        return exercise_obj.run_tests(code)
+
     # Start a console to run the tests on
     jail_path = os.path.join(config['paths']['jails']['mounts'],
                              user.login)
@@ -375,7 +837,8 @@ def create_list_of_fake_worksheets_and_stats(config, store, user, offering,
             # Calculate the user's score for this worksheet
             mand_done, mand_total, opt_done, opt_total = (
                 ivle.worksheet.utils.calculate_score(store, user, worksheet,
-                                                     as_of=as_of))
+                    as_of=as_of,
+                    use_progress=config['tutorial']['use_progress_table']))
             if opt_total > 0:
                 optional_message = " (excluding optional exercises)"
             else:
@@ -308,6 +308,7 @@ class InstallList(object):
         "services/diffservice",
         "services/svnlogservice",
         "services/usrmgt-server", # XXX: Should be in bin/
+        "services/grading-server",
     ]
 
     list_user_binaries = [
@@ -324,6 +325,7 @@ class InstallList(object):
         "bin/ivle-loadsampledata",
         "bin/ivle-mountallusers",
         "bin/ivle-refreshfilesystem",
+        "bin/ivle-refreshprogress",
         "bin/ivle-remakeuser",
         "bin/ivle-showenrolment",
     ]
@@ -0,0 +1,10 @@
+BEGIN;
+
+CREATE TABLE exercise_solution_output (
+    exerciseid  TEXT REFERENCES exercise (identifier) NOT NULL,
+    key         TEXT NOT NULL,
+    data        BYTEA NOT NULL,
+    PRIMARY KEY (exerciseid, key)
+);
+
+COMMIT;
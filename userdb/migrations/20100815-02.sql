@@ -0,0 +1,14 @@
+BEGIN;
+
+CREATE TABLE console_session (
+    sessionid   SERIAL PRIMARY KEY NOT NULL,
+    loginid     INT4 REFERENCES login (loginid) NOT NULL,
+    host        TEXT NOT NULL,
+    port        INT4 NOT NULL,
+    magic       TEXT NOT NULL,
+    started     TIMESTAMP NOT NULL,
+    UNIQUE (host, port)
+);
+CREATE INDEX console_session_loginid ON console_session (loginid);
+
+COMMIT;
@@ -0,0 +1,29 @@
+BEGIN;
+
+CREATE TABLE exercise_progress (
+    loginid             INT4 REFERENCES login (loginid) NOT NULL,
+    ws_ex_id            INT4 REFERENCES worksheet_exercise (ws_ex_id) NOT NULL,
+    first_success       TIMESTAMP,
+    attempts_to_success INT4,
+    total_attempts      INT4 NOT NULL DEFAULT 0,
+    last_attempt        TIMESTAMP,
+    PRIMARY KEY (loginid, ws_ex_id)
+);
+
+INSERT INTO exercise_progress (loginid, ws_ex_id, first_success,
+                               total_attempts, last_attempt)
+    SELECT loginid, ws_ex_id, MIN(CASE WHEN complete THEN date END),
+           COUNT(*), MAX(date)
+    FROM exercise_attempt
+    WHERE active
+    GROUP BY loginid, ws_ex_id;
+
+UPDATE exercise_progress SET attempts_to_success = (
+    SELECT COUNT(*) FROM exercise_attempt
+    WHERE exercise_attempt.loginid = exercise_progress.loginid
+      AND exercise_attempt.ws_ex_id = exercise_progress.ws_ex_id
+      AND exercise_attempt.active
+      AND exercise_attempt.date <= exercise_progress.first_success)
+WHERE first_success IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,29 @@
+BEGIN;
+
+CREATE INDEX exercise_progress_ws_ex_id ON exercise_progress (ws_ex_id);
+
+CREATE TABLE exercise_statistics (
+    ws_ex_id    INT4 PRIMARY KEY REFERENCES worksheet_exercise (ws_ex_id),
+    attempted   INT4 NOT NULL DEFAULT 0,
+    completed   INT4 NOT NULL DEFAULT 0
+);
+
+CREATE TABLE exercise_success_count (
+    ws_ex_id    INT4 REFERENCES worksheet_exercise (ws_ex_id) NOT NULL,
+    attempts    INT4 NOT NULL,
+    users       INT4 NOT NULL DEFAULT 0,
+    PRIMARY KEY (ws_ex_id, attempts)
+);
+
+INSERT INTO exercise_statistics (ws_ex_id, attempted, completed)
+    SELECT ws_ex_id, COUNT(*), COUNT(first_success)
+    FROM exercise_progress
+    GROUP BY ws_ex_id;
+
+INSERT INTO exercise_success_count (ws_ex_id, attempts, users)
+    SELECT ws_ex_id, attempts_to_success, COUNT(*)
+    FROM exercise_progress
+    WHERE first_success IS NOT NULL
+    GROUP BY ws_ex_id, attempts_to_success;
+
+COMMIT;
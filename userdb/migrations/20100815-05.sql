@@ -0,0 +1,18 @@
+BEGIN;
+
+-- Users' attempts at an exercise, and exercise statistics. (exercise_save's
+-- primary key already covers its (loginid, ws_ex_id) lookups.)
+CREATE INDEX exercise_attempt_loginid_ws_ex_id_active_date
+    ON exercise_attempt (loginid, ws_ex_id, active, date);
+CREATE INDEX exercise_attempt_ws_ex_id_loginid
+    ON exercise_attempt (ws_ex_id, loginid);
+
+-- The latest submission of each assessed.
+CREATE INDEX project_submission_assessedid_date_submitted
+    ON project_submission (assessedid, date_submitted);
+
+-- An offering's members in a role.
+CREATE INDEX enrolment_offeringid_role_active
+    ON enrolment (offeringid, role, active);
+
+COMMIT;
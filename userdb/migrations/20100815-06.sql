@@ -0,0 +1,15 @@
+BEGIN;
+
+-- Point each assessed at its latest submission, rather than finding it with
+-- a MAX(date_submitted) subquery every time. Project.submit keeps it up to
+-- date from now on.
+ALTER TABLE assessed ADD COLUMN latest_submissionid INT4
+    REFERENCES project_submission (submissionid);
+
+UPDATE assessed SET latest_submissionid = (
+    SELECT submissionid FROM project_submission
+    WHERE project_submission.assessedid = assessed.assessedid
+    ORDER BY date_submitted DESC, submissionid DESC
+    LIMIT 1);
+
+COMMIT;
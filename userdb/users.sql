@@ -175,12 +175,17 @@ CREATE TABLE enrolment (
     active      BOOL NOT NULL DEFAULT true,
     PRIMARY KEY (loginid,offeringid)
 );
+CREATE INDEX enrolment_offeringid_role_active
+    ON enrolment (offeringid, role, active);
 
 CREATE TABLE assessed (
     assessedid  SERIAL PRIMARY KEY NOT NULL,
     loginid     INT4 REFERENCES login (loginid),
     groupid     INT4 REFERENCES project_group (groupid),
     projectid   INT4 REFERENCES project (projectid) NOT NULL,
+    -- the most recent submission, kept by the application; references
+    -- project_submission, so its constraint is added after that table
+    latest_submissionid INT4,
     -- exactly one of loginid and groupid must be non-null
     CHECK ((loginid IS NOT NULL AND groupid IS NULL)
         OR (loginid IS NULL AND groupid IS NOT NULL))
@@ -206,6 +211,11 @@ CREATE TABLE project_submission (
     date_submitted TIMESTAMP NOT NULL,
     submitter   INT4 REFERENCES login (loginid) NOT NULL
 );
+CREATE INDEX project_submission_assessedid_date_submitted
+    ON project_submission (assessedid, date_submitted);
+
+ALTER TABLE assessed ADD FOREIGN KEY (latest_submissionid)
+    REFERENCES project_submission (submissionid);
 
 CREATE TABLE project_mark (
     assessedid  INT4 REFERENCES assessed (assessedid) NOT NULL,
@@ -263,6 +273,10 @@ CREATE TABLE exercise_attempt (
     active      BOOLEAN NOT NULL DEFAULT true,
     PRIMARY KEY (loginid, ws_ex_id, date)
 );
+CREATE INDEX exercise_attempt_loginid_ws_ex_id_active_date
+    ON exercise_attempt (loginid, ws_ex_id, active, date);
+CREATE INDEX exercise_attempt_ws_ex_id_loginid
+    ON exercise_attempt (ws_ex_id, loginid);
 
 CREATE TABLE exercise_save (
     loginid     INT4 REFERENCES login (loginid) NOT NULL,
@@ -307,4 +321,46 @@ CREATE TABLE test_case_part (
     data            TEXT,
     filename        TEXT
 );
+
+CREATE TABLE exercise_solution_output (
+    exerciseid  TEXT REFERENCES exercise (identifier) NOT NULL,
+    key         TEXT NOT NULL,
+    data        BYTEA NOT NULL,
+    PRIMARY KEY (exerciseid, key)
+);
+
+CREATE TABLE console_session (
+    sessionid   SERIAL PRIMARY KEY NOT NULL,
+    loginid     INT4 REFERENCES login (loginid) NOT NULL,
+    host        TEXT NOT NULL,
+    port        INT4 NOT NULL,
+    magic       TEXT NOT NULL,
+    started     TIMESTAMP NOT NULL,
+    UNIQUE (host, port)
+);
+CREATE INDEX console_session_loginid ON console_session (loginid);
+
+CREATE TABLE exercise_progress (
+    loginid             INT4 REFERENCES login (loginid) NOT NULL,
+    ws_ex_id            INT4 REFERENCES worksheet_exercise (ws_ex_id) NOT NULL,
+    first_success       TIMESTAMP,
+    attempts_to_success INT4,
+    total_attempts      INT4 NOT NULL DEFAULT 0,
+    last_attempt        TIMESTAMP,
+    PRIMARY KEY (loginid, ws_ex_id)
+);
+CREATE INDEX exercise_progress_ws_ex_id ON exercise_progress (ws_ex_id);
+
+CREATE TABLE exercise_statistics (
+    ws_ex_id    INT4 PRIMARY KEY REFERENCES worksheet_exercise (ws_ex_id),
+    attempted   INT4 NOT NULL DEFAULT 0,
+    completed   INT4 NOT NULL DEFAULT 0
+);
+
+CREATE TABLE exercise_success_count (
+    ws_ex_id    INT4 REFERENCES worksheet_exercise (ws_ex_id) NOT NULL,
+    attempts    INT4 NOT NULL,
+    users       INT4 NOT NULL DEFAULT 0,
+    PRIMARY KEY (ws_ex_id, attempts)
+);
 COMMIT;